@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Time of compare_images against the full resolution comparison it replaced, over a generated set of cover images.
+
+The fixtures stand in for third-party cover candidates: the original cover re-encoded as JPEGs of other sizes and
+qualities, which should match, and unrelated covers, which shouldn't:
+
+    python3 benchmarks/cover_compare.py --resolution 3000
+"""
+
+import argparse
+import math
+import operator
+import os
+import random
+import sys
+import tempfile
+import time
+from functools import reduce
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+# Add parent directory to Python path to allow importing modules
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
+
+from utils.utils import compare_images
+
+
+def compare_images_full_resolution(image_1, image_2):
+    # compare_images before the thumbnail comparison, which only works for images of the same resolution
+    with Image.open(image_1) as im1, Image.open(image_2) as im2:
+        h = ImageChops.difference(im1, im2).convert('L').histogram()
+        return math.sqrt(reduce(operator.add, map(lambda h, i: h*(i**2), h, range(256))) / (float(im1.size[0]) * im1.size[1]))
+
+
+def generate_cover(seed, resolution):
+    # Some large shapes on a gradient, blurred a little, so the covers compress like artwork rather than noise
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize((resolution, resolution)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(resolution), rng.randrange(resolution)
+        size = rng.randrange(resolution // 10, resolution // 2)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)((x - size, y - size, x + size, y + size), fill=colour)
+    return image.filter(ImageFilter.GaussianBlur(resolution / 500))
+
+
+def generate_fixtures(directory, resolution, count):
+    original = generate_cover(0, resolution)
+    default = os.path.join(directory, 'default.jpg')
+    original.save(default, quality=95)
+    candidates = []  # (location, should match)
+    for i in range(count):
+        location = os.path.join(directory, f'same_{i}.jpg')
+        # Half of the matching candidates keep the resolution, so the old comparison can also be timed on them
+        size = resolution if i % 2 == 0 else resolution * (i + 2) // (count + 2)
+        original.resize((size, size), Image.Resampling.LANCZOS).save(location, quality=70 + i % 3 * 10)
+        candidates.append((location, True))
+        location = os.path.join(directory, f'other_{i}.jpg')
+        generate_cover(i + 1, resolution).save(location, quality=90)
+        candidates.append((location, False))
+    return default, candidates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cover comparison of the third-party covers path')
+    parser.add_argument('--resolution', type=int, default=3000, help='Resolution of the fixture covers')
+    parser.add_argument('--candidates', type=int, default=4, help='Matching and unrelated candidates each')
+    parser.add_argument('--threshold', type=float, default=8, help='RMS below which a candidate matches, as cover_variance_threshold')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        default, candidates = generate_fixtures(directory, args.resolution, args.candidates)
+        timings = {'full resolution': [], 'compare_images': []}
+        for location, should_match in candidates:
+            with Image.open(location) as im:
+                same_resolution = im.size[0] == args.resolution
+            results = []
+            for name, compare in (('full resolution', compare_images_full_resolution), ('compare_images', compare_images)):
+                if compare is compare_images_full_resolution and not same_resolution:
+                    results.append('-')
+                    continue
+                start = time.perf_counter()
+                rms = compare(default, location)
+                timings[name].append(time.perf_counter() - start)
+                results.append(f'{rms:.2f}')
+                if compare is compare_images:
+                    assert (rms < args.threshold) == should_match, f'{os.path.basename(location)} matched wrongly, RMS {rms:.2f}'
+            print(f'{os.path.basename(location)}: RMS full resolution {results[0]}, compare_images {results[1]}')
+
+    for name, values in timings.items():
+        print(f'{name}: {sum(values) / len(values) * 1000:.1f} ms per comparison')
+
+
+if __name__ == '__main__':
+    main()
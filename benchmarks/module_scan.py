@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Time of Orpheus.read_module_information without (cold) and with (cached) the module cache.
+
+Every measurement runs in a fresh interpreter, so imports of earlier runs don't count. The installed modules are
+scanned, or with --synthetic N that many generated modules whose interface.py imports some heavy standard library
+packages, standing in for the protobuf and crypto dependencies of real modules:
+
+    python3 benchmarks/module_scan.py --synthetic 8
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+synthetic_interface = '''import asyncio, decimal, email.mime.multipart, http.cookiejar, json, sqlite3, unittest, xml.dom.minidom
+from utils.models import *
+
+module_information = ModuleInformation(
+    service_name = 'Synthetic {index}',
+    module_supported_modes = ModuleModes.download,
+    netlocation_constant = 'synthetic{index}'
+)
+'''
+
+# Runs in the OrpheusDL root (or a copy of it with synthetic modules), prints the seconds the scan took
+scan = '''import os, sys, time
+sys.path.insert(0, os.getcwd())
+from orpheus.core import Orpheus
+orpheus = Orpheus.__new__(Orpheus)
+orpheus.module_cache_location = sys.argv[1]
+module_list = sorted(i for i in os.listdir('modules') if os.path.isfile(os.path.join('modules', i, 'interface.py')))
+started = time.perf_counter()
+orpheus.read_module_information(module_list)
+print(time.perf_counter() - started, len(module_list))
+'''
+
+
+def run_scan(root, cache_location):
+    output = subprocess.run([sys.executable, '-c', scan, cache_location], cwd=root, check=True, capture_output=True, text=True).stdout
+    seconds, modules = output.split()
+    return float(seconds), int(modules)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the module scan with and without the module cache')
+    parser.add_argument('--synthetic', type=int, default=0, help='Scan this many generated modules instead of the installed ones')
+    parser.add_argument('--runs', type=int, default=5, help='Measurements of each kind, the median is printed')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        root = parent_dir
+        if args.synthetic:
+            root = os.path.join(directory, 'root')
+            for package in ('orpheus', 'utils'):
+                shutil.copytree(os.path.join(parent_dir, package), os.path.join(root, package))
+            for index in range(args.synthetic):
+                os.makedirs(os.path.join(root, 'modules', f'synthetic{index}'))
+                with open(os.path.join(root, 'modules', f'synthetic{index}', 'interface.py'), 'w') as f:
+                    f.write(synthetic_interface.format(index=index))
+            open(os.path.join(root, 'modules', '__init__.py'), 'w').close()
+
+        cache_location = os.path.join(directory, 'modulecache.bin')
+        cold, cached = [], []
+        for _ in range(args.runs):
+            if os.path.exists(cache_location): os.remove(cache_location)
+            seconds, modules = run_scan(root, cache_location)
+            cold.append(seconds)
+            cached.append(run_scan(root, cache_location)[0])
+
+    if not modules:
+        sys.exit('No modules installed, use --synthetic N to scan generated ones')
+    cold_median, cached_median = statistics.median(cold), statistics.median(cached)
+    print(f'{modules} modules, cold: {cold_median * 1000:.1f} ms, cached: {cached_median * 1000:.1f} ms, '
+          f'{cold_median / cached_median:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
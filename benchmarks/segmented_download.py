@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Download time of a file over 1, 2, 4 and 8 connections from a local server that throttles every connection.
+
+Segmented downloads only help when a single connection is slower than the line, which the throttling stands in for:
+
+    python3 benchmarks/segmented_download.py --size 32 --throttle 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Add parent directory to Python path to allow importing modules
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
+
+from tests.file_server import FileServer
+from utils.utils import download_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark segmented downloads against a throttled local server')
+    parser.add_argument('--size', type=int, default=32, help='File size in MiB')
+    parser.add_argument('--throttle', type=float, default=4, help='Throughput of every connection in MiB/s')
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 2, 4, 8], help='Connection counts to compare')
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 1024 * 1024)
+    server = FileServer(data, throttle=args.throttle * 1024 * 1024).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for segments in args.segments:
+                location = os.path.join(directory, f'{segments}.bin')
+                start = time.perf_counter()
+                download_file(server.url, location, segments=segments)
+                elapsed = time.perf_counter() - start
+                with open(location, 'rb') as f:
+                    assert f.read() == data, 'downloaded file differs'
+                print(f'{segments} connection(s): {elapsed:.2f} s, {args.size / elapsed:.1f} MiB/s')
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
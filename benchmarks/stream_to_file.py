@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""CPU time per GB of the download loop, the 1 KiB iter_content loop download_file used before against _stream_to_file.
+
+Only the CPU time of the downloading thread is counted, the local server runs in other threads of the process:
+
+    python3 benchmarks/stream_to_file.py --size 512
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from tqdm import tqdm
+
+# Add parent directory to Python path to allow importing modules
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
+
+from tests.file_server import FileServer
+from utils.utils import download_file, r_session
+
+
+def download_1kib(url, file_location, progress_bar):
+    # The loop of download_file before the streaming writer
+    r = r_session.get(url, stream=True)
+    total = int(r.headers['content-length'])
+    with open(file_location, 'wb') as f:
+        if progress_bar:
+            bar = tqdm(total=total, unit='B', unit_scale=True, unit_divisor=1024, initial=0, miniters=1)
+            for chunk in r.iter_content(chunk_size=1024):
+                if chunk:
+                    f.write(chunk)
+                    bar.update(len(chunk))
+            bar.close()
+        else:
+            [f.write(chunk) for chunk in r.iter_content(chunk_size=1024) if chunk]
+
+
+def download_streamed(url, file_location, progress_bar):
+    download_file(url, file_location, enable_progress_bar=progress_bar)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the CPU time of the download loop')
+    parser.add_argument('--size', type=int, default=256, help='File size in MiB')
+    parser.add_argument('--progress-bar', action='store_true', help='Also draw the progress bar, as the command line does')
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 1024 * 1024)
+    server = FileServer(data).start()
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for name, download in (('1 KiB iter_content', download_1kib), ('_stream_to_file', download_streamed)):
+                location = os.path.join(directory, name.replace(' ', '_'))
+                cpu_started, wall_started = time.thread_time(), time.perf_counter()
+                download(server.url, location, args.progress_bar)
+                cpu, wall = time.thread_time() - cpu_started, time.perf_counter() - wall_started
+                assert os.path.getsize(location) == len(data), 'download is incomplete'
+                os.remove(location)
+                results[name] = cpu * 1024 / args.size
+                print(f'{name}: {results[name]:.2f} CPU s/GB, {wall:.2f} s for {args.size} MiB')
+    finally:
+        server.stop()
+    before, after = results.values()
+    print(f'{before / after:.1f}x less CPU time per GB')
+
+
+if __name__ == '__main__':
+    main()
@@ -22,7 +22,8 @@ def main():
             ''')
     
     help_ = 'Use "settings [option]" for orpheus controls (coreupdate, fullupdate, modinstall), "settings [module]' \
-           '[option]" for module specific options (update, test, setup), searching by "[search/luckysearch] [module]' \
+           '[option]" for module specific options (update, test, setup), "library reindex" to rebuild the index of ' \
+           'downloaded tracks from the files in the download path, searching by "[search/luckysearch] [module]' \
            '[track/artist/playlist/album] [query]", or just putting in urls. (you may need to wrap the URLs in double' \
            'quotes if you have issues downloading)'
     parser = argparse.ArgumentParser(description='Orpheus: modular music archival')
@@ -32,10 +33,21 @@ def main():
     parser.add_argument('-cv', '--covers', default='default', help='Override module to get covers from')
     parser.add_argument('-cr', '--credits', default='default', help='Override module to get credits from')
     parser.add_argument('-sd', '--separatedownload', default='default', help='Select a different module that will download the playlist instead of the main module. Only for playlists.')
+    parser.add_argument('-r', '--resume', help='Resume an interrupted download job by its ID, skipping its finished media and tracks')
     parser.add_argument('arguments', nargs='*', help=help_)
     args = parser.parse_args()
 
     orpheus = Orpheus(args.private)
+    if args.resume:
+        job = orpheus.journal.get_job(args.resume)
+        if not job:
+            unfinished_jobs = ', '.join(i.job_id for i in orpheus.journal.get_unfinished_jobs())
+            raise Exception(f'Unknown job "{args.resume}"' + (f', unfinished jobs: {unfinished_jobs}' if unfinished_jobs else ''))
+        if job.status == 'running' and not orpheus.journal.is_orphaned(job):
+            raise Exception(f'Job "{job.job_id}" is still running in process {job.owner_pid} on {job.owner_host}')
+        orpheus_core_download(orpheus, job_id=job.job_id, printer=oprinter, **job.request)
+        return
+
     if not args.arguments:
         parser.print_help()
         exit()
@@ -93,6 +105,14 @@ def main():
                 raise Exception(f'Unknown option {option}, choose add/delete/list/test')
         else:
             raise Exception(f'Unknown module {module}') # TODO: replace with InvalidModuleError
+    elif orpheus_mode == 'library':
+        option = args.arguments[1].lower() if len(args.arguments) > 1 else None
+        if option == 'reindex':
+            path = args.output if args.output else orpheus.settings['global']['general']['download_path']
+            indexed, removed = orpheus.library.reindex(path)
+            print(f'Library index rebuilt: {indexed!s} tracks indexed, {removed!s} missing tracks removed')
+        else:
+            raise Exception(f'Unknown library option {option}, choose reindex')
     else:
         path = args.output if args.output else orpheus.settings['global']['general']['download_path']
         if path[-1] == '/': path = path[:-1]  # removes '/' from end if it exists
@@ -217,7 +237,7 @@ def main():
         if not media_to_download:
             print('No links given')
 
-        orpheus_core_download(orpheus, media_to_download, tpm, sdm, path)
+        orpheus_core_download(orpheus, media_to_download, tpm, sdm, path, printer=oprinter)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
-import importlib, json, logging, os, pickle, requests, urllib3, base64, shutil
+import copy, dataclasses, hashlib, importlib, json, logging, os, pickle, requests, urllib3, base64, shutil, threading
 from datetime import datetime
 
+from orpheus.journal import JobJournal
+from orpheus.library import LibraryIndex
 from orpheus.music_downloader import Downloader
 from utils.models import *
 from utils.utils import *
@@ -20,7 +22,7 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)  # Make SSL
 #     print('System time is incorrect, using online time to correct it for subscription expiry checks')
 
 timestamp_correction_term = 0
-# Use the same Oprinter instance wherever it's needed
+# Use the same Oprinter instance wherever it's needed, except for the download jobs which each get their own
 oprinter = Oprinter()
 
 
@@ -36,7 +38,9 @@ class Orpheus:
             "general": {
                 "download_path": "./downloads/",
                 "download_quality": "hifi",
-                "search_limit": 10
+                "search_limit": 10,
+                "track_workers": 1,
+                "metadata_prefetch": 2
             },
             "artist_downloading":{
                 "return_credited_albums": True,
@@ -72,7 +76,8 @@ class Orpheus:
                 "external_format": 'png',
                 "external_compression": "low",
                 "external_resolution": 3000,
-                "save_animated_cover": True
+                "save_animated_cover": True,
+                "artwork_cache_size": 256
             },
             "playlist": {
                 "save_m3u": True,
@@ -91,18 +96,32 @@ class Orpheus:
                     }
                 },
                 "conversion_keep_original": False,
+                "conversion_workers": 0,
+                "conversion_backlog": 0,
+                "stream_conversions": False,
                 "cover_variance_threshold": 8,
                 "debug_mode": False,
                 "disable_subscription_checks": False,
                 "enable_undesirable_conversions": False,
                 "ignore_existing_files": False,
-                "ignore_different_artists": True
+                "ignore_different_artists": True,
+                "library_index": True,
+                "library_isrc_dedupe": False,
+                "segmented_download_connections": 4,
+                "segmented_download_min_size": 0,
+                "segmented_download_modules": [],
+                "connection_pool_size": 16
             }
         }
 
         self.data_folder_base = 'config'
         self.settings_location = os.path.join(self.data_folder_base, 'settings.json')
         self.session_storage_location = os.path.join(self.data_folder_base, 'loginstorage.bin')
+        self.module_cache_location = os.path.join(self.data_folder_base, 'modulecache.bin')
+        self.library = LibraryIndex(os.path.join(self.data_folder_base, 'library.db'))
+        self.journal = JobJournal(os.path.join(self.data_folder_base, 'jobs.db'))
+        # Jobs running in parallel threads must not load and log in to the same module twice
+        self.module_lock = threading.RLock()
 
         os.makedirs('config', exist_ok=True)
         self.settings = json.loads(open(self.settings_location, 'r').read()) if os.path.exists(self.settings_location) else {}
@@ -130,8 +149,9 @@ class Orpheus:
             exit()
         logging.debug('Orpheus: Modules detected: ' + ", ".join(module_list))
 
+        module_informations = self.read_module_information(module_list)
         for module in module_list:  # Loading module information into module_settings
-            module_information: ModuleInformation = getattr(importlib.import_module(f'modules.{module}.interface'), 'module_information', None)
+            module_information: ModuleInformation = module_informations[module]
             if module_information and not ModuleFlags.private in module_information.flags and not private_mode:
                 self.module_list.add(module)
                 self.module_settings[module] = module_information
@@ -161,6 +181,9 @@ class Orpheus:
         if duplicates: raise Exception('Multiple modules installed that connect to the same service names: ' + ', '.join(' and '.join(duplicates)))
 
         self.update_module_storage()
+        connection_pool.set_pool_size(self.settings['global']['advanced']['connection_pool_size'])
+        artwork_cache.location = os.path.join(self.data_folder_base, 'artwork')
+        artwork_cache.max_size = self.settings['global']['covers']['artwork_cache_size'] * 1024 ** 2
 
         for i in self.extension_list:
             extension_settings: ExtensionInformation = getattr(importlib.import_module(f'extensions.{i}.interface'), 'extension_settings', None)
@@ -176,7 +199,44 @@ class Orpheus:
         self.module_controls = {'module_list': self.module_list, 'module_settings': self.module_settings,
             'loaded_modules': self.loaded_modules, 'module_loader': self.load_module}
 
+    def read_module_information(self, module_list):
+        # Importing a module only to read its module_information also imports all of its dependencies, so the
+        # information is cached together with a hash of the interface.py it came from and reused until that changes
+        cache_version = tuple(i.name for i in dataclasses.fields(ModuleInformation))
+        try:
+            cache = pickle.load(open(self.module_cache_location, 'rb'))
+            if cache.get('version') != cache_version: cache = {}
+        except Exception:  # missing, corrupt or written by an incompatible version
+            cache = {}
+        cached_modules = cache.get('modules', {})
+
+        module_informations, new_cache = {}, {}
+        for module in module_list:
+            interface_hash = hashlib.sha256(open(f'modules/{module}/interface.py', 'rb').read()).hexdigest()
+            if module in cached_modules and cached_modules[module][0] == interface_hash:
+                module_informations[module] = cached_modules[module][1]
+            else:
+                module_informations[module] = getattr(importlib.import_module(f'modules.{module}.interface'), 'module_information', None)
+                logging.debug(f'Orpheus: {module} module information imported')
+            if module_informations[module]:
+                new_cache[module] = (interface_hash, module_informations[module])
+
+        if new_cache != cached_modules:
+            try:
+                temp_location = f'{self.module_cache_location}.{os.getpid()}.tmp'
+                with open(temp_location, 'wb') as f:
+                    pickle.dump({'version': cache_version, 'modules': new_cache}, f)
+                os.replace(temp_location, self.module_cache_location)
+            except Exception as e:  # the cache is only an optimisation
+                logging.debug(f'Orpheus: could not write the module cache: {e}')
+                silentremove(temp_location)
+        return module_informations
+
     def load_module(self, module: str):
+        with self.module_lock:
+            return self._load_module(module)
+
+    def _load_module(self, module: str):
         module = module.lower()
         if module not in self.module_list:
             raise Exception(f'"{module}" does not exist in modules.') # TODO: replace with InvalidModuleError
@@ -195,6 +255,7 @@ class Orpheus:
                     module_error = ModuleError, # DEPRECATED
                     get_current_timestamp = true_current_utc_timestamp,
                     printer_controller = oprinter,
+                    connection_pool = connection_pool,
                     orpheus_options = OrpheusOptions(
                         debug_mode = self.settings['global']['advanced']['debug_mode'],
                         quality_tier = QualityEnum[self.settings['global']['general']['download_quality'].upper()],
@@ -298,7 +359,9 @@ class Orpheus:
         new_settings['modules'] = module_settings
 
         ## Sessions
-        sessions = pickle.load(open(self.session_storage_location, 'rb')) if os.path.exists(self.session_storage_location) else {}
+        session_store = get_temporary_settings_store(self.session_storage_location)
+        with session_store.lock:
+            sessions = copy.deepcopy(session_store.load())
 
         if not ('advancedmode' in sessions and 'modules' in sessions and sessions['advancedmode'] == advanced_login_mode):
             sessions = {'advancedmode': advanced_login_mode, 'modules':{}}
@@ -347,7 +410,7 @@ class Orpheus:
                         if 'custom_data' in current_session and j in current_session['custom_data'] and not clear_session}
                 elif 'custom_data' in current_session: current_session.pop('custom_data')
 
-        pickle.dump({'advancedmode': advanced_login_mode, 'modules': new_module_sessions}, open(self.session_storage_location, 'wb'))
+        session_store.replace({'advancedmode': advanced_login_mode, 'modules': new_module_sessions})
         open(self.settings_location, 'w').write(json.dumps(new_settings, indent = 4, sort_keys = False))
 
         if new_setting_detected:
@@ -355,12 +418,72 @@ class Orpheus:
             exit()
 
 
-def orpheus_core_download(orpheus_session: Orpheus, media_to_download, third_party_modules, separate_download_module, output_path):
-    downloader = Downloader(orpheus_session.settings['global'], orpheus_session.module_controls, oprinter, output_path)
-    os.makedirs('temp', exist_ok=True)
-
+def orpheus_core_download(orpheus_session: Orpheus, media_to_download, third_party_modules, separate_download_module, output_path, job_id=None, control: JobControl = None, printer: Oprinter = None, progress_callback=None):
+    # Everything a job changes while it runs is scoped to it (downloader, printer, temp directory), so several jobs can
+    # run in parallel threads of the same process
+    printer = printer if printer else Oprinter()
+    downloader = Downloader(orpheus_session.settings['global'], orpheus_session.module_controls, printer, output_path)
+    downloader.library = orpheus_session.library
+    downloader.control = control
+    downloader.progress_callback = progress_callback  # Gets a DownloadProgress at every stage, see Downloader.report_progress
+
+    # Every download is a job in the journal, resuming one skips its finished media and tracks
+    journal = orpheus_session.journal
+    if job_id and journal.get_job(job_id):
+        journal.claim_job(job_id)
+    else:
+        job_id = journal.create_job(media_to_download, third_party_modules, separate_download_module, output_path, job_id)
+    journal.start_heartbeat(job_id)
+    downloader.journal, downloader.job_id = journal, job_id
+    downloader.temp_path = os.path.join('temp', job_id)
+    _start_job_temp(downloader.temp_path)
+    printer.oprint(f'Job {job_id}, use --resume {job_id} to continue it if it gets interrupted', drop_level=1)
+
+    try:
+        job_completed = _download_job_media(orpheus_session, downloader, journal, job_id, media_to_download, third_party_modules, separate_download_module)
+    except DownloadCancelledError:
+        journal.set_job_status(job_id, 'cancelled')
+        raise
+    except BaseException:
+        journal.set_job_status(job_id, 'failed')
+        raise
+    finally:
+        journal.stop_heartbeat(job_id)
+        _finish_job_temp(downloader.temp_path)
+    journal.set_job_status(job_id, 'completed' if job_completed else 'failed')
+
+    logging.debug(f'Orpheus: connection pools: {connection_pool.get_metrics()}')
+    logging.debug(f'Orpheus: third-party search cache: {downloader.search_cache.get_stats()}')
+
+
+def _start_job_temp(temp_path):
+    os.makedirs(temp_path, exist_ok=True)
+
+
+def _finish_job_temp(temp_path):
+    # Jobs of other threads and processes (the command line next to the web executor) share temp/, so every job only
+    # removes its own folder, and temp/ itself once it is empty
+    shutil.rmtree(temp_path, ignore_errors=True)
+    try:
+        os.rmdir('temp')
+    except OSError:
+        pass  # Still used by another job
+
+
+def _download_job_media(orpheus_session: Orpheus, downloader: Downloader, journal: JobJournal, job_id, media_to_download, third_party_modules, separate_download_module):
+    # Returns whether every media of the job completed without failed tracks
+    job_completed, media_index = True, 0
+    downloader.media_total = sum(len(items) for items in media_to_download.values())
     for mainmodule, items in media_to_download.items():
         for media in items:
+            media_index += 1
+            if journal.is_media_completed(job_id, media_index): continue
+            if downloader.control: downloader.control.check()
+            downloader.failed_tracks = set()
+            downloader.media_index = media_index
+            downloader.album_index, downloader.album_total = 0, 0
+            downloader.report_progress(DownloadStageEnum.media)
+
             if ModuleModes.download not in orpheus_session.module_settings[mainmodule].module_supported_modes:
                 raise Exception(f'{mainmodule} does not support track downloading') # TODO: replace with ModuleDoesNotSupportAbility
 
@@ -404,4 +527,8 @@ def orpheus_core_download(orpheus_session: Orpheus, media_to_download, third_par
                 else:
                     raise Exception(f'\tUnknown media type "{mediatype}"')
 
-    if os.path.exists('temp'): shutil.rmtree('temp')
\ No newline at end of file
+            journal.set_media_status(job_id, media_index, 'failed' if downloader.failed_tracks else 'completed')
+            downloader.report_progress(DownloadStageEnum.media_completed)
+            if downloader.failed_tracks: job_completed = False
+
+    return job_completed
\ No newline at end of file
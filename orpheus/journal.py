@@ -0,0 +1,158 @@
+import os, pickle, socket, threading, time, uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from utils.sqlite_store import SQLiteStore
+
+
+@dataclass
+class Job:
+    job_id: str
+    status: str  # running, failed, cancelled or completed
+    request: dict  # The orpheus_core_download arguments, see JobJournal.create_job
+    created: float
+    updated: float
+    owner_host: Optional[str] = None  # The host and process running the job, see JobJournal.is_orphaned
+    owner_pid: Optional[int] = None
+    heartbeat: Optional[float] = None
+
+
+@dataclass
+class JournalTrack:
+    track_id: str
+    status: str  # completed or failed
+    path: Optional[str] = None
+    name: Optional[str] = None
+    artist: Optional[str] = None
+    duration: Optional[int] = None
+
+
+# Seconds between the heartbeats of running jobs, a job that missed them for stale_after seconds counts as orphaned
+heartbeat_interval = 60
+stale_after = 5 * 60
+
+job_columns = 'job_id, status, request, created, updated, owner_host, owner_pid, heartbeat'
+
+
+class JobJournal(SQLiteStore):
+    # SQLite journal of job -> media -> track states, written as a job progresses so a crashed or restarted job can be
+    # resumed from its last unfinished track instead of starting over. Running jobs record the process running them
+    # and keep a heartbeat, so only jobs whose process is gone are resumed automatically
+    schema = '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY, status TEXT, request BLOB, created REAL, updated REAL,
+            owner_host TEXT, owner_pid INTEGER, heartbeat REAL
+        );
+        CREATE TABLE IF NOT EXISTS job_media (
+            job_id TEXT, media_index INTEGER, status TEXT,
+            PRIMARY KEY (job_id, media_index)
+        );
+        CREATE TABLE IF NOT EXISTS job_tracks (
+            job_id TEXT, service TEXT, track_id TEXT, status TEXT,
+            path TEXT, name TEXT, artist TEXT, duration INTEGER,
+            PRIMARY KEY (job_id, service, track_id)
+        );
+    '''
+    migrations = (
+        'ALTER TABLE jobs ADD COLUMN owner_host TEXT',
+        'ALTER TABLE jobs ADD COLUMN owner_pid INTEGER',
+        'ALTER TABLE jobs ADD COLUMN heartbeat REAL'
+    )
+
+    def __init__(self, location: str):
+        super().__init__(location)
+        self._running_jobs = set()  # Jobs of this process that get heartbeats
+        self._heartbeat_thread = None
+        self._heartbeat_lock = threading.Lock()
+
+    @staticmethod
+    def _to_job(row) -> Job:
+        return Job(row[0], row[1], pickle.loads(row[2]), *row[3:])
+
+    def create_job(self, media_to_download: dict, third_party_modules: dict, separate_download_module: str,
+                   output_path: str, job_id: Optional[str] = None) -> str:
+        # The request is pickled, the extra_kwargs of the modules can hold anything
+        job_id = job_id if job_id else uuid.uuid4().hex[:12]
+        request = dict(media_to_download=media_to_download, third_party_modules=third_party_modules,
+                       separate_download_module=separate_download_module, output_path=output_path)
+        now = time.time()
+        self._execute(f'INSERT OR REPLACE INTO jobs ({job_columns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                      (job_id, 'running', pickle.dumps(request), now, now, socket.gethostname(), os.getpid(), now))
+        return job_id
+
+    def claim_job(self, job_id: str):
+        # Marks an existing job as running in this process, when it's resumed
+        now = time.time()
+        self._execute('UPDATE jobs SET status = ?, updated = ?, owner_host = ?, owner_pid = ?, heartbeat = ? WHERE job_id = ?',
+                      ('running', now, socket.gethostname(), os.getpid(), now, job_id))
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        rows = self._select(f'SELECT {job_columns} FROM jobs WHERE job_id = ?', (job_id,))
+        return self._to_job(rows[0]) if rows else None
+
+    def get_unfinished_jobs(self) -> list:
+        rows = self._select(f"SELECT {job_columns} FROM jobs WHERE status != 'completed' ORDER BY created")
+        return [self._to_job(row) for row in rows]
+
+    def get_orphaned_jobs(self) -> list:
+        # Jobs that are still marked as running, but whose process stopped without finishing them
+        return [job for job in self.get_unfinished_jobs() if self.is_orphaned(job)]
+
+    def is_orphaned(self, job: Job) -> bool:
+        if job.status != 'running':
+            return False
+        if job.owner_host == socket.gethostname() and job.owner_pid is not None:
+            if job.owner_pid == os.getpid():
+                # Also covers a restarted container, where the new process can get the same PID as the old one
+                with self._heartbeat_lock:
+                    return job.job_id not in self._running_jobs
+            if os.name == 'posix':  # os.kill would stop the process on Windows instead of checking it
+                try:
+                    os.kill(job.owner_pid, 0)
+                except ProcessLookupError:
+                    return True
+                except PermissionError:
+                    pass  # Runs as another user
+        # Jobs of other hosts sharing the journal, or of processes that hang, only have their heartbeat to go by
+        return time.time() - (job.heartbeat or job.updated) > stale_after
+
+    def start_heartbeat(self, job_id: str):
+        with self._heartbeat_lock:
+            self._running_jobs.add(job_id)
+            if not self._heartbeat_thread:
+                self._heartbeat_thread = threading.Thread(target=self._send_heartbeats, daemon=True)
+                self._heartbeat_thread.start()
+
+    def stop_heartbeat(self, job_id: str):
+        with self._heartbeat_lock:
+            self._running_jobs.discard(job_id)
+
+    def _send_heartbeats(self):
+        # A single thread for all jobs of the process, it runs until the process stops
+        while True:
+            time.sleep(heartbeat_interval)
+            with self._heartbeat_lock:
+                job_ids = list(self._running_jobs)
+            now = time.time()
+            for job_id in job_ids:
+                self._execute('UPDATE jobs SET heartbeat = ? WHERE job_id = ? AND owner_pid = ?', (now, job_id, os.getpid()))
+
+    def set_job_status(self, job_id: str, status: str):
+        self._execute('UPDATE jobs SET status = ?, updated = ? WHERE job_id = ?', (status, time.time(), job_id))
+
+    def is_media_completed(self, job_id: str, media_index: int) -> bool:
+        rows = self._select('SELECT status FROM job_media WHERE job_id = ? AND media_index = ?', (job_id, media_index))
+        return bool(rows) and rows[0][0] == 'completed'
+
+    def set_media_status(self, job_id: str, media_index: int, status: str):
+        self._execute('INSERT OR REPLACE INTO job_media VALUES (?, ?, ?)', (job_id, media_index, status))
+
+    def get_track(self, job_id: str, service: str, track_id) -> Optional[JournalTrack]:
+        rows = self._select('SELECT track_id, status, path, name, artist, duration FROM job_tracks '
+                            'WHERE job_id = ? AND service = ? AND track_id = ?', (job_id, service, str(track_id)))
+        return JournalTrack(*rows[0]) if rows else None
+
+    def set_track_status(self, job_id: str, service: str, track_id, status: str, path: Optional[str] = None,
+                         name: Optional[str] = None, artist: Optional[str] = None, duration: Optional[int] = None):
+        self._execute('INSERT OR REPLACE INTO job_tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                      (job_id, service, str(track_id), status, path, name, artist, duration))
@@ -0,0 +1,147 @@
+import json, logging, os, time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import mutagen
+from mutagen.id3 import ID3
+from mutagen.mp4 import MP4
+
+from utils.models import ContainerEnum
+from utils.sqlite_store import SQLiteStore
+
+
+@dataclass
+class LibraryTrack:
+    path: str
+    service: Optional[str]
+    track_id: Optional[str]
+    isrc: Optional[str]
+    codec: Optional[str]
+    size: int
+    mtime: float
+    name: Optional[str] = None
+    artist: Optional[str] = None
+    duration: Optional[int] = None
+    # The download_quality setting and the codec the service sent before codec_conversions, None for tracks indexed
+    # before they were recorded or found by reindex
+    quality: Optional[str] = None
+    source_codec: Optional[str] = None
+
+
+@dataclass
+class ArtistAlbum:
+    album_id: str
+    name: str
+    complete: bool
+    track_ids: list = field(default_factory=list)
+    downloaded_track_ids: list = field(default_factory=list)  # The tracks of track_ids that have a file in the library
+
+
+# Same order as the LibraryTrack fields
+library_columns = 'path, service, track_id, isrc, codec, size, mtime, name, artist, duration, quality, source_codec'
+
+
+class LibraryIndex(SQLiteStore):
+    # SQLite index of every downloaded track, so known tracks can be skipped before asking the service about them and
+    # the same recording (ISRC) can be recognised across services. Paths are stored absolute
+    schema = '''
+        CREATE TABLE IF NOT EXISTS tracks (
+            path TEXT PRIMARY KEY, service TEXT, track_id TEXT, isrc TEXT, codec TEXT,
+            size INTEGER, mtime REAL, name TEXT, artist TEXT, duration INTEGER, quality TEXT, source_codec TEXT
+        );
+        CREATE INDEX IF NOT EXISTS tracks_service_track_id ON tracks (service, track_id);
+        CREATE INDEX IF NOT EXISTS tracks_isrc ON tracks (isrc);
+        CREATE TABLE IF NOT EXISTS artist_albums (
+            service TEXT, artist_id TEXT, album_id TEXT, name TEXT, complete INTEGER,
+            track_ids TEXT, downloaded_track_ids TEXT, updated REAL,
+            PRIMARY KEY (service, artist_id, album_id)
+        );
+    '''
+    migrations = (
+        'ALTER TABLE tracks ADD COLUMN quality TEXT',
+        'ALTER TABLE tracks ADD COLUMN source_codec TEXT'
+    )
+
+    def _find(self, where: str, parameters: tuple) -> Optional[LibraryTrack]:
+        # Returns the first match whose file still exists, entries of deleted files are dropped on the way
+        with self._transaction() as connection:
+            for row in connection.execute(f'SELECT {library_columns} FROM tracks WHERE {where}', parameters).fetchall():
+                if os.path.isfile(row[0]):
+                    return LibraryTrack(*row)
+                connection.execute('DELETE FROM tracks WHERE path = ?', (row[0],))
+        return None
+
+    def get_track(self, service: str, track_id) -> Optional[LibraryTrack]:
+        return self._find('service = ? AND track_id = ?', (service, str(track_id)))
+
+    def get_track_by_isrc(self, isrc: str) -> Optional[LibraryTrack]:
+        return self._find('isrc = ?', (isrc.upper(),)) if isrc else None
+
+    def get_track_by_path(self, path: str) -> Optional[LibraryTrack]:
+        return self._find('path = ?', (os.path.abspath(path),))
+
+    def add_track(self, path: str, service: Optional[str], track_id, isrc: Optional[str], codec: Optional[str],
+                  name: Optional[str] = None, artist: Optional[str] = None, duration: Optional[int] = None,
+                  quality: Optional[str] = None, source_codec: Optional[str] = None):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        self._execute(f'INSERT OR REPLACE INTO tracks ({library_columns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                      (path, service, str(track_id) if track_id is not None else None, isrc.upper() if isrc else None,
+                       codec, stat.st_size, stat.st_mtime, name, artist, duration, quality, source_codec))
+
+    def get_artist_albums(self, service: str, artist_id) -> dict:
+        # The completion manifest of an artist, album ID -> ArtistAlbum of every album downloaded for it before
+        rows = self._select('SELECT album_id, name, complete, track_ids, downloaded_track_ids FROM artist_albums '
+                            'WHERE service = ? AND artist_id = ?', (service, str(artist_id)))
+        return {row[0]: ArtistAlbum(row[0], row[1], bool(row[2]), json.loads(row[3]), json.loads(row[4])) for row in rows}
+
+    def set_artist_album(self, service: str, artist_id, album: ArtistAlbum):
+        self._execute('INSERT OR REPLACE INTO artist_albums VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                      (service, str(artist_id), str(album.album_id), album.name, int(album.complete),
+                       json.dumps([str(i) for i in album.track_ids]), json.dumps([str(i) for i in album.downloaded_track_ids]), time.time()))
+
+    def reindex(self, path: str):
+        # Rebuilds the index from the tags of the files under path, the service, track ID and download settings can't
+        # be read back from the files so they are kept for files that were already indexed. Returns (indexed, removed)
+        extensions = {f'.{i.name}' for i in ContainerEnum}
+        indexed = 0
+        for root, _, files in os.walk(path):
+            for file in files:
+                file_path = os.path.abspath(os.path.join(root, file))
+                if os.path.splitext(file)[1].lower() not in extensions: continue
+                try:
+                    isrc, name, artist, duration = read_library_tags(file_path)
+                except Exception as e:
+                    logging.debug(f'Library: could not read {file_path}: {e}')
+                    continue
+
+                known = self._select('SELECT service, track_id, codec, quality, source_codec FROM tracks WHERE path = ?', (file_path,))
+                service, track_id, codec, quality, source_codec = known[0] if known else (None, None, None, None, None)
+                self.add_track(file_path, service, track_id, isrc, codec, name, artist, duration, quality, source_codec)
+                indexed += 1
+
+        with self._transaction() as connection:
+            missing = [row[0] for row in connection.execute('SELECT path FROM tracks') if not os.path.isfile(row[0])]
+            connection.executemany('DELETE FROM tracks WHERE path = ?', ((i,) for i in missing))
+        return indexed, len(missing)
+
+
+def read_library_tags(file_path: str):
+    # Reads (isrc, name, artist, duration) the same way orpheus.tagging wrote them
+    audio = mutagen.File(file_path)
+    if audio is None: raise Exception('Unknown file format')
+    duration = int(audio.info.length) if audio.info and audio.info.length else None
+    tags = audio.tags
+    if tags is None: return None, None, None, duration
+
+    if isinstance(audio, MP4):
+        first = lambda key: tags[key][0] if tags.get(key) else None
+        isrc = first('----:com.apple.itunes:ISRC')
+        isrc = bytes(isrc).decode('utf-8') if isrc else None
+        return isrc, first('\xa9nam'), first('\xa9ART'), duration
+    elif isinstance(tags, ID3):
+        first = lambda key: str(tags[key].text[0]) if key in tags and tags[key].text else None
+        return first('TSRC'), first('TIT2'), first('TPE1'), duration
+    else:  # Vorbis comments
+        first = lambda key: tags[key][0] if key in tags and tags[key] else None
+        return first('isrc'), first('title'), first('artist'), duration
@@ -1,12 +1,18 @@
 import logging, os, ffmpeg, sys
 import shutil
+import threading
 import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import asdict
-from time import strftime, gmtime
+from time import monotonic, strftime, gmtime
+from typing import Callable
 
 from ffmpeg import Error
 
-from orpheus.tagging import tag_file
+from orpheus.journal import JobJournal, JournalTrack
+from orpheus.library import ArtistAlbum, LibraryIndex, LibraryTrack
+from orpheus.tagging import CoverArt, tag_file
 from utils.models import *
 from utils.utils import *
 from utils.exceptions import *
@@ -25,6 +31,95 @@ def beauty_format_seconds(seconds: int) -> str:
     return strftime(time_format, time_data)
 
 
+# Containers ffmpeg can decode from a pipe, as they don't need seeking
+streamable_containers = {ContainerEnum.flac, ContainerEnum.wav, ContainerEnum.ogg, ContainerEnum.opus, ContainerEnum.mp3}
+
+
+# How many third-party cover candidates are fetched at the same time
+cover_candidate_workers = 4
+
+
+class TrackInfoPrefetcher:
+    # Resolves the TrackInfo of the next tracks of an album or playlist while the current one is downloading
+    def __init__(self, service, track_ids: list, depth: int, quality_tier: QualityEnum, codec_options: CodecOptions, extra_kwargs: dict, skip_track_ids: set = frozenset()):
+        self.service = service
+        self.track_ids = track_ids
+        self.skip_track_ids = skip_track_ids
+        self.depth = depth
+        self.quality_tier = quality_tier
+        self.codec_options = codec_options
+        self.extra_kwargs = extra_kwargs
+        self._futures = {}
+        self._next_index = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=depth)
+
+    def advance(self, index: int):
+        # Makes sure every track from index (0-based) up to depth tracks ahead is being fetched
+        with self._lock:
+            self._next_index = max(self._next_index, index)
+            while self._next_index < min(index + self.depth + 1, len(self.track_ids)):
+                track_id = self.track_ids[self._next_index]
+                if track_id not in self._futures and track_id not in self.skip_track_ids:
+                    self._futures[track_id] = self._executor.submit(self.service.get_track_info, track_id, self.quality_tier, self.codec_options, **self.extra_kwargs)
+                self._next_index += 1
+
+    def pop(self, track_id) -> Optional[TrackInfo]:
+        # Returns the prefetched TrackInfo, or None if track_id was never scheduled
+        with self._lock:
+            future = self._futures.pop(track_id, None)
+        return future.result() if future else None
+
+    def close(self):
+        with self._lock:
+            for future in self._futures.values(): future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=False)
+
+
+class SearchCache:
+    # Third-party search results of the current job, so finding the covers, lyrics and credits of a track searches each
+    # module only once. Searches for a key that is already being searched wait for that search instead of repeating it
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.hits, self.misses = 0, 0
+        self._entries = {}  # key: (expiry, future)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(module_name, track_info: TrackInfo):
+        normalise = lambda text: ' '.join(unicodedata.normalize('NFKC', str(text)).casefold().split())
+        return module_name, normalise(track_info.name), tuple(normalise(i) for i in track_info.artists), track_info.tags.isrc
+
+    def get(self, key, search):
+        with self._lock:
+            now = monotonic()
+            entry = self._entries.get(key)
+            is_search_owner = not entry or entry[0] <= now
+            if is_search_owner:
+                self.misses += 1
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+                future = Future()
+                self._entries[key] = (now + self.ttl, future)
+            else:
+                self.hits += 1
+                future = entry[1]
+
+        if is_search_owner:
+            try:
+                future.set_result(search())
+            except BaseException as e:
+                # Failed searches are not cached, but whoever is waiting for this one gets the error too
+                with self._lock:
+                    if key in self._entries and self._entries[key][1] is future: del self._entries[key]
+                future.set_exception(e)
+                raise
+        return list(future.result())
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
 class Downloader:
     def __init__(self, settings, module_controls, oprinter, path):
         self.path = path if path.endswith('/') else path + '/' 
@@ -32,6 +127,20 @@ class Downloader:
         self.download_mode = None
         self.service = None
         self.service_name = None
+        self.track_info_prefetcher = None
+        self.search_cache = SearchCache()
+        self.library: Optional[LibraryIndex] = None
+        self.journal: Optional[JobJournal] = None
+        self.job_id = None
+        self.control: Optional[JobControl] = None  # Lets the web interface cancel and watch the job
+        self.temp_path = 'temp'  # Set to a directory of the job, so jobs running in parallel don't share temp files
+        # Called with a DownloadProgress at every stage of the job, the media are counted by orpheus_core_download
+        self.progress_callback: Optional[Callable[[DownloadProgress], None]] = None
+        self.media_index, self.media_total = 0, 0
+        self.album_index, self.album_total = 0, 0  # Set by download_artist, see DownloadProgress
+        self._track_positions = {}  # Track ID -> (track index, number of tracks) as passed to download_track
+        # Tracks of the current media that failed and didn't succeed since, so it isn't marked complete
+        self.failed_tracks = set()
         self.module_list = module_controls['module_list']
         self.module_settings = module_controls['module_settings']
         self.loaded_modules = module_controls['loaded_modules']
@@ -40,18 +149,236 @@ class Downloader:
 
         self.oprinter = oprinter
         self.print = self.oprinter.oprint
+        self.newline = self.oprinter.newline
         self.set_indent_number = self.oprinter.set_indent_number
+        # Holds the ordered side effects (m3u entries) of tracks running in a worker thread
+        self._track_local = threading.local()
+        # Only set while an album or playlist runs with conversion_backlog
+        self._download_slots, self._conversion_slots = None, None
 
     def search_by_tags(self, module_name, track_info: TrackInfo):
-        return self.loaded_modules[module_name].search(DownloadTypeEnum.track, f'{track_info.name} {" ".join(track_info.artists)}', track_info=track_info)
+        return self.search_cache.get(SearchCache.get_key(module_name, track_info), lambda: self.loaded_modules[module_name].search(
+            DownloadTypeEnum.track, f'{track_info.name} {" ".join(track_info.artists)}', track_info=track_info))
+
+    def _get_quality_options(self):
+        quality_tier = QualityEnum[self.global_settings['general']['download_quality'].upper()]
+        codec_options = CodecOptions(
+            spatial_codecs = self.global_settings['codecs']['spatial_codecs'],
+            proprietary_codecs = self.global_settings['codecs']['proprietary_codecs'],
+        )
+        return quality_tier, codec_options
+
+    def _create_prefetcher(self, service, track_ids: list, extra_kwargs: dict, skip_known_tracks: bool = False) -> Optional[TrackInfoPrefetcher]:
+        # With skip_known_tracks, tracks that are already in the library or the job journal aren't prefetched, as
+        # download_track skips them without getting their info. They are only looked up once prefetching is on
+        depth = self.global_settings['general']['metadata_prefetch']
+        if depth <= 0 or len(track_ids) <= 1:
+            return None
+        skip_track_ids = {i for i in track_ids if self._get_journal_track(i) or self._get_library_track(i)} if skip_known_tracks else frozenset()
+        return TrackInfoPrefetcher(service, track_ids, depth, *self._get_quality_options(), extra_kwargs, skip_track_ids)
+
+    def _get_library(self) -> Optional[LibraryIndex]:
+        # New tracks are also recorded with ignore_existing_files, that setting only turns off skipping known ones
+        return self.library if self.library and self.global_settings['advanced']['library_index'] else None
+
+    def _get_library_track(self, track_id):
+        library = self._get_library()
+        if not library or self.global_settings['advanced']['ignore_existing_files']: return None
+        library_track = library.get_track(self.service_name, track_id)
+        # Tracks with unknown download settings go through the file check of download_track, which records them
+        return library_track if library_track and self._matches_download_settings(library_track) else None
+
+    def _get_codec_conversions(self) -> Optional[dict]:
+        # None if the codec_conversions setting is invalid
+        try:
+            return {CodecEnum[k.upper()]: CodecEnum[v.upper()] for k, v in self.global_settings['advanced']['codec_conversions'].items()}
+        except:
+            return None
+
+    def _matches_download_settings(self, library_track: LibraryTrack) -> Optional[bool]:
+        # Whether a library track was downloaded in the current download_quality and converted by the current
+        # codec_conversions, None if the library doesn't know how it was downloaded
+        if not library_track.quality or not library_track.source_codec or library_track.source_codec not in CodecEnum.__members__:
+            return None
+        if library_track.quality != self.global_settings['general']['download_quality']:
+            return False
+        source_codec = CodecEnum[library_track.source_codec]
+        new_codec = (self._get_codec_conversions() or {}).get(source_codec, source_codec)
+        if self._is_conversion_skipped(source_codec, new_codec): new_codec = source_codec
+        return new_codec.name == library_track.codec
+
+    def _is_conversion_skipped(self, codec: CodecEnum, new_codec: CodecEnum) -> bool:
+        # The conversions download_track refuses, those tracks keep the codec they were downloaded in
+        old_codec_data, new_codec_data = codec_data[codec], codec_data[new_codec]
+        return old_codec_data.spatial or new_codec_data.spatial or (not old_codec_data.lossless and new_codec_data.lossless
+                                                                    and not self.global_settings['advanced']['enable_undesirable_conversions'])
+
+    def _check_control(self):
+        # Called between tracks, raises DownloadCancelledError once the job got cancelled
+        if self.control:
+            self.control.check()
+            self.control.touch()
+
+    def _get_journal_track(self, track_id) -> Optional[JournalTrack]:
+        # Tracks an interrupted run of the current job already finished, regardless of ignore_existing_files
+        if not self.journal or not self.job_id: return None
+        journal_track = self.journal.get_track(self.job_id, self.service_name, track_id)
+        if journal_track and journal_track.status == 'completed' and journal_track.path and os.path.isfile(journal_track.path):
+            return journal_track
+        return None
+
+    def report_progress(self, stage: DownloadStageEnum, track_id=None, bytes_done=0, bytes_total=None):
+        if not self.progress_callback: return
+        track_index, track_total = self._track_positions.get(str(track_id), (0, 0))
+        self.progress_callback(DownloadProgress(stage, self.job_id, self.media_index, self.media_total, track_index, track_total,
+                                                str(track_id) if track_id is not None else None, bytes_done, bytes_total,
+                                                self.album_index, self.album_total))
+
+    def _get_bytes_callback(self, track_id):
+        # For download_file and download_to_pipe, which report the bytes done and the total bytes
+        if not self.progress_callback: return None
+        return lambda bytes_done, bytes_total: self.report_progress(DownloadStageEnum.download, track_id, bytes_done, bytes_total)
+
+    def _set_track_status(self, track_id, status: str, track_location: str = None, name: str = None, artist: str = None, duration: int = None):
+        if status == 'failed':
+            self.failed_tracks.add(str(track_id))
+            self.report_progress(DownloadStageEnum.track_failed, track_id)
+        else:
+            self.failed_tracks.discard(str(track_id))
+            self.report_progress(DownloadStageEnum.track_completed, track_id)
+        if self.journal and self.job_id:
+            self.journal.set_track_status(self.job_id, self.service_name, track_id, status,
+                                          os.path.abspath(track_location) if track_location else None, name, artist, duration)
+
+    def _get_track_info(self, track_id, extra_kwargs: dict) -> TrackInfo:
+        prefetcher = self.track_info_prefetcher
+        if prefetcher and prefetcher.service is self.service:
+            track_info = prefetcher.pop(track_id)
+            if track_info: return track_info
+        return self.service.get_track_info(track_id, *self._get_quality_options(), **extra_kwargs)
+
+    def _run_ordered(self, function, *args):
+        # Tracks downloaded concurrently defer their ordered side effects until they are flushed in index order
+        deferred = getattr(self._track_local, 'deferred', None)
+        if deferred is not None:
+            deferred.append((function, args))
+        else:
+            function(*args)
+
+    def _submit_buffered(self, executor: ThreadPoolExecutor, job):
+        # Runs job on the executor with its output buffered, the future resolves to (lines, deferred, result, error)
+        indent_number = self.oprinter.indent_number
+
+        def run_buffered():
+            self._track_local.deferred = []
+            try:
+                with self.oprinter.buffered(indent_number) as lines:
+                    try:
+                        result, error = job(), None
+                    except Exception as e:
+                        result, error = None, e
+                return lines, self._track_local.deferred, result, error
+            finally:
+                del self._track_local.deferred
+
+        return executor.submit(run_buffered)
+
+    def _join_buffered(self, future):
+        # Flushes the buffered output and ordered side effects of a job into the current thread, then returns its result
+        lines, deferred, result, error = future.result()
+        self.oprinter.flush(lines)
+        for function, args in deferred: self._run_ordered(function, *args)
+        if error: raise error
+        return result
+
+    def _download_tracks(self, track_jobs: list, track_ids: list, extra_kwargs: dict):
+        # track_jobs is a list of callables that each print the track header and download the track at the same index of track_ids
+        prefetcher = self._create_prefetcher(self.service, track_ids, extra_kwargs, skip_known_tracks=True)
+        if prefetcher:
+            def with_prefetch(index, job):
+                def prefetching_job():
+                    prefetcher.advance(index)
+                    job()
+                return prefetching_job
+            track_jobs = [with_prefetch(index, job) for index, job in enumerate(track_jobs)]
+
+        # At most conversion_workers conversions run at once. With a conversion backlog, tracks that are done downloading
+        # also give up their download slot while they wait for or run their conversion, so up to conversion_backlog
+        # more tracks can download in the meantime
+        track_workers = max(self.global_settings['general']['track_workers'], 1)
+        conversion_backlog = max(self.global_settings['advanced']['conversion_backlog'], 0)
+        self._conversion_slots = threading.Semaphore(self.global_settings['advanced']['conversion_workers'] or os.cpu_count() or 1)
+        if conversion_backlog:
+            self._download_slots = threading.Semaphore(track_workers)
+            track_jobs = [self._with_download_slot(job) for job in track_jobs]
+        track_workers += conversion_backlog
+
+        previous_prefetcher, self.track_info_prefetcher = self.track_info_prefetcher, prefetcher
+        try:
+            if track_workers <= 1 or len(track_jobs) <= 1:
+                for job in track_jobs: job()
+                return
+
+            with ThreadPoolExecutor(max_workers=track_workers) as executor:
+                futures = [self._submit_buffered(executor, job) for job in track_jobs]
+                try:
+                    # Flush each track's output in index order so the log reads the same as a sequential run
+                    for future in futures: self._join_buffered(future)
+                except BaseException:
+                    for future in futures: future.cancel()
+                    raise
+        finally:
+            self.track_info_prefetcher = previous_prefetcher
+            if prefetcher: prefetcher.close()
+            self._download_slots, self._conversion_slots = None, None
+
+    def _with_download_slot(self, job):
+        def slotted_job():
+            self._download_slots.acquire()
+            self._track_local.download_slot = True
+            try:
+                job()
+            finally:
+                self._release_download_slot()
+        return slotted_job
+
+    def _release_download_slot(self):
+        if getattr(self._track_local, 'download_slot', False):
+            self._track_local.download_slot = False
+            self._download_slots.release()
+
+    @contextmanager
+    def _conversion_slot(self, keep_download_slot=False):
+        # ffmpeg runs in its own process, so limiting how many run at once is all the conversion pool needs. Streamed
+        # conversions count against conversion_workers as well, but they are still downloading while ffmpeg runs, so
+        # they keep their download slot. Single tracks outside of _download_tracks only ever run one conversion
+        if not self._conversion_slots:
+            yield
+            return
+        if not keep_download_slot: self._release_download_slot()
+        with self._conversion_slots:
+            yield
+
+    @contextmanager
+    def _using_service(self, module_name: str):
+        # Downloads with another loaded module, the job's own service is restored afterwards
+        service, service_name = self.service, self.service_name
+        self.service, self.service_name = self.loaded_modules[module_name], module_name
+        try:
+            yield
+        finally:
+            self.service, self.service_name = service, service_name
 
     def _add_track_m3u_playlist(self, m3u_playlist: str, track_info: TrackInfo, track_location: str):
+        self._add_m3u_entry(m3u_playlist, track_location, track_info.name, track_info.artists[0], track_info.duration)
+
+    def _add_m3u_entry(self, m3u_playlist: str, track_location: str, name: str, artist: str, duration: Optional[int]):
         if self.global_settings['playlist']['extended_m3u']:
             with open(m3u_playlist, 'a', encoding='utf-8') as f:
                 # if no duration exists default to -1
-                duration = track_info.duration if track_info.duration else -1
+                duration = duration if duration else -1
                 # write the extended track header
-                f.write(f'#EXTINF:{duration}, {track_info.artists[0]} - {track_info.name}\n')
+                f.write(f'#EXTINF:{duration}, {artist} - {name}\n')
 
         with open(m3u_playlist, 'a', encoding='utf-8') as f:
             if self.global_settings['playlist']['paths_m3u'] == "absolute":
@@ -119,39 +446,42 @@ class Downloader:
             self.print(f'Service used for downloading: {self.module_settings[custom_module].service_name}')
             original_service = str(self.service_name)
             self.load_module(custom_module)
+            prefetcher = self._create_prefetcher(self.loaded_modules[original_service], playlist_info.tracks, playlist_info.track_extra_kwargs)
             for index, track_id in enumerate(playlist_info.tracks, start=1):
                 self.set_indent_number(2)
-                print()
+                self.newline()
                 self.print(f'Track {index}/{number_of_tracks}', drop_level=1)
-                quality_tier = QualityEnum[self.global_settings['general']['download_quality'].upper()]
-                codec_options = CodecOptions(
-                    spatial_codecs = self.global_settings['codecs']['spatial_codecs'],
-                    proprietary_codecs = self.global_settings['codecs']['proprietary_codecs'],
-                )
-                track_info: TrackInfo = self.loaded_modules[original_service].get_track_info(track_id, quality_tier, codec_options, **playlist_info.track_extra_kwargs)
+                self._check_control()
+                if prefetcher: prefetcher.advance(index - 1)
+                track_info: TrackInfo = prefetcher.pop(track_id) if prefetcher else None
+                if not track_info:
+                    track_info = self.loaded_modules[original_service].get_track_info(track_id, *self._get_quality_options(), **playlist_info.track_extra_kwargs)
                 
-                self.service = self.loaded_modules[custom_module]
-                self.service_name = custom_module
                 results = self.search_by_tags(custom_module, track_info)
                 track_id_new = results[0].result_id if len(results) else None
                 
                 if track_id_new:
-                    self.download_track(track_id_new, album_location=playlist_path, track_index=index, number_of_tracks=number_of_tracks, indent_level=2, m3u_playlist=m3u_playlist_path, extra_kwargs=results[0].extra_kwargs)
+                    with self._using_service(custom_module):
+                        self.download_track(track_id_new, album_location=playlist_path, track_index=index, number_of_tracks=number_of_tracks, indent_level=2, m3u_playlist=m3u_playlist_path, extra_kwargs=results[0].extra_kwargs)
                 else:
                     tracks_errored.add(f'{track_info.name} - {track_info.artists[0]}')
                     if ModuleModes.download in self.module_settings[original_service].module_supported_modes:
-                        self.service = self.loaded_modules[original_service]
-                        self.service_name = original_service
                         self.print(f'Track {track_info.name} not found, using the original service as a fallback', drop_level=1)
                         self.download_track(track_id, album_location=playlist_path, track_index=index, number_of_tracks=number_of_tracks, indent_level=2, m3u_playlist=m3u_playlist_path, extra_kwargs=playlist_info.track_extra_kwargs)
                     else:
                         self.print(f'Track {track_info.name} not found, skipping')
+            if prefetcher: prefetcher.close()
         else:
-            for index, track_id in enumerate(playlist_info.tracks, start=1):
-                self.set_indent_number(2)
-                print()
-                self.print(f'Track {index}/{number_of_tracks}', drop_level=1)
-                self.download_track(track_id, album_location=playlist_path, track_index=index, number_of_tracks=number_of_tracks, indent_level=2, m3u_playlist=m3u_playlist_path, extra_kwargs=playlist_info.track_extra_kwargs)
+            def playlist_track_job(index, track_id):
+                def job():
+                    self.set_indent_number(2)
+                    self.newline()
+                    self.print(f'Track {index}/{number_of_tracks}', drop_level=1)
+                    self.download_track(track_id, album_location=playlist_path, track_index=index, number_of_tracks=number_of_tracks, indent_level=2, m3u_playlist=m3u_playlist_path, extra_kwargs=playlist_info.track_extra_kwargs)
+                return job
+
+            self._download_tracks([playlist_track_job(index, track_id) for index, track_id in enumerate(playlist_info.tracks, start=1)],
+                                  playlist_info.tracks, playlist_info.track_extra_kwargs)
 
         self.set_indent_number(1)
         self.print(f'=== Playlist {playlist_info.name} downloaded ===', drop_level=1)
@@ -195,7 +525,7 @@ class Downloader:
 
         if album_info.animated_cover_url and self.global_settings['covers']['save_animated_cover']:
             self.print('Downloading animated album cover')
-            download_file(album_info.animated_cover_url, album_path + 'cover.mp4', enable_progress_bar=True)
+            download_file(album_info.animated_cover_url, album_path + 'cover.mp4', enable_progress_bar=not self.oprinter.is_buffering)
 
         if album_info.description:
             with open(album_path + 'description.txt', 'w', encoding='utf-8') as f:
@@ -230,16 +560,23 @@ class Downloader:
                 self.print('Downloading booklet')
                 download_file(album_info.booklet_url, album_path + 'Booklet.pdf')
             
-            cover_temp_location = download_to_temp(album_info.all_track_cover_jpg_url) if album_info.all_track_cover_jpg_url else ''
+            cover_temp_location = download_to_temp(album_info.all_track_cover_jpg_url, artwork_settings={}, directory=self.temp_path) if album_info.all_track_cover_jpg_url else ''
+            # Shared by all tracks, so the cover is only read and encoded once for the whole album
+            cover_art = CoverArt(cover_temp_location) if cover_temp_location else None
 
             # Download booklet, animated album cover and album cover if present
             self._download_album_files(album_path, album_info)
 
-            for index, track_id in enumerate(album_info.tracks, start=1):
-                self.set_indent_number(indent_level + 1)
-                print()
-                self.print(f'Track {index}/{number_of_tracks}', drop_level=1)
-                self.download_track(track_id, album_location=album_path, track_index=index, number_of_tracks=number_of_tracks, main_artist=artist_name, cover_temp_location=cover_temp_location, indent_level=indent_level+1, extra_kwargs=album_info.track_extra_kwargs)
+            def album_track_job(index, track_id):
+                def job():
+                    self.set_indent_number(indent_level + 1)
+                    self.newline()
+                    self.print(f'Track {index}/{number_of_tracks}', drop_level=1)
+                    self.download_track(track_id, album_location=album_path, track_index=index, number_of_tracks=number_of_tracks, main_artist=artist_name, cover_temp_location=cover_temp_location, cover_art=cover_art, indent_level=indent_level+1, extra_kwargs=album_info.track_extra_kwargs)
+                return job
+
+            self._download_tracks([album_track_job(index, track_id) for index, track_id in enumerate(album_info.tracks, start=1)],
+                                  album_info.tracks, album_info.track_extra_kwargs)
 
             self.set_indent_number(indent_level)
             self.print(f'=== Album {album_info.name} downloaded ===', drop_level=1)
@@ -247,7 +584,7 @@ class Downloader:
         elif number_of_tracks == 1:
             self.download_track(album_info.tracks[0], album_location=path, number_of_tracks=1, main_artist=artist_name, indent_level=indent_level, extra_kwargs=album_info.track_extra_kwargs)
 
-        return album_info.tracks
+        return album_info
 
     def download_artist(self, artist_id, extra_kwargs={}):
         artist_info: ArtistInfo = self.service.get_artist_info(artist_id, self.global_settings['artist_downloading']['return_credited_albums'], **extra_kwargs)
@@ -264,19 +601,45 @@ class Downloader:
         self.print(f'Service: {self.module_settings[self.service_name].service_name}')
         artist_path = self.path + sanitise_name(artist_name) + '/'
 
+        # Albums completed by an earlier run are skipped without requesting any of their metadata again
+        library = self._get_library() if not self.global_settings['advanced']['ignore_existing_files'] else None
+        known_albums = library.get_artist_albums(self.service_name, artist_id) if library else {}
+
         self.set_indent_number(2)
-        tracks_downloaded = []
+        tracks_downloaded = set()
+        # Every album and separate track is a part of the artist's progress, the tracks are counted again once the
+        # tracks that came with the albums are known
+        self.album_total = number_of_albums + number_of_tracks
         for index, album_id in enumerate(artist_info.albums, start=1):
-            print()
+            self.album_index = index
+            self.newline()
             self.print(f'Album {index}/{number_of_albums}', drop_level=1)
-            tracks_downloaded += self.download_album(album_id, artist_name=artist_name, path=artist_path, indent_level=2, extra_kwargs=artist_info.album_extra_kwargs)
+
+            known_album = known_albums.get(str(album_id))
+            if known_album and known_album.complete and all(self._get_library_track(i) for i in known_album.downloaded_track_ids):
+                self.print(f'=== Album {known_album.name} ({album_id}) already downloaded, skipped ===', drop_level=1)
+                tracks_downloaded.update(known_album.track_ids)
+                continue
+
+            album_info = self.download_album(album_id, artist_name=artist_name, path=artist_path, indent_level=2, extra_kwargs=artist_info.album_extra_kwargs)
+            if not album_info: continue
+            track_ids = [str(i) for i in album_info.tracks]
+            tracks_downloaded.update(track_ids)
+
+            # Recorded even with ignore_existing_files, that setting only turns off skipping known albums
+            manifest = self._get_library()
+            if manifest:
+                manifest.set_artist_album(self.service_name, artist_id, ArtistAlbum(str(album_id), album_info.name,
+                    not self.failed_tracks.intersection(track_ids), track_ids, [i for i in track_ids if manifest.get_track(self.service_name, i)]))
 
         self.set_indent_number(2)
         skip_tracks = self.global_settings['artist_downloading']['separate_tracks_skip_downloaded']
-        tracks_to_download = [i for i in artist_info.tracks if (i not in tracks_downloaded and skip_tracks) or not skip_tracks]
+        tracks_to_download = [i for i in artist_info.tracks if not skip_tracks or str(i) not in tracks_downloaded]
         number_of_tracks_new = len(tracks_to_download)
+        self.album_total = number_of_albums + number_of_tracks_new
         for index, track_id in enumerate(tracks_to_download, start=1):
-            print()
+            self.album_index = number_of_albums + index
+            self.newline()
             self.print(f'Track {index}/{number_of_tracks_new}', drop_level=1)
             self.download_track(track_id, album_location=artist_path, main_artist=artist_name, number_of_tracks=1, indent_level=2, extra_kwargs=artist_info.track_extra_kwargs)
 
@@ -285,13 +648,21 @@ class Downloader:
         if tracks_skipped > 0: self.print(f'Tracks skipped: {tracks_skipped!s}', drop_level=1)
         self.print(f'=== Artist {artist_name} downloaded ===', drop_level=1)
 
-    def download_track(self, track_id, album_location='', main_artist='', track_index=0, number_of_tracks=0, cover_temp_location='', indent_level=1, m3u_playlist=None, extra_kwargs={}):
-        quality_tier = QualityEnum[self.global_settings['general']['download_quality'].upper()]
-        codec_options = CodecOptions(
-            spatial_codecs = self.global_settings['codecs']['spatial_codecs'],
-            proprietary_codecs = self.global_settings['codecs']['proprietary_codecs'],
-        )
-        track_info: TrackInfo = self.service.get_track_info(track_id, quality_tier, codec_options, **extra_kwargs)
+    def download_track(self, track_id, album_location='', main_artist='', track_index=0, number_of_tracks=0, cover_temp_location='', indent_level=1, m3u_playlist=None, extra_kwargs={}, cover_art: CoverArt = None):
+        self._check_control()
+        self._track_positions[str(track_id)] = (track_index, number_of_tracks)
+        self.report_progress(DownloadStageEnum.track, track_id)
+        library_track = self._get_journal_track(track_id) or self._get_library_track(track_id)
+        if library_track:
+            self.set_indent_number(indent_level)
+            self.print(f'Track file already exists: {library_track.path}')
+            self._set_track_status(track_id, 'completed', library_track.path, library_track.name, library_track.artist, library_track.duration)
+            if m3u_playlist:
+                self._run_ordered(self._add_m3u_entry, m3u_playlist, library_track.path, library_track.name, library_track.artist, library_track.duration)
+            self.print(f'=== Track {track_id} skipped ===', drop_level=1)
+            return
+
+        track_info: TrackInfo = self._get_track_info(track_id, extra_kwargs)
         
         if main_artist.lower() not in [i.lower() for i in track_info.artists] and self.global_settings['advanced']['ignore_different_artists'] and self.download_mode is DownloadTypeEnum.artist:
            self.print('Track is not from the correct artist, skipping', drop_level=1)
@@ -330,9 +701,21 @@ class Downloader:
         # Check if track_info returns error, display it and return this function to not download the track
         if track_info.error:
             self.print(track_info.error)
+            self._set_track_status(track_id, 'failed')
             self.print(f'=== Track {track_id} failed ===', drop_level=1)
             return
 
+        # The same recording might already have been downloaded from another service
+        if self._get_library() and self.global_settings['advanced']['library_isrc_dedupe'] and not self.global_settings['advanced']['ignore_existing_files']:
+            library_track = self.library.get_track_by_isrc(track_info.tags.isrc)
+            if library_track and self._matches_download_settings(library_track) is not False:
+                self.print(f'Track with the same ISRC already exists: {library_track.path}')
+                self._set_track_status(track_id, 'completed', library_track.path, library_track.name, library_track.artist, library_track.duration)
+                if m3u_playlist:
+                    self._run_ordered(self._add_m3u_entry, m3u_playlist, library_track.path, library_track.name, library_track.artist, library_track.duration)
+                self.print(f'=== Track {track_id} skipped ===', drop_level=1)
+                return
+
         album_location = album_location.replace('\\', '/')
 
         # Ignores "single_full_path_format" and just downloads every track as an album
@@ -359,9 +742,8 @@ class Downloader:
         track_location_name = fix_byte_limit(track_location_name)
         os.makedirs(track_location_name[:track_location_name.rfind('/')], exist_ok=True)
 
-        try:
-            conversions = {CodecEnum[k.upper()]: CodecEnum[v.upper()] for k, v in self.global_settings['advanced']['codec_conversions'].items()}
-        except:
+        conversions = self._get_codec_conversions()
+        if conversions is None:
             conversions = {}
             self.print('Warning: codec_conversions setting is invalid!')
         
@@ -371,12 +753,19 @@ class Downloader:
         check_codec = conversions[track_info.codec] if track_info.codec in conversions else track_info.codec
         check_location = f'{track_location_name}.{codec_data[check_codec].container.name}'
 
+        # A file the library knows was downloaded with other settings is replaced
+        known_track = self._get_library().get_track_by_path(check_location) if self._get_library() else None
+        if known_track and self._matches_download_settings(known_track) is False and not self.global_settings['advanced']['ignore_existing_files']:
+            self.print('Track file was downloaded with other quality or conversion settings, downloading it again')
+            silentremove(check_location)
+
         if os.path.isfile(check_location) and not self.global_settings['advanced']['ignore_existing_files']:
             self.print('Track file already exists')
+            self._record_track(check_location, track_id, track_info, check_codec)
 
             # also make sure to add already existing tracks to the m3u playlist
             if m3u_playlist:
-                self._add_track_m3u_playlist(m3u_playlist, track_info, track_location)
+                self._run_ordered(self._add_track_m3u_playlist, m3u_playlist, track_info, track_location)
 
             self.print(f'=== Track {track_id} skipped ===', drop_level=1)
             return
@@ -384,118 +773,69 @@ class Downloader:
         if track_info.description:
             with open(track_location_name + '.txt', 'w', encoding='utf-8') as f: f.write(track_info.description)
 
-        # Begin process
-        print()
-        self.print("Downloading track file")
-        try:
-            download_info: TrackDownloadInfo = self.service.get_track_download(**track_info.download_extra_kwargs)
-            download_file(download_info.file_url, track_location, headers=download_info.file_url_headers, enable_progress_bar=True, indent_level=self.oprinter.indent_number) \
-                if download_info.download_type is DownloadEnum.URL else shutil.move(download_info.temp_file_path, track_location)
-
-            # check if get_track_download returns a different codec, for example ffmpeg failed
-            if download_info.different_codec:
-                # overwrite the old known codec with the new
-                codec = download_info.different_codec
-                container = codec_data[codec].container
-                old_track_location = track_location
-                # create the new track_location and move the old file to the new location
-                track_location = f'{track_location_name}.{container.name}'
-                shutil.move(old_track_location, track_location)
-        except KeyboardInterrupt:
-            self.print('^C pressed, exiting')
-            sys.exit(0)
-        except Exception:
-            if self.global_settings['advanced']['debug_mode']: raise
-            self.print('Warning: Track download failed: ' + str(sys.exc_info()[1]))
-            self.print(f'=== Track {track_id} failed ===', drop_level=1)
-            return
-
-        delete_cover = False
+        # Artwork, animated cover, lyrics and credits don't depend on the audio file, so fetch them while it downloads
+        side_stages = {}
         if not cover_temp_location:
-            cover_temp_location = create_temp_filename()
-            delete_cover = True
-            covers_module_name = self.third_party_modules[ModuleModes.covers]
-            covers_module_name = covers_module_name if covers_module_name != self.service_name else None
-            if covers_module_name: print()
-            self.print('Downloading artwork' + ((' with ' + covers_module_name) if covers_module_name else ''))
-            
-            jpg_cover_options = CoverOptions(file_type=ImageFileTypeEnum.jpg, resolution=self.global_settings['covers']['main_resolution'], \
-                compression=CoverCompressionEnum[self.global_settings['covers']['main_compression'].lower()])
-            ext_cover_options = CoverOptions(file_type=ImageFileTypeEnum[self.global_settings['covers']['external_format']], \
-                resolution=self.global_settings['covers']['external_resolution'], \
-                compression=CoverCompressionEnum[self.global_settings['covers']['external_compression'].lower()])
-            
-            if covers_module_name:
-                default_temp = download_to_temp(track_info.cover_url)
-                test_cover_options = CoverOptions(file_type=ImageFileTypeEnum.jpg, resolution=get_image_resolution(default_temp), compression=CoverCompressionEnum.high)
-                cover_module = self.loaded_modules[covers_module_name]
-                rms_threshold = self.global_settings['advanced']['cover_variance_threshold']
-
-                results: list[SearchResult] = self.search_by_tags(covers_module_name, track_info)
-                self.print('Covers to test: ' + str(len(results)))
-                attempted_urls = []
-                for i, r in enumerate(results, start=1):
-                    test_cover_info: CoverInfo = cover_module.get_track_cover(r.result_id, test_cover_options, **r.extra_kwargs)
-                    if test_cover_info.url not in attempted_urls:
-                        attempted_urls.append(test_cover_info.url)
-                        test_temp = download_to_temp(test_cover_info.url)
-                        rms = compare_images(default_temp, test_temp)
-                        silentremove(test_temp)
-                        self.print(f'Attempt {i} RMS: {rms!s}') # The smaller the root mean square, the closer the image is to the desired one
-                        if rms < rms_threshold:
-                            self.print('Match found below threshold ' + str(rms_threshold))
-                            jpg_cover_info: CoverInfo = cover_module.get_track_cover(r.result_id, jpg_cover_options, **r.extra_kwargs)
-                            download_file(jpg_cover_info.url, cover_temp_location, artwork_settings=self._get_artwork_settings(covers_module_name))
-                            silentremove(default_temp)
-                            if self.global_settings['covers']['save_external']:
-                                ext_cover_info: CoverInfo = cover_module.get_track_cover(r.result_id, ext_cover_options, **r.extra_kwargs)
-                                download_file(ext_cover_info.url, f'{track_location_name}.{ext_cover_info.file_type.name}', artwork_settings=self._get_artwork_settings(covers_module_name, is_external=True))
-                            break
-                else:
-                    self.print('Third-party module could not find cover, using fallback')
-                    shutil.move(default_temp, cover_temp_location)
-            else:
-                download_file(track_info.cover_url, cover_temp_location, artwork_settings=self._get_artwork_settings())
-                if self.global_settings['covers']['save_external'] and ModuleModes.covers in self.module_settings[self.service_name].module_supported_modes:
-                    ext_cover_info: CoverInfo = self.service.get_track_cover(track_id, ext_cover_options, **track_info.cover_extra_kwargs)
-                    download_file(ext_cover_info.url, f'{track_location_name}.{ext_cover_info.file_type.name}', artwork_settings=self._get_artwork_settings(is_external=True))
-
+            side_stages['cover'] = lambda: self._download_track_cover(track_id, track_info, track_location_name)
         if track_info.animated_cover_url and self.global_settings['covers']['save_animated_cover']:
-            self.print('Downloading animated cover')
-            download_file(track_info.animated_cover_url, track_location_name + '_cover.mp4', enable_progress_bar=True)
-
-        # Get lyrics
-        embedded_lyrics = ''
+            side_stages['animated_cover'] = lambda: self._download_track_animated_cover(track_info, track_location_name)
         if self.global_settings['lyrics']['embed_lyrics'] or self.global_settings['lyrics']['save_synced_lyrics']:
-            lyrics_info = LyricsInfo()
-            if self.third_party_modules[ModuleModes.lyrics] and self.third_party_modules[ModuleModes.lyrics] != self.service_name:
-                lyrics_module_name = self.third_party_modules[ModuleModes.lyrics]
-                self.print('Retrieving lyrics with ' + lyrics_module_name)
-                lyrics_module = self.loaded_modules[lyrics_module_name]
-
-                if lyrics_module_name != self.service_name:
-                    results: list[SearchResult] = self.search_by_tags(lyrics_module_name, track_info)
-                    lyrics_track_id = results[0].result_id if len(results) else None
-                    extra_kwargs = results[0].extra_kwargs if len(results) else None
-                else:
-                    lyrics_track_id = track_id
-                    extra_kwargs = {}
-                
-                if lyrics_track_id:
-                    lyrics_info: LyricsInfo = lyrics_module.get_track_lyrics(lyrics_track_id, **extra_kwargs)
-                    # if lyrics_info.embedded or lyrics_info.synced:
-                    #     self.print('Lyrics retrieved')
-                    # else:
-                    #     self.print('Lyrics module could not find any lyrics.')
+            side_stages['lyrics'] = lambda: self._get_track_lyrics(track_id, track_info)
+        side_stages['credits'] = lambda: self._get_track_credits(track_id, track_info)
+
+        with ThreadPoolExecutor(max_workers=len(side_stages)) as executor:
+            side_futures = {name: self._submit_buffered(executor, stage) for name, stage in side_stages.items()}
+
+            # Begin process
+            self.newline()
+            self.print("Downloading track file")
+            try:
+                download_info: TrackDownloadInfo = self.service.get_track_download(**track_info.download_extra_kwargs)
+                streamed_codec = self._get_streamed_conversion(codec, conversions, download_info)
+                if streamed_codec:
+                    self.print(f'Converting to {codec_data[streamed_codec].pretty_name} while downloading')
+                    track_location = self._download_converted(download_info, streamed_codec, track_location_name, track_id)
+                    codec, container = streamed_codec, codec_data[streamed_codec].container
+                elif download_info.download_type is DownloadEnum.URL:
+                    download_file(download_info.file_url, track_location, headers=download_info.file_url_headers, enable_progress_bar=not self.oprinter.is_buffering, indent_level=self.oprinter.indent_number, control=self.control, progress_callback=self._get_bytes_callback(track_id), **self._get_segment_settings())
                 else:
-                    self.print('Lyrics module could not find any lyrics.')
-            elif ModuleModes.lyrics in self.module_settings[self.service_name].module_supported_modes:
-                lyrics_info: LyricsInfo = self.service.get_track_lyrics(track_id, **track_info.lyrics_extra_kwargs)
-                # if lyrics_info.embedded or lyrics_info.synced:
-                #     self.print('Lyrics retrieved')
-                # else:
-                #     self.print('No lyrics available')
+                    shutil.move(download_info.temp_file_path, track_location)
+
+                # check if get_track_download returns a different codec, for example ffmpeg failed
+                if download_info.different_codec:
+                    # overwrite the old known codec with the new
+                    codec = download_info.different_codec
+                    container = codec_data[codec].container
+                    old_track_location = track_location
+                    # create the new track_location and move the old file to the new location
+                    track_location = f'{track_location_name}.{container.name}'
+                    shutil.move(old_track_location, track_location)
+            except KeyboardInterrupt:
+                self.print('^C pressed, exiting')
+                sys.exit(0)
+            except DownloadCancelledError:
+                self.print(f'=== Track {track_id} cancelled ===', drop_level=1)
+                raise
+            except Exception:
+                # Wait for the side stages and throw their output away, the track is not going to be tagged
+                for name, future in side_futures.items():
+                    _, _, result, _ = future.result()
+                    if name == 'cover' and result: silentremove(result)
+                if self.global_settings['advanced']['debug_mode']: raise
+                self.print('Warning: Track download failed: ' + str(sys.exc_info()[1]))
+                self._set_track_status(track_id, 'failed')
+                self.print(f'=== Track {track_id} failed ===', drop_level=1)
+                return
+
+            # Join the side stages in their original order so the log reads the same as before
+            side_results = {name: self._join_buffered(future) for name, future in side_futures.items()}
+
+        delete_cover = 'cover' in side_results
+        if delete_cover: cover_temp_location = side_results['cover']
 
+        embedded_lyrics = ''
+        if 'lyrics' in side_results:
+            lyrics_info: LyricsInfo = side_results['lyrics']
             if lyrics_info.embedded and self.global_settings['lyrics']['embed_lyrics']:
                 embedded_lyrics = lyrics_info.embedded
             # embed the synced lyrics (f.e. Roon) if they are available
@@ -508,44 +848,16 @@ class Downloader:
                     with open(lrc_location, 'w', encoding='utf-8') as f:
                         f.write(lyrics_info.synced)
 
-        # Get credits
-        credits_list = []
-        if self.third_party_modules[ModuleModes.credits] and self.third_party_modules[ModuleModes.credits] != self.service_name:
-            credits_module_name = self.third_party_modules[ModuleModes.credits]
-            self.print('Retrieving credits with ' + credits_module_name)
-            credits_module = self.loaded_modules[credits_module_name]
+        credits_list = side_results['credits']
 
-            if credits_module_name != self.service_name:
-                results: list[SearchResult] = self.search_by_tags(credits_module_name, track_info)
-                credits_track_id = results[0].result_id if len(results) else None
-                extra_kwargs = results[0].extra_kwargs if len(results) else None
-            else:
-                credits_track_id = track_id
-                extra_kwargs = {}
-            
-            if credits_track_id:
-                credits_list = credits_module.get_track_credits(credits_track_id, **extra_kwargs)
-                # if credits_list:
-                #     self.print('Credits retrieved')
-                # else:
-                #     self.print('Credits module could not find any credits.')
-            # else:
-            #     self.print('Credits module could not find any credits.')
-        elif ModuleModes.credits in self.module_settings[self.service_name].module_supported_modes:
-            self.print('Retrieving credits')
-            credits_list = self.service.get_track_credits(track_id, **track_info.credits_extra_kwargs)
-            # if credits_list:
-            #     self.print('Credits retrieved')
-            # else:
-            #     self.print('No credits available')
-        
         # Do conversions
         old_track_location, old_container = None, None
-        if codec in conversions:
+        if codec in conversions and not streamed_codec:
             old_codec_data = codec_data[codec]
             new_codec = conversions[codec]
             new_codec_data = codec_data[new_codec]
             self.print(f'Converting to {new_codec_data.pretty_name}')
+            self.report_progress(DownloadStageEnum.conversion, track_id)
                 
             if old_codec_data.spatial or new_codec_data.spatial:
                 self.print('Warning: converting spacial formats is not allowed, skipping')
@@ -559,42 +871,37 @@ class Downloader:
                 elif not old_codec_data:
                     self.print('Warning: Undesirable lossy-to-lossy conversion')
 
-                try:
-                    conversion_flags = {CodecEnum[k.upper()]:v for k,v in self.global_settings['advanced']['conversion_flags'].items()}
-                except:
-                    conversion_flags = {}
-                    self.print('Warning: conversion_flags setting is invalid, using defaults')
-                
-                conv_flags = conversion_flags[new_codec] if new_codec in conversion_flags else {}
-                temp_track_location = f'{create_temp_filename()}.{new_codec_data.container.name}'
+                conv_flags = self._get_conversion_flags(new_codec)
+                temp_track_location = f'{create_temp_filename(self.temp_path)}.{new_codec_data.container.name}'
                 new_track_location = f'{track_location_name}.{new_codec_data.container.name}'
                 
-                stream: ffmpeg = ffmpeg.input(track_location, hide_banner=None, y=None)
-                # capture_stderr is required for the error output to be captured
-                try:
+                with self._conversion_slot():
+                    stream: ffmpeg = ffmpeg.input(track_location, hide_banner=None, y=None)
                     # capture_stderr is required for the error output to be captured
-                    stream.output(
-                        temp_track_location,
-                        acodec=new_codec.name.lower(),
-                        **conv_flags,
-                        loglevel='error'
-                    ).run(capture_stdout=True, capture_stderr=True)
-                except Error as e:
-                    error_msg = e.stderr.decode('utf-8')
-                    # get the error message from ffmpeg and search foe the non-experimental encoder
-                    encoder = re.search(r"(?<=non experimental encoder ')[^']+", error_msg)
-                    if encoder:
-                        self.print(f'Encoder {new_codec.name.lower()} is experimental, trying {encoder.group(0)}')
-                        # try to use the non-experimental encoder
+                    try:
+                        # capture_stderr is required for the error output to be captured
                         stream.output(
                             temp_track_location,
-                            acodec=encoder.group(0),
+                            acodec=new_codec.name.lower(),
                             **conv_flags,
                             loglevel='error'
-                        ).run()
-                    else:
-                        # raise any other occurring error
-                        raise Exception(f'ffmpeg error converting to {new_codec.name.lower()}:\n{error_msg}')
+                        ).run(capture_stdout=True, capture_stderr=True)
+                    except Error as e:
+                        error_msg = e.stderr.decode('utf-8')
+                        # get the error message from ffmpeg and search foe the non-experimental encoder
+                        encoder = re.search(r"(?<=non experimental encoder ')[^']+", error_msg)
+                        if encoder:
+                            self.print(f'Encoder {new_codec.name.lower()} is experimental, trying {encoder.group(0)}')
+                            # try to use the non-experimental encoder
+                            stream.output(
+                                temp_track_location,
+                                acodec=encoder.group(0),
+                                **conv_flags,
+                                loglevel='error'
+                            ).run()
+                        else:
+                            # raise any other occurring error
+                            raise Exception(f'ffmpeg error converting to {new_codec.name.lower()}:\n{error_msg}')
 
                 # remove file if it requires an overwrite, maybe os.replace would work too?
                 if track_location == new_track_location:
@@ -617,23 +924,241 @@ class Downloader:
 
         # Add the playlist track to the m3u playlist
         if m3u_playlist:
-            self._add_track_m3u_playlist(m3u_playlist, track_info, track_location)
+            self._run_ordered(self._add_track_m3u_playlist, m3u_playlist, track_info, track_location)
 
         # Finally tag file
         self.print('Tagging file')
+        self.report_progress(DownloadStageEnum.tagging, track_id)
+        # The track's own cover is also read only once when the original file is tagged as well
+        if cover_temp_location and (not cover_art or cover_art.image_path != cover_temp_location):
+            cover_art = CoverArt(cover_temp_location)
         try:
             tag_file(track_location, cover_temp_location if self.global_settings['covers']['embed_cover'] else None,
-                     track_info, credits_list, embedded_lyrics, container)
+                     track_info, credits_list, embedded_lyrics, container, cover_art)
             if old_track_location:
                 tag_file(old_track_location, cover_temp_location if self.global_settings['covers']['embed_cover'] else None,
-                         track_info, credits_list, embedded_lyrics, old_container)
+                         track_info, credits_list, embedded_lyrics, old_container, cover_art)
         except TagSavingFailure:
             self.print('Tagging failed, tags saved to text file')
+        self._record_track(track_location, track_id, track_info, codec)
         if delete_cover:
             silentremove(cover_temp_location)
         
         self.print(f'=== Track {track_id} downloaded ===', drop_level=1)
 
+    def _record_track(self, track_location: str, track_id, track_info: TrackInfo, codec: CodecEnum):
+        # Adds a finished track to the library index and to the journal of the current job
+        library = self._get_library()
+        if library:
+            library.add_track(track_location, self.service_name, track_id, track_info.tags.isrc, codec.name,
+                              track_info.name, track_info.artists[0], track_info.duration,
+                              self.global_settings['general']['download_quality'], track_info.codec.name)
+        self._set_track_status(track_id, 'completed', track_location, track_info.name, track_info.artists[0], track_info.duration)
+
+    def _get_conversion_flags(self, new_codec: CodecEnum) -> dict:
+        try:
+            conversion_flags = {CodecEnum[k.upper()]:v for k,v in self.global_settings['advanced']['conversion_flags'].items()}
+        except:
+            conversion_flags = {}
+            self.print('Warning: conversion_flags setting is invalid, using defaults')
+        return conversion_flags[new_codec] if new_codec in conversion_flags else {}
+
+    def _get_streamed_conversion(self, codec: CodecEnum, conversions: dict, download_info: TrackDownloadInfo) -> Optional[CodecEnum]:
+        # Returns the codec to convert to while downloading, or None if the track has to be converted after downloading.
+        # ffmpeg can't read MPEG-4 (ALAC) from a pipe as its index can be at the end of the file. Only lossless, non-spatial
+        # sources are streamed, everything else goes through the checks and warnings of the regular path
+        if not self.global_settings['advanced']['stream_conversions'] or codec not in conversions or \
+                download_info.download_type is not DownloadEnum.URL or download_info.different_codec or \
+                self.global_settings['advanced']['conversion_keep_original']:
+            return None
+        old_codec_data, new_codec_data = codec_data[codec], codec_data[conversions[codec]]
+        if old_codec_data.container not in streamable_containers or not old_codec_data.lossless or \
+                old_codec_data.spatial or new_codec_data.spatial:
+            return None
+        return conversions[codec]
+
+    def _download_converted(self, download_info: TrackDownloadInfo, new_codec: CodecEnum, track_location_name: str, track_id) -> str:
+        # Pipes the download into ffmpeg, so the original file is never written and only the converted one is
+        new_container = codec_data[new_codec].container
+        new_track_location = f'{track_location_name}.{new_container.name}'
+        # Keeps the extension so ffmpeg still picks the right muxer
+        part_location = f'{track_location_name}.part.{new_container.name}'
+
+        with self._conversion_slot(keep_download_slot=True):
+            self.report_progress(DownloadStageEnum.conversion, track_id)
+            process = ffmpeg.input('pipe:', hide_banner=None).output(
+                part_location,
+                acodec=new_codec.name.lower(),
+                **self._get_conversion_flags(new_codec),
+                loglevel='error'
+            ).overwrite_output().run_async(pipe_stdin=True, pipe_stderr=True)
+            try:
+                try:
+                    download_to_pipe(download_info.file_url, process.stdin, headers=download_info.file_url_headers, control=self.control,
+                                     progress_callback=self._get_bytes_callback(track_id))
+                except BrokenPipeError:
+                    pass  # ffmpeg quit early, its error is raised below
+                finally:
+                    process.stdin.close()
+                error_msg = process.stderr.read().decode('utf-8')
+                if process.wait():
+                    raise Exception(f'ffmpeg error converting to {new_codec.name.lower()}:\n{error_msg}')
+                os.replace(part_location, new_track_location)
+            except BaseException:
+                process.kill()
+                process.wait()
+                silentremove(part_location)
+                raise
+        return new_track_location
+
+    def _download_track_cover(self, track_id, track_info: TrackInfo, track_location_name: str) -> str:
+        cover_temp_location = create_temp_filename(self.temp_path)
+        covers_module_name = self.third_party_modules[ModuleModes.covers]
+        covers_module_name = covers_module_name if covers_module_name != self.service_name else None
+        if covers_module_name: self.newline()
+        self.print('Downloading artwork' + ((' with ' + covers_module_name) if covers_module_name else ''))
+
+        jpg_cover_options = CoverOptions(file_type=ImageFileTypeEnum.jpg, resolution=self.global_settings['covers']['main_resolution'], \
+            compression=CoverCompressionEnum[self.global_settings['covers']['main_compression'].lower()])
+        ext_cover_options = CoverOptions(file_type=ImageFileTypeEnum[self.global_settings['covers']['external_format']], \
+            resolution=self.global_settings['covers']['external_resolution'], \
+            compression=CoverCompressionEnum[self.global_settings['covers']['external_compression'].lower()])
+
+        if covers_module_name:
+            default_temp = download_to_temp(track_info.cover_url, artwork_settings={}, directory=self.temp_path)
+            test_cover_options = CoverOptions(file_type=ImageFileTypeEnum.jpg, resolution=get_image_resolution(default_temp), compression=CoverCompressionEnum.high)
+            cover_module = self.loaded_modules[covers_module_name]
+            rms_threshold = self.global_settings['advanced']['cover_variance_threshold']
+
+            results: list[SearchResult] = self.search_by_tags(covers_module_name, track_info)
+            self.print('Covers to test: ' + str(len(results)))
+
+            def fetch_candidate(r: SearchResult):
+                test_cover_info: CoverInfo = cover_module.get_track_cover(r.result_id, test_cover_options, **r.extra_kwargs)
+                return test_cover_info.url, download_to_temp(test_cover_info.url, artwork_settings={}, directory=self.temp_path)
+
+            def remove_candidate(future):
+                if not future.cancelled() and not future.exception(): silentremove(future.result()[1])
+
+            # Candidates are fetched ahead in parallel but compared in order, so the first match still wins
+            executor = ThreadPoolExecutor(max_workers=max(min(len(results), cover_candidate_workers), 1))
+            candidate_futures = [executor.submit(fetch_candidate, r) for r in results]
+            attempted_urls, candidates_used = [], 0
+            try:
+                for i, (r, future) in enumerate(zip(results, candidate_futures), start=1):
+                    candidates_used = i
+                    test_cover_url, test_temp = future.result()
+                    if test_cover_url in attempted_urls:
+                        silentremove(test_temp)
+                        continue
+                    attempted_urls.append(test_cover_url)
+                    rms = compare_images(default_temp, test_temp)
+                    silentremove(test_temp)
+                    self.print(f'Attempt {i} RMS: {rms!s}') # The smaller the root mean square, the closer the image is to the desired one
+                    if rms < rms_threshold:
+                        self.print('Match found below threshold ' + str(rms_threshold))
+                        jpg_cover_info: CoverInfo = cover_module.get_track_cover(r.result_id, jpg_cover_options, **r.extra_kwargs)
+                        download_file(jpg_cover_info.url, cover_temp_location, artwork_settings=self._get_artwork_settings(covers_module_name))
+                        silentremove(default_temp)
+                        if self.global_settings['covers']['save_external']:
+                            ext_cover_info: CoverInfo = cover_module.get_track_cover(r.result_id, ext_cover_options, **r.extra_kwargs)
+                            download_file(ext_cover_info.url, f'{track_location_name}.{ext_cover_info.file_type.name}', artwork_settings=self._get_artwork_settings(covers_module_name, is_external=True))
+                        break
+                else:
+                    self.print('Third-party module could not find cover, using fallback')
+                    shutil.move(default_temp, cover_temp_location)
+            finally:
+                # Don't wait for candidates after the match, just clean up whatever they download
+                for future in candidate_futures[candidates_used:]:
+                    future.cancel()
+                    future.add_done_callback(remove_candidate)
+                executor.shutdown(wait=False)
+        else:
+            download_file(track_info.cover_url, cover_temp_location, artwork_settings=self._get_artwork_settings())
+            if self.global_settings['covers']['save_external'] and ModuleModes.covers in self.module_settings[self.service_name].module_supported_modes:
+                ext_cover_info: CoverInfo = self.service.get_track_cover(track_id, ext_cover_options, **track_info.cover_extra_kwargs)
+                download_file(ext_cover_info.url, f'{track_location_name}.{ext_cover_info.file_type.name}', artwork_settings=self._get_artwork_settings(is_external=True))
+
+        return cover_temp_location
+
+    def _download_track_animated_cover(self, track_info: TrackInfo, track_location_name: str):
+        self.print('Downloading animated cover')
+        download_file(track_info.animated_cover_url, track_location_name + '_cover.mp4', enable_progress_bar=not self.oprinter.is_buffering)
+
+    def _get_track_lyrics(self, track_id, track_info: TrackInfo) -> LyricsInfo:
+        lyrics_info = LyricsInfo()
+        if self.third_party_modules[ModuleModes.lyrics] and self.third_party_modules[ModuleModes.lyrics] != self.service_name:
+            lyrics_module_name = self.third_party_modules[ModuleModes.lyrics]
+            self.print('Retrieving lyrics with ' + lyrics_module_name)
+            lyrics_module = self.loaded_modules[lyrics_module_name]
+
+            if lyrics_module_name != self.service_name:
+                results: list[SearchResult] = self.search_by_tags(lyrics_module_name, track_info)
+                lyrics_track_id = results[0].result_id if len(results) else None
+                extra_kwargs = results[0].extra_kwargs if len(results) else None
+            else:
+                lyrics_track_id = track_id
+                extra_kwargs = {}
+
+            if lyrics_track_id:
+                lyrics_info: LyricsInfo = lyrics_module.get_track_lyrics(lyrics_track_id, **extra_kwargs)
+                # if lyrics_info.embedded or lyrics_info.synced:
+                #     self.print('Lyrics retrieved')
+                # else:
+                #     self.print('Lyrics module could not find any lyrics.')
+            else:
+                self.print('Lyrics module could not find any lyrics.')
+        elif ModuleModes.lyrics in self.module_settings[self.service_name].module_supported_modes:
+            lyrics_info: LyricsInfo = self.service.get_track_lyrics(track_id, **track_info.lyrics_extra_kwargs)
+            # if lyrics_info.embedded or lyrics_info.synced:
+            #     self.print('Lyrics retrieved')
+            # else:
+            #     self.print('No lyrics available')
+
+        return lyrics_info
+
+    def _get_track_credits(self, track_id, track_info: TrackInfo) -> list:
+        credits_list = []
+        if self.third_party_modules[ModuleModes.credits] and self.third_party_modules[ModuleModes.credits] != self.service_name:
+            credits_module_name = self.third_party_modules[ModuleModes.credits]
+            self.print('Retrieving credits with ' + credits_module_name)
+            credits_module = self.loaded_modules[credits_module_name]
+
+            if credits_module_name != self.service_name:
+                results: list[SearchResult] = self.search_by_tags(credits_module_name, track_info)
+                credits_track_id = results[0].result_id if len(results) else None
+                extra_kwargs = results[0].extra_kwargs if len(results) else None
+            else:
+                credits_track_id = track_id
+                extra_kwargs = {}
+
+            if credits_track_id:
+                credits_list = credits_module.get_track_credits(credits_track_id, **extra_kwargs)
+                # if credits_list:
+                #     self.print('Credits retrieved')
+                # else:
+                #     self.print('Credits module could not find any credits.')
+            # else:
+            #     self.print('Credits module could not find any credits.')
+        elif ModuleModes.credits in self.module_settings[self.service_name].module_supported_modes:
+            self.print('Retrieving credits')
+            credits_list = self.service.get_track_credits(track_id, **track_info.credits_extra_kwargs)
+            # if credits_list:
+            #     self.print('Credits retrieved')
+            # else:
+            #     self.print('No credits available')
+
+        return credits_list
+
+    def _get_segment_settings(self):
+        # Modules listed in segmented_download_modules always use segments, every other module only above the size threshold
+        advanced = self.global_settings['advanced']
+        if self.service_name in advanced['segmented_download_modules']:
+            return {'segments': advanced['segmented_download_connections'], 'segment_threshold': 0}
+        elif advanced['segmented_download_min_size'] > 0:
+            return {'segments': advanced['segmented_download_connections'], 'segment_threshold': advanced['segmented_download_min_size'] * 1024 ** 2}
+        return {'segments': 1, 'segment_threshold': 0}
+
     def _get_artwork_settings(self, module_name = None, is_external = False):
         if not module_name:
             module_name = self.service_name
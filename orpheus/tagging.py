@@ -1,5 +1,6 @@
 import base64
 import logging
+import threading
 from dataclasses import asdict
 
 from PIL import Image
@@ -20,7 +21,57 @@ from utils.models import ContainerEnum, TrackInfo
 MP4Tags._padding = 0
 
 
-def tag_file(file_path: str, image_path: str, track_info: TrackInfo, credits_list: list, embedded_lyrics: str, container: ContainerEnum):
+class CoverArt:
+    # The cover of an album is embedded into every one of its tracks, so the file is only read and every picture block
+    # is only built once per container and then shared by all tag_file calls using the same CoverArt
+    def __init__(self, image_path: str):
+        self.image_path = image_path
+        self._data = None
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    @property
+    def data(self) -> bytes:
+        with self._lock:
+            if self._data is None:
+                with open(self.image_path, 'rb') as c:
+                    self._data = c.read()
+            return self._data
+
+    def get_block(self, container: ContainerEnum):
+        # Returns the picture block for container, ID3 has none as its APIC frames are changed when saving as ID3v2.3
+        data = self.data
+        with self._lock:
+            if container not in self._blocks:
+                self._blocks[container] = self._create_block(container, data)
+            return self._blocks[container]
+
+    def _create_block(self, container: ContainerEnum, data: bytes):
+        if container == ContainerEnum.flac:
+            picture = Picture()
+            picture.data = data
+            picture.type = PictureType.COVER_FRONT
+            picture.mime = u'image/jpeg'
+            return picture
+        elif container == ContainerEnum.m4a:
+            return MP4Cover(data, imageformat=MP4Cover.FORMAT_JPEG)
+        # If you want to have a cover in only a few applications, then this technically works for Opus
+        elif container in {ContainerEnum.ogg, ContainerEnum.opus}:
+            with Image.open(self.image_path) as im:
+                width, height = im.size
+            picture = Picture()
+            picture.data = data
+            picture.type = 17
+            picture.desc = u'Cover Art'
+            picture.mime = u'image/jpeg'
+            picture.width = width
+            picture.height = height
+            picture.depth = 24
+            return base64.b64encode(picture.write()).decode('ascii')
+        return None
+
+
+def tag_file(file_path: str, image_path: str, track_info: TrackInfo, credits_list: list, embedded_lyrics: str, container: ContainerEnum, cover_art: CoverArt = None):
     if container == ContainerEnum.flac:
         tagger = FLAC(file_path)
     elif container == ContainerEnum.opus:
@@ -192,19 +243,15 @@ def tag_file(file_path: str, image_path: str, track_info: TrackInfo, credits_lis
 
     # only embed the cover when embed_cover is set to True
     if image_path:
-        with open(image_path, 'rb') as c:
-            data = c.read()
-        picture = Picture()
-        picture.data = data
+        if not cover_art or cover_art.image_path != image_path: cover_art = CoverArt(image_path)
+        data = cover_art.data
 
         # Check if cover is smaller than 16MB
-        if len(picture.data) < picture._MAX_SIZE:
+        if len(data) < Picture._MAX_SIZE:
             if container == ContainerEnum.flac:
-                picture.type = PictureType.COVER_FRONT
-                picture.mime = u'image/jpeg'
-                tagger.add_picture(picture)
+                tagger.add_picture(cover_art.get_block(container))
             elif container == ContainerEnum.m4a:
-                tagger['covr'] = [MP4Cover(data, imageformat=MP4Cover.FORMAT_JPEG)]
+                tagger['covr'] = [cover_art.get_block(container)]
             elif container == ContainerEnum.mp3:
                 # Never access protected attributes, too bad!
                 tagger.tags._EasyID3__id3._DictProxy__dict['APIC'] = APIC(
@@ -214,20 +261,10 @@ def tag_file(file_path: str, image_path: str, track_info: TrackInfo, credits_lis
                     desc='Cover',  # name
                     data=data
                 )
-            # If you want to have a cover in only a few applications, then this technically works for Opus
             elif container in {ContainerEnum.ogg, ContainerEnum.opus}:
-                im = Image.open(image_path)
-                width, height = im.size
-                picture.type = 17
-                picture.desc = u'Cover Art'
-                picture.mime = u'image/jpeg'
-                picture.width = width
-                picture.height = height
-                picture.depth = 24
-                encoded_data = base64.b64encode(picture.write())
-                tagger['metadata_block_picture'] = [encoded_data.decode('ascii')]
+                tagger['metadata_block_picture'] = [cover_art.get_block(container)]
         else:
-            print(f'\tCover file size is too large, only {(picture._MAX_SIZE / 1024 ** 2):.2f}MB are allowed. Track '
+            print(f'\tCover file size is too large, only {(Picture._MAX_SIZE / 1024 ** 2):.2f}MB are allowed. Track '
                   f'will not have cover saved.')
 
     try:
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# Add parent directory to Python path to allow importing modules
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
+
+from tests.file_server import FileServer
+
+
+@pytest.fixture
+def file_server():
+    """Starts FileServer instances, file_server(data, **options), and stops them after the test."""
+    servers = []
+
+    def start(data: bytes, **options) -> FileServer:
+        servers.append(FileServer(data, **options).start())
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
@@ -0,0 +1,102 @@
+import gzip
+import http.server
+import re
+import threading
+import time
+
+
+class FileServer:
+    """Local HTTP server for a single file, with ETag and Range support.
+
+    drops is how many responses are cut off after drop_after bytes by closing the connection, throttle limits every
+    connection to that many bytes per second. requests records the (Range, If-Range) headers of every request.
+    gzip sends the whole file gzip encoded if the client accepts it, or always if it is 'always', like some CDNs do.
+    """
+
+    etag = '"v1"'
+
+    def __init__(self, data: bytes, drop_after: int = 0, drops: int = 0, throttle: float = 0, gzip=False):
+        self.data, self.drop_after, self.drops, self.throttle, self.gzip = data, drop_after, drops, throttle, gzip
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self._create_handler())
+        self._server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}/file'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _take_drop(self) -> bool:
+        with self._lock:
+            if self.drops <= 0: return False
+            self.drops -= 1
+            return True
+
+    def _create_handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                range_header, if_range = self.headers.get('Range'), self.headers.get('If-Range')
+                with server._lock:
+                    server.requests.append((range_header, if_range))
+
+                data, status = server.data, 200
+                start, end = 0, len(data) - 1
+                encoded = server.gzip == 'always' or (server.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''))
+                if encoded:
+                    # Ranges of the encoded file aren't supported
+                    body = gzip.compress(data)
+                    self.send_response(200)
+                    self.send_header('ETag', server.etag)
+                    self.send_header('Content-Encoding', 'gzip')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if range_header and (not if_range or if_range == server.etag):
+                    match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), end) if match.group(2) else end
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{len(data)}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    status = 206
+
+                body = data[start:end + 1]
+                self.send_response(status)
+                self.send_header('ETag', server.etag)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(len(body)))
+                if status == 206: self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+                self.end_headers()
+
+                if len(body) > server.drop_after and server._take_drop():
+                    self.wfile.write(body[:server.drop_after])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+
+                step = 64 * 1024
+                try:
+                    for i in range(0, len(body), step):
+                        self.wfile.write(body[i:i + step])
+                        if server.throttle: time.sleep(step / server.throttle)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # the client stopped reading, f.e. a segment that was cancelled
+
+        return Handler
@@ -0,0 +1,28 @@
+from utils.utils import download_file
+
+# Compresses well, so an encoded response is a lot smaller than the file
+data = b'OrpheusDL ' * 200000
+
+
+def test_download_asks_for_unencoded_file(file_server, tmp_path):
+    server = file_server(data, gzip=True)
+    location = str(tmp_path / 'track.flac')
+
+    download_file(server.url, location, segments=4)
+
+    with open(location, 'rb') as f:
+        assert f.read() == data
+    # The first segment reuses the initial response, the other three are fetched with their own ranges
+    assert len(server.requests) == 4
+
+
+def test_encoded_download_is_not_size_checked(file_server, tmp_path):
+    server = file_server(data, gzip='always')
+    location = str(tmp_path / 'track.flac')
+
+    # The Content-Length of the encoded body doesn't match the decoded file, which must not count as incomplete
+    download_file(server.url, location, segments=4)
+
+    with open(location, 'rb') as f:
+        assert f.read() == data
+    assert len(server.requests) == 1
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+import requests
+
+from utils.utils import download_file
+
+
+def test_dropped_download_resumes_byte_exact(file_server, tmp_path):
+    data = os.urandom(3 * 1024 * 1024)
+    server = file_server(data, drop_after=1024 * 1024, drops=1)
+    location = str(tmp_path / 'track.flac')
+
+    # None is what TrackDownloadInfo.file_url_headers defaults to
+    download_file(server.url, location, headers=None)
+
+    with open(location, 'rb') as f:
+        assert f.read() == data
+    assert not os.path.exists(location + '.part') and not os.path.exists(location + '.part.json')
+    # The retry continued where the dropped response stopped, validated by the ETag
+    assert len(server.requests) == 2 and server.requests[0] == (None, None)
+    assert server.requests[1][0] != 'bytes=0-' and server.requests[1][1] == server.etag
+
+
+def test_partial_download_resumes_byte_exact(file_server, tmp_path):
+    data = os.urandom(2 * 1024 * 1024)
+    server = file_server(data, drop_after=512 * 1024, drops=3)
+    location = str(tmp_path / 'track.flac')
+
+    # Every retry of the first run is cut off as well, so only the .part file is left behind
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        download_file(server.url, location)
+    assert not os.path.exists(location)
+    part_size = os.path.getsize(location + '.part')
+    assert 0 < part_size < len(data)
+
+    # A later run picks the .part file up again
+    download_file(server.url, location)
+    with open(location, 'rb') as f:
+        assert f.read() == data
+    assert server.requests[-1] == (f'bytes={part_size}-', server.etag)
@@ -0,0 +1,77 @@
+import pickle
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+from orpheus import journal as journal_module
+from orpheus.journal import JobJournal
+
+
+def create_job(journal: JobJournal, owner_host: str, owner_pid: int, heartbeat: float) -> str:
+    job_id = journal.create_job({}, {}, None, 'downloads/')
+    journal._execute('UPDATE jobs SET owner_host = ?, owner_pid = ?, heartbeat = ? WHERE job_id = ?',
+                     (owner_host, owner_pid, heartbeat, job_id))
+    return job_id
+
+
+def orphaned_job_ids(journal: JobJournal) -> set:
+    return {job.job_id for job in journal.get_orphaned_jobs()}
+
+
+def test_jobs_of_this_process_are_orphaned_once_they_stop(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal.db'))
+    job_id = journal.create_job({}, {}, None, 'downloads/')
+
+    journal.start_heartbeat(job_id)
+    assert orphaned_job_ids(journal) == set()
+    # Still marked as running, but no longer run by this process, like a job of a previous process with the same PID
+    journal.stop_heartbeat(job_id)
+    assert orphaned_job_ids(journal) == {job_id}
+
+
+def test_jobs_of_other_processes_are_orphaned_once_the_process_is_gone(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal.db'))
+    process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    try:
+        running_job_id = create_job(journal, socket.gethostname(), process.pid, time.time())
+        assert orphaned_job_ids(journal) == set()
+    finally:
+        process.kill()
+        process.wait()
+    assert orphaned_job_ids(journal) == {running_job_id}
+
+    # Failed and cancelled jobs are never resumed automatically
+    journal.set_job_status(running_job_id, 'failed')
+    assert orphaned_job_ids(journal) == set()
+
+
+def test_jobs_of_other_hosts_are_orphaned_once_their_heartbeat_is_stale(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal.db'))
+    create_job(journal, 'other-host', 1, time.time())
+    stale_job_id = create_job(journal, 'other-host', 1, time.time() - journal_module.stale_after - 1)
+    assert orphaned_job_ids(journal) == {stale_job_id}
+
+
+def test_claiming_a_job_makes_this_process_its_owner(tmp_path):
+    journal = JobJournal(str(tmp_path / 'journal.db'))
+    job_id = create_job(journal, 'other-host', 1, 0)
+    journal.claim_job(job_id)
+    journal.start_heartbeat(job_id)
+    assert orphaned_job_ids(journal) == set()
+    journal.stop_heartbeat(job_id)
+
+
+def test_journals_of_older_versions_get_the_owner_columns(tmp_path):
+    location = str(tmp_path / 'journal.db')
+    connection = sqlite3.connect(location)
+    connection.execute('CREATE TABLE jobs (job_id TEXT PRIMARY KEY, status TEXT, request BLOB, created REAL, updated REAL)')
+    connection.execute("INSERT INTO jobs VALUES ('old', 'running', ?, 0, 0)", (pickle.dumps({}),))
+    connection.commit()
+    connection.close()
+
+    journal = JobJournal(location)
+    # Without a heartbeat the last update counts, which is long ago
+    assert orphaned_job_ids(journal) == {'old'}
+    assert journal.get_job(journal.create_job({}, {}, None, 'downloads/')).owner_pid is not None
@@ -0,0 +1,60 @@
+import sqlite3
+
+from orpheus.library import LibraryIndex, LibraryTrack
+from orpheus.music_downloader import Downloader
+
+
+def create_downloader(download_quality: str, codec_conversions: dict) -> Downloader:
+    # Only the settings are needed to compare library tracks with them
+    downloader = Downloader.__new__(Downloader)
+    downloader.global_settings = {
+        'general': {'download_quality': download_quality},
+        'advanced': {'codec_conversions': codec_conversions, 'enable_undesirable_conversions': False}
+    }
+    return downloader
+
+
+def library_track(codec: str, quality=None, source_codec=None) -> LibraryTrack:
+    return LibraryTrack('/music/track', 'qobuz', '1', None, codec, 0, 0, quality=quality, source_codec=source_codec)
+
+
+def test_library_tracks_only_match_the_settings_they_were_downloaded_with():
+    downloader = create_downloader('hifi', {'flac': 'alac'})
+    assert downloader._matches_download_settings(library_track('ALAC', 'hifi', 'FLAC'))
+    assert downloader._matches_download_settings(library_track('ALAC', 'lossless', 'FLAC')) is False
+    assert downloader._matches_download_settings(library_track('FLAC', 'hifi', 'FLAC')) is False
+    assert create_downloader('hifi', {})._matches_download_settings(library_track('FLAC', 'hifi', 'FLAC'))
+    # Tracks indexed before the settings were recorded
+    assert downloader._matches_download_settings(library_track('FLAC')) is None
+
+
+def test_refused_conversions_keep_matching():
+    # Lossy to lossless conversions are skipped, so the track stays AAC
+    downloader = create_downloader('high', {'aac': 'flac'})
+    assert downloader._matches_download_settings(library_track('AAC', 'high', 'AAC'))
+
+
+def test_library_records_the_download_settings(tmp_path):
+    path = tmp_path / 'track.flac'
+    path.write_bytes(b'fLaC')
+    library = LibraryIndex(str(tmp_path / 'library.db'))
+    library.add_track(str(path), 'qobuz', 1, 'usabc1234567', 'FLAC', quality='hifi', source_codec='FLAC')
+
+    track = library.get_track('qobuz', 1)
+    assert (track.codec, track.quality, track.source_codec) == ('FLAC', 'hifi', 'FLAC')
+    assert library.get_track_by_path(str(path)) == track == library.get_track_by_isrc('USABC1234567')
+
+
+def test_libraries_of_older_versions_get_the_settings_columns(tmp_path):
+    path = tmp_path / 'track.flac'
+    path.write_bytes(b'fLaC')
+    location = str(tmp_path / 'library.db')
+    connection = sqlite3.connect(location)
+    connection.execute('CREATE TABLE tracks (path TEXT PRIMARY KEY, service TEXT, track_id TEXT, isrc TEXT, codec TEXT, '
+                       'size INTEGER, mtime REAL, name TEXT, artist TEXT, duration INTEGER)')
+    connection.execute("INSERT INTO tracks VALUES (?, 'qobuz', '1', NULL, 'FLAC', 4, 0, NULL, NULL, NULL)", (str(path),))
+    connection.commit()
+    connection.close()
+
+    track = LibraryIndex(location).get_track('qobuz', 1)
+    assert track.codec == 'FLAC' and track.quality is None and track.source_codec is None
@@ -0,0 +1,34 @@
+from utils.events import EventManager, EventType
+from utils.models import DownloadProgress, DownloadStageEnum
+from utils.progress import ProgressReporter
+
+
+def run_artist(albums):
+    """Feeds the progress of an artist job with albums of the given track counts, returns the reported percentages
+    after every finished track."""
+    events = EventManager()
+    reporter = ProgressReporter('artist', events)
+    percentages = []
+    events.subscribe('artist', EventType.PROGRESS, lambda event: percentages.append(event.data['progress']))
+
+    reporter.handle_progress(DownloadProgress(DownloadStageEnum.media, media_index=1, media_total=1))
+    finished = []
+    for album_index, track_total in enumerate(albums, start=1):
+        for track_index in range(1, track_total + 1):
+            track = dict(media_index=1, media_total=1, track_index=track_index, track_total=track_total,
+                         track_id=f'{album_index}-{track_index}', album_index=album_index, album_total=len(albums))
+            reporter.handle_progress(DownloadProgress(DownloadStageEnum.track, **track))
+            reporter.handle_progress(DownloadProgress(DownloadStageEnum.track_completed, **track))
+            finished.append(percentages[-1])
+    return finished
+
+
+def test_artist_progress_counts_albums():
+    # Finishing the first album is a third of the artist, not all of it
+    finished = run_artist([2, 4, 1])
+    assert finished == [16, 33, 41, 50, 58, 66, 100]
+
+
+def test_artist_progress_only_goes_up():
+    finished = run_artist([1, 10])
+    assert finished == sorted(finished) and finished[0] == 50 and finished[-1] == 100
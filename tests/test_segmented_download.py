@@ -0,0 +1,51 @@
+import json
+import os
+
+import pytest
+import requests
+
+from utils.utils import download_file
+
+
+def test_segmented_download_is_byte_exact(file_server, tmp_path):
+    data = os.urandom(4 * 1024 * 1024 + 123)
+    server = file_server(data)
+    location = str(tmp_path / 'track.flac')
+
+    download_file(server.url, location, headers=None, segments=4)
+
+    with open(location, 'rb') as f:
+        assert f.read() == data
+    # The first segment reuses the initial response, the other three are fetched with their own ranges
+    assert server.requests[0] == (None, None)
+    assert sorted(server.requests[1:]) == [(f'bytes={start}-{end}', server.etag) for start, end in
+                                           ((1048607, 2097213), (2097214, 3145820), (3145821, 4194426))]
+
+
+def test_small_files_are_not_segmented(file_server, tmp_path):
+    server = file_server(os.urandom(1024))
+    download_file(server.url, str(tmp_path / 'cover.jpg'), segments=4, segment_threshold=2048)
+    assert server.requests == [(None, None)]
+
+
+def test_dropped_segments_resume_byte_exact(file_server, tmp_path):
+    data = os.urandom(4 * 1024 * 1024)
+    # Every response of the first run is cut off, so all of its retries fail
+    server = file_server(data, drop_after=256 * 1024, drops=1000)
+    location = str(tmp_path / 'track.flac')
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        download_file(server.url, location, segments=4)
+    # The progress of every segment is kept in the .part.json
+    with open(location + '.part.json') as f:
+        segments = json.load(f)['segments']
+    assert len(segments) == 4 and sum(done for _, _, done in segments) > 0
+    request_count = len(server.requests)
+
+    server.drops = 0
+    download_file(server.url, location, segments=4)
+    with open(location, 'rb') as f:
+        assert f.read() == data
+    # The second run only asks for the rest of each segment
+    assert sorted(server.requests[request_count:]) == sorted(
+        (f'bytes={start + done}-{end}', server.etag) for start, end, done in segments if start + done <= end)
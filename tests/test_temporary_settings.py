@@ -0,0 +1,58 @@
+from utils.utils import TemporarySettingsStore
+
+
+def session(store: TemporarySettingsStore, module: str) -> dict:
+    with store.lock:
+        return store.load()['modules'][module]['sessions']['default']
+
+
+def set_token(store: TemporarySettingsStore, module: str, token: str):
+    with store.lock:
+        session(store, module)['bearer'] = token
+        store.mark_changed(module)
+
+
+def create_sessions(location: str):
+    modules = {module: {'selected': 'default', 'sessions': {'default': {'bearer': ''}}} for module in ('qobuz', 'tidal')}
+    TemporarySettingsStore(location).replace({'advancedmode': False, 'modules': modules})
+
+
+def test_writes_of_other_processes_are_kept(tmp_path):
+    location = str(tmp_path / 'loginstorage.bin')
+    create_sessions(location)
+    # Two stores of the same file stand in for the command line and the web interface
+    first, second = TemporarySettingsStore(location), TemporarySettingsStore(location)
+
+    set_token(first, 'qobuz', 'qobuz token')
+    set_token(second, 'tidal', 'tidal token')
+    first.flush()
+    second.flush()
+
+    stored = TemporarySettingsStore(location)
+    assert session(stored, 'qobuz')['bearer'] == 'qobuz token'
+    assert session(stored, 'tidal')['bearer'] == 'tidal token'
+
+
+def test_reads_see_writes_of_other_processes(tmp_path):
+    location = str(tmp_path / 'loginstorage.bin')
+    create_sessions(location)
+    first, second = TemporarySettingsStore(location), TemporarySettingsStore(location)
+    assert session(first, 'qobuz')['bearer'] == ''
+
+    set_token(second, 'qobuz', 'refreshed token')
+    second.flush()
+    assert session(first, 'qobuz')['bearer'] == 'refreshed token'
+
+
+def test_unwritten_changes_survive_a_reload(tmp_path):
+    location = str(tmp_path / 'loginstorage.bin')
+    create_sessions(location)
+    first, second = TemporarySettingsStore(location), TemporarySettingsStore(location)
+
+    set_token(first, 'qobuz', 'not written yet')
+    set_token(second, 'tidal', 'tidal token')
+    second.flush()
+    # Reading reloads the file, the pending change of this process stays
+    assert session(first, 'qobuz')['bearer'] == 'not written yet'
+    assert session(first, 'tidal')['bearer'] == 'tidal token'
+    first.flush()
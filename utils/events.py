@@ -1,8 +1,9 @@
-from typing import Callable, Dict, List, Any
+from typing import Callable, Dict, List, Any, Optional
 import threading
 import time
 import logging
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 from enum import Enum
 
 # Configure logging
@@ -15,20 +16,40 @@ class EventType(Enum):
     ERROR = "error"
     COMPLETE = "complete"
 
+# Event types of which every event is kept (up to the message cap), of the others only the latest one is kept
+LOGGED_EVENT_TYPES = {EventType.MESSAGE, EventType.ERROR}
+
 @dataclass
 class DownloadEvent:
     download_id: str
     event_type: EventType
     data: Dict[str, Any]
-    timestamp: float = time.time()
+    timestamp: float = field(default_factory=time.time)
+    sequence: int = 0  # Set by EventManager.emit, increases with every event of a download
+
+class EventHistory:
+    """Bounded event history of a single download."""
+
+    def __init__(self, max_messages: int):
+        # A ring buffer per event type, the ones that aren't logged only hold their latest event
+        self.events: Dict[EventType, deque] = {
+            event_type: deque(maxlen=max_messages if event_type in LOGGED_EVENT_TYPES else 1) for event_type in EventType
+        }
+        self.sequence = 0
+
+    def add(self, event: DownloadEvent):
+        self.sequence += 1
+        event.sequence = self.sequence
+        self.events[event.event_type].append(event)
 
 class EventManager:
-    def __init__(self):
+    def __init__(self, max_messages: int = 1000):
         logger.debug("Initializing EventManager")
+        self.max_messages = max_messages  # How many messages and errors are kept per download
         self._subscribers: Dict[str, Dict[EventType, List[Callable]]] = {}
-        self._event_history: Dict[str, List[DownloadEvent]] = {}
+        self._event_history: Dict[str, EventHistory] = {}
         self._lock = threading.Lock()
-    
+
     def subscribe(self, download_id: str, event_type: EventType, callback: Callable):
         """Subscribe to events for a specific download ID and event type."""
         logger.debug(f"Subscribing to {event_type.value} events for download ID: {download_id}")
@@ -39,7 +60,7 @@ class EventManager:
                 self._subscribers[download_id][event_type] = []
             self._subscribers[download_id][event_type].append(callback)
             logger.debug(f"Current subscribers for {download_id}: {len(self._subscribers[download_id][event_type])}")
-    
+
     def unsubscribe(self, download_id: str, event_type: EventType, callback: Callable):
         """Unsubscribe from events for a specific download ID and event type."""
         logger.debug(f"Unsubscribing from {event_type.value} events for download ID: {download_id}")
@@ -48,41 +69,42 @@ class EventManager:
                 if callback in self._subscribers[download_id][event_type]:
                     self._subscribers[download_id][event_type].remove(callback)
                     logger.debug(f"Remaining subscribers for {download_id}: {len(self._subscribers[download_id][event_type])}")
-    
+
     def emit(self, event: DownloadEvent):
         """Emit an event to all subscribers for the specific download ID and event type."""
-        logger.debug(f"Emitting event: {event.event_type.value} for download ID: {event.download_id}")
         with self._lock:
             # Store event in history
             if event.download_id not in self._event_history:
-                self._event_history[event.download_id] = []
-            self._event_history[event.download_id].append(event)
-            
-            # Notify subscribers
-            if event.download_id in self._subscribers and event.event_type in self._subscribers[event.download_id]:
-                callbacks = self._subscribers[event.download_id][event.event_type]
-                logger.debug(f"Notifying {len(callbacks)} subscribers for {event.download_id}")
-                for callback in callbacks:
-                    try:
-                        callback(event)
-                    except Exception as e:
-                        logger.error(f"Error in event callback for {event.download_id}: {str(e)}")
-    
+                self._event_history[event.download_id] = EventHistory(self.max_messages)
+            self._event_history[event.download_id].add(event)
+            callbacks = list(self._subscribers.get(event.download_id, {}).get(event.event_type, []))
+
+        # Subscribers are notified outside of the lock, so they can use the event manager themselves
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Error in event callback for {event.download_id}: {str(e)}")
+
     def get_events(self, download_id: str, event_type: EventType = None) -> List[DownloadEvent]:
-        """Get all events for a specific download ID, optionally filtered by event type."""
-        logger.debug(f"Getting events for download ID: {download_id}, event type: {event_type.value if event_type else 'all'}")
+        """Get the kept events for a specific download ID in the order they were emitted, optionally filtered by event type."""
         with self._lock:
             if download_id not in self._event_history:
-                logger.debug(f"No events found for download ID: {download_id}")
                 return []
-            
-            events = self._event_history[download_id]
+
+            history = self._event_history[download_id]
             if event_type:
-                events = [e for e in events if e.event_type == event_type]
-            
-            logger.debug(f"Found {len(events)} events for {download_id}")
-            return events
-    
+                return list(history.events[event_type])
+            return sorted((e for events in history.events.values() for e in events), key=lambda e: e.sequence)
+
+    def get_latest_event(self, download_id: str, event_type: EventType) -> Optional[DownloadEvent]:
+        """Get the latest event of a type for a specific download ID."""
+        with self._lock:
+            if download_id not in self._event_history:
+                return None
+            events = self._event_history[download_id].events[event_type]
+            return events[-1] if events else None
+
     def clear_events(self, download_id: str):
         """Clear all events for a specific download ID."""
         logger.debug(f"Clearing events for download ID: {download_id}")
@@ -94,4 +116,4 @@ class EventManager:
             logger.debug(f"Cleared events and subscribers for {download_id}")
 
 # Global instance
-event_manager = EventManager() 
\ No newline at end of file
+event_manager = EventManager()
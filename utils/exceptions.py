@@ -30,4 +30,10 @@ class ModuleSettingsNotSet(Exception):
     pass # TODO: will either tell you to add settings for a specific module in simple sessions mode, or the command needed to set a setting in advanced sessions mode
 
 class TagSavingFailure(Exception):
+    pass
+
+class DownloadIncompleteError(Exception):
+    pass
+
+class DownloadCancelledError(Exception):
     pass
\ No newline at end of file
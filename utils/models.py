@@ -1,17 +1,35 @@
-import os
+import os, threading
+from contextlib import contextmanager
 from dataclasses import dataclass, field
 from enum import Flag, auto
 from types import ClassMethodDescriptorType, FunctionType
 from typing import Optional
 
-from utils.utils import read_temporary_setting, set_temporary_setting
+from utils.utils import ConnectionPoolManager, read_temporary_setting, set_temporary_setting
 
 
 class Oprinter:  # Could change to inherit from print class instead, but this is fine
     def __init__(self):
-        self.indent_number = 1
+        self._indent_number = 1
         self.printing_enabled = True
         self.multiplier = 8
+        # Per-thread output buffer and indent, used while tracks are downloaded concurrently
+        self._local = threading.local()
+
+    @property
+    def indent_number(self):
+        return getattr(self._local, 'indent_number', self._indent_number)
+
+    @indent_number.setter
+    def indent_number(self, number: int):
+        if hasattr(self._local, 'indent_number'):
+            self._local.indent_number = number
+        else:
+            self._indent_number = number
+
+    @property
+    def is_buffering(self):
+        return getattr(self._local, 'buffer', None) is not None
 
     def set_indent_number(self, number: int):
         try:
@@ -27,9 +45,33 @@ class Oprinter:  # Could change to inherit from print class instead, but this is
 
         self.indent_number = number * self.multiplier
 
+    def _output(self, line: str):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            buffer.append(line)
+        else:
+            print(line)
+
     def oprint(self, inp: str, drop_level: int = 0):
         if self.printing_enabled:
-            print(' ' * (self.indent_number - drop_level * self.multiplier) + inp)
+            self._output(' ' * (self.indent_number - drop_level * self.multiplier) + inp)
+
+    def newline(self):
+        if self.printing_enabled:
+            self._output('')
+
+    @contextmanager
+    def buffered(self, indent_number: int = None):
+        # Collects everything printed by the current thread so it can be flushed in order later
+        self._local.buffer, self._local.indent_number = [], self.indent_number if indent_number is None else indent_number
+        try:
+            yield self._local.buffer
+        finally:
+            del self._local.buffer, self._local.indent_number
+
+    def flush(self, lines: list):
+        for line in lines:
+            self._output(line)
 
 
 class CodecEnum(Flag):
@@ -190,6 +232,33 @@ class MediaIdentification:
     extra_kwargs: Optional[dict] = field(default_factory=dict)
 
 
+class DownloadStageEnum(Flag):
+    media = auto()  # A media of the job starts
+    track = auto()  # A track starts
+    download = auto()  # Bytes of the track's file arrived
+    conversion = auto()
+    tagging = auto()
+    track_completed = auto()  # Also sent for tracks that are skipped because they already exist
+    track_failed = auto()
+    media_completed = auto()
+
+
+@dataclass
+class DownloadProgress:
+    stage: DownloadStageEnum
+    job_id: Optional[str] = None
+    media_index: int = 0  # Counting from 1, of media_total media in the job
+    media_total: int = 0
+    track_index: int = 0  # Counting from 1, of track_total tracks in the album or playlist, 0 for single tracks
+    track_total: int = 0
+    track_id: Optional[str] = None
+    bytes_done: int = 0
+    bytes_total: Optional[int] = None  # None if the server doesn't send the size
+    # Counting from 1, of album_total parts of an artist (its albums, then its separate tracks), 0 outside of artists
+    album_index: int = 0
+    album_total: int = 0
+
+
 class QualityEnum(Flag):
     MINIMUM = auto()
     LOW = auto()
@@ -240,6 +309,7 @@ class ModuleController:
     orpheus_options: OrpheusOptions
     get_current_timestamp: FunctionType
     printer_controller: Oprinter
+    connection_pool: ConnectionPoolManager
     module_error: ClassMethodDescriptorType  # Will eventually be deprecated *sigh*
 
 
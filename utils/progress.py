@@ -1,16 +1,18 @@
 from typing import Optional
+import threading
 import time
 import logging
-from .events import EventManager, EventType, DownloadEvent
+from .events import EventManager, EventType, DownloadEvent, event_manager
+from .models import DownloadProgress, DownloadStageEnum
 
 # Configure logging
 logger = logging.getLogger('progress-reporter')
 
 class ProgressReporter:
-    def __init__(self, download_id: str):
+    def __init__(self, download_id: str, event_manager: EventManager = event_manager):
         logger.debug(f"Initializing ProgressReporter for download ID: {download_id}")
         self.download_id = download_id
-        self.event_manager = EventManager()
+        self.event_manager = event_manager
         self.total_items = 0
         self.current_item = 0
         self.last_progress = 0
@@ -18,6 +20,16 @@ class ProgressReporter:
         self.update_interval = 0.5  # Minimum time between progress updates in seconds
         self.indent_number = 0
         self.completion_detected = False
+        # State of handle_progress, which is called from every thread downloading a track of the job
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._first_progress = None
+        self._album_index = 0
+        self._track_total = 0
+        self._finished_tracks = set()
+        self._track_fractions = {}  # Track ID -> downloaded part of the tracks that are running
+        self._track_bytes = {}  # Track ID -> bytes downloaded of it so far
+        self._bytes_downloaded = 0
     
     def set_indent_number(self, number: int):
         """Set the indent number for message formatting."""
@@ -54,6 +66,65 @@ class ProgressReporter:
             else:
                 logger.debug(f"Skipping progress update due to rate limiting for download ID {self.download_id}")
     
+    def handle_progress(self, progress: DownloadProgress):
+        """Turn the structured progress of a Downloader into progress events, used as its progress_callback."""
+        with self._lock:
+            now = time.time()
+            stage, track_id = progress.stage, progress.track_id
+            # The tracks are counted per album, so they start over with every media and every album of an artist
+            if stage is DownloadStageEnum.media or progress.album_index != self._album_index:
+                self._album_index, self._track_total = progress.album_index, 0
+                self._finished_tracks, self._track_fractions, self._track_bytes = set(), {}, {}
+            if stage is DownloadStageEnum.track:
+                self._track_total = progress.track_total
+                self._track_fractions[track_id] = 0
+            elif stage is DownloadStageEnum.download:
+                # The bytes a resumed .part file already had don't count towards the throughput
+                self._track_bytes.setdefault(track_id, progress.bytes_done)
+                self._bytes_downloaded += max(progress.bytes_done - self._track_bytes.get(track_id, 0), 0)
+                self._track_bytes[track_id] = progress.bytes_done
+                if progress.bytes_total:
+                    self._track_fractions[track_id] = progress.bytes_done / progress.bytes_total
+            elif stage in (DownloadStageEnum.track_completed, DownloadStageEnum.track_failed):
+                self._track_fractions.pop(track_id, None)
+                self._finished_tracks.add(track_id)
+
+            # Single tracks have no track total, they are the only track of their media
+            if stage is DownloadStageEnum.media_completed:
+                media_fraction = 1
+            else:
+                media_fraction = min((len(self._finished_tracks) + sum(self._track_fractions.values())) / (self._track_total or 1), 1)
+                # Artists count the albums done, plus the part of the current one
+                if progress.album_total:
+                    media_fraction = min((progress.album_index - 1 + media_fraction) / progress.album_total, 1)
+            # The album total of an artist shrinks once its separate tracks are known, so progress only ever goes up
+            percentage = int((progress.media_index - 1 + media_fraction) / (progress.media_total or 1) * 100)
+            percentage = max(percentage, self.last_progress)
+            if self._first_progress is None:
+                self._first_progress = percentage
+
+            # Bytes arrive many times a second, the other stages are always reported
+            if stage is DownloadStageEnum.download and now - self.last_update_time < self.update_interval:
+                return
+            self.last_update_time, self.last_progress = now, percentage
+
+            elapsed = now - self._started
+            eta = int(elapsed * (100 - percentage) / (percentage - self._first_progress)) if percentage > self._first_progress else None
+            data = {
+                "current": progress.media_index, "total": progress.media_total, "progress": percentage, "stage": stage.name,
+                "album_index": progress.album_index, "album_total": progress.album_total,
+                "track_index": progress.track_index, "track_total": progress.track_total, "track_id": track_id,
+                "bytes_done": progress.bytes_done, "bytes_total": progress.bytes_total,
+                "speed": int(self._bytes_downloaded / elapsed) if elapsed else 0, "eta": eta
+            }
+
+        self.event_manager.emit(DownloadEvent(download_id=self.download_id, event_type=EventType.PROGRESS, data=data))
+        if stage is DownloadStageEnum.media:
+            self.report_message(f"Downloading {progress.media_index}/{progress.media_total}")
+        elif stage in (DownloadStageEnum.track_completed, DownloadStageEnum.track_failed):
+            position = f"{progress.track_index}/{progress.track_total}" if progress.track_index else track_id
+            self.report_message(f"Track {position} {'downloaded' if stage is DownloadStageEnum.track_completed else 'failed'}")
+
     def report_message(self, message: str, level: int = 0):
         """Report a message for the current download."""
         # Add timestamp to message
@@ -0,0 +1,50 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteStore:
+    # Base of the SQLite databases that threads and processes share: the job journal, the library index and the job
+    # store of the web interface. The database is only created once it's used, in WAL mode so reads don't wait for a
+    # writing process, and a single connection is shared by the threads of a process behind a lock
+    schema = ''  # CREATE TABLE IF NOT EXISTS ... statements run on connecting
+    migrations = ()  # ALTER TABLE ... ADD COLUMN statements for databases created by older versions
+
+    def __init__(self, location: str):
+        self.location = location
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Callers must hold the lock
+        if not self._connection:
+            self._connection = sqlite3.connect(self.location, timeout=30, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(self.schema)
+            for migration in self.migrations:
+                try:
+                    self._connection.execute(migration)
+                except sqlite3.OperationalError:
+                    pass  # The column exists already
+        return self._connection
+
+    @contextmanager
+    def _transaction(self):
+        # Holds the lock for the block, whose changes are committed at its end or rolled back on errors
+        with self._lock:
+            connection = self._connect()
+            try:
+                yield connection
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+
+    def _execute(self, query: str, parameters: tuple = ()) -> int:
+        # Returns the number of changed rows
+        with self._transaction() as connection:
+            return connection.execute(query, parameters).rowcount
+
+    def _select(self, query: str, parameters: tuple = ()) -> list:
+        with self._lock:
+            return self._connect().execute(query, parameters).fetchall()
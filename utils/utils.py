@@ -1,9 +1,12 @@
-import pickle, requests, errno, hashlib, math, os, re, operator
+import atexit, copy, pickle, requests, errno, hashlib, json, math, os, re, shutil, threading, time
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from PIL import Image, ImageChops
 from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
 from urllib3.util.retry import Retry
-from functools import reduce
+
+from utils.exceptions import DownloadCancelledError, DownloadIncompleteError
 
 
 def hash_string(input_str: str, hash_type: str = 'MD5'):
@@ -12,12 +15,47 @@ def hash_string(input_str: str, hash_type: str = 'MD5'):
     else:
         raise Exception('Invalid hash type selected')
 
+class ConnectionPoolManager:
+    # Every session created here shares the same adapter, which keeps one pool of keep-alive connections per host.
+    # That way the API and CDN requests of all modules and downloads reuse already open (TLS) connections
+    def __init__(self, pool_size=16, max_hosts=32):
+        self.pool_size, self.max_hosts = pool_size, max_hosts
+        self.adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=pool_size,
+                                   max_retries=Retry(total=10, backoff_factor=0.4, status_forcelist=[429, 500, 502, 503, 504]))
+
+    def set_pool_size(self, pool_size):
+        # Connections of the old pools are dropped, so only call this before downloading anything
+        if pool_size != self.pool_size:
+            self.pool_size = pool_size
+            self.adapter.poolmanager.clear()
+            self.adapter.init_poolmanager(self.max_hosts, pool_size)
+
+    def create_session(self):
+        session_ = requests.Session()
+        session_.mount('http://', self.adapter)
+        session_.mount('https://', self.adapter)
+        return session_
+
+    def get_metrics(self):
+        # requests - connections_opened is the number of requests that reused a kept alive connection
+        metrics = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if not pool: continue
+            idle_connections = sum(1 for connection in list(pool.pool.queue) if connection) if pool.pool else 0
+            metrics[f'{key.key_scheme}://{key.key_host}:{key.key_port}'] = {
+                'requests': pool.num_requests,
+                'connections_opened': pool.num_connections,
+                'idle_connections': idle_connections
+            }
+        return metrics
+
+
+connection_pool = ConnectionPoolManager()
+
 def create_requests_session():
-    session_ = requests.Session()
-    retries = Retry(total=10, backoff_factor=0.4, status_forcelist=[429, 500, 502, 503, 504])
-    session_.mount('http://', HTTPAdapter(max_retries=retries))
-    session_.mount('https://', HTTPAdapter(max_retries=retries))
-    return session_
+    return connection_pool.create_session()
 
 sanitise_name = lambda name : re.sub(r'[:]', ' - ', re.sub(r'[\\/*?"<>|$]', '', re.sub(r'[ \t]+$', '', str(name).rstrip()))) if name else ''
 
@@ -40,35 +78,326 @@ def fix_byte_limit(path: str, byte_limit=250):
 
 r_session = create_requests_session()
 
-def download_file(url, file_location, headers={}, enable_progress_bar=False, indent_level=0, artwork_settings=None):
+download_retries = 3
+# (connect, read) timeouts of file downloads, a connection that stops sending data is retried instead of hanging forever
+download_timeout = (30, 60)
+# Reads are sized to take about chunk_read_time seconds at the measured throughput, within these bounds
+min_chunk_size, max_chunk_size, chunk_read_time = 64 * 1024, 1024 ** 2, 0.25
+progress_update_interval = 0.1
+
+
+def _parse_content_range(content_range: str):
+    # "bytes 100-999/1000" -> (100, 1000), the total is None if the server doesn't know it
+    match = re.fullmatch(r'bytes (\d+)-\d+/(\d+|\*)', content_range.strip()) if content_range else None
+    if not match:
+        return None, None
+    return int(match.group(1)), int(match.group(2)) if match.group(2) != '*' else None
+
+
+class _ByteProgress:
+    # Progress of one file download, every update is passed on to the progress bar and the progress callback, which is
+    # called with the bytes done and the total bytes (None if unknown)
+    def __init__(self, total, initial, bar=None, callback=None):
+        self.total, self.done, self.bar, self.callback = total, initial, bar, callback
+        self.lock = threading.Lock()  # Segments update it from their own threads
+        if callback: callback(initial, total)
+
+    def update(self, length):
+        with self.lock:
+            self.done += length
+            done = self.done
+        if self.bar: self.bar.update(length)
+        if self.callback: self.callback(done, self.total)
+
+    def close(self):
+        if self.bar: self.bar.close()
+
+
+def _create_progress(total, initial, indent_level, enable_progress_bar, progress_callback):
+    # The bar needs the total, the callback also works without it
+    bar = _create_progress_bar(total, initial, indent_level) if enable_progress_bar and total else None
+    return _ByteProgress(total, initial, bar, progress_callback) if bar or progress_callback else None
+
+
+def _create_progress_bar(total, initial, indent_level):
+    try:
+        columns = os.get_terminal_size().columns
+        if os.name == 'nt':
+            return tqdm(total=total, unit='B', unit_scale=True, unit_divisor=1024, initial=initial, miniters=1, ncols=(columns-indent_level), bar_format=' '*indent_level + '{l_bar}{bar}{r_bar}')
+        else:
+            raise
+    except:
+        return tqdm(total=total, unit='B', unit_scale=True, unit_divisor=1024, initial=initial, miniters=1, bar_format=' '*indent_level + '{l_bar}{bar}{r_bar}')
+
+
+class JobControl:
+    # Shared by everything working on one download job. cancel() makes the job stop at the next track or chunk, and
+    # every track and chunk counts as activity so a watchdog can tell a stalled job from a slow one
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.last_activity = time.monotonic()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def check(self):
+        if self.cancelled.is_set(): raise DownloadCancelledError('The download was cancelled')
+
+    def get_idle_time(self):
+        return time.monotonic() - self.last_activity
+
+
+def _stream_to_file(r, f, limit=None, progress=None, on_chunk=None, stop=None, control=None):
+    # Copies the response body into f using large reads that adapt to the throughput, returns the bytes written
+    chunk_size, written, pending_progress = 256 * 1024, 0, 0
+    last_progress_update = time.monotonic()
+    while limit is None or written < limit:
+        if stop and stop.is_set(): break
+        if control: control.check()
+        read_started = time.monotonic()
+        try:
+            chunk = r.raw.read(chunk_size if limit is None else min(chunk_size, limit - written), decode_content=True)
+        except ProtocolError as e:  # Same translation iter_content does
+            raise requests.exceptions.ChunkedEncodingError(e)
+        except ReadTimeoutError as e:
+            raise requests.exceptions.ConnectionError(e)
+        if not chunk: break
+
+        f.write(chunk)
+        written += len(chunk)
+        if on_chunk: on_chunk(len(chunk))
+        if control: control.touch()
+
+        read_time = time.monotonic() - read_started
+        chunk_size = max(min_chunk_size, min(max_chunk_size, int(len(chunk) / max(read_time, 1e-6) * chunk_read_time)))
+
+        # Redrawing the bar costs more than reading a chunk, so only do it every progress_update_interval seconds
+        if progress:
+            pending_progress += len(chunk)
+            if read_started - last_progress_update >= progress_update_interval:
+                progress.update(pending_progress)
+                pending_progress, last_progress_update = 0, read_started
+    if progress and pending_progress: progress.update(pending_progress)
+    return written
+
+
+def _split_segments(total, segments):
+    # [start, end, bytes done] for every segment, end is inclusive like in the Range header
+    size = math.ceil(total / segments)
+    return [[start, min(start + size, total) - 1, 0] for start in range(0, total, size)]
+
+
+def _download_segments(url, part_location, meta_location, headers, meta, first_response, progress, control=None):
+    # Every segment is fetched over its own connection and written at its offset in the preallocated .part file
+    segments, total = meta['segments'], meta['total']
+    validator = meta.get('etag') or meta.get('last_modified')
+    changed, stop = threading.Event(), threading.Event()
+
+    def fetch_segment(segment, r=None):
+        start, end, done = segment
+        if start + done > end:
+            return
+        if not r:
+            range_headers = {**headers, 'Range': f'bytes={start + done}-{end}'}
+            if validator: range_headers['If-Range'] = validator
+            r = r_session.get(url, stream=True, headers=range_headers, verify=False, timeout=download_timeout)
+            range_start, range_total = _parse_content_range(r.headers.get('content-range'))
+            if r.status_code != 206 or range_start != start + done or range_total != total:
+                r.close()
+                changed.set()
+                stop.set()
+                raise DownloadIncompleteError(f'{url} changed while downloading it in segments')
+
+        def on_chunk(length):
+            segment[2] += length
+
+        remaining = end - start - done + 1
+        with r, open(part_location, 'r+b') as f:
+            f.seek(start + done)
+            # the limit matters for the first segment, which reuses the initial response carrying the whole file
+            remaining -= _stream_to_file(r, f, limit=remaining, progress=progress, on_chunk=on_chunk, stop=stop, control=control)
+        if stop.is_set(): return
+        if remaining > 0:
+            raise DownloadIncompleteError(f'Segment {start}-{end} of {url} is missing {remaining} bytes')
+
+    with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+        futures = [executor.submit(fetch_segment, segment, first_response if index == 0 else None) for index, segment in enumerate(segments)]
+        try:
+            for future in futures: future.result()
+        finally:
+            # Stops the other segments on errors and ^C, the progress so far is kept in the .part.json
+            stop.set()
+            for future in futures: future.cancel()
+            executor.shutdown(wait=True)
+            if changed.is_set():
+                # The file changed on the server, so none of the fetched bytes can be trusted
+                silentremove(meta_location)
+                silentremove(part_location)
+            else:
+                with open(meta_location, 'w') as f:
+                    json.dump(meta, f)
+
+    if sum(done for _, _, done in segments) != total:
+        raise DownloadIncompleteError(f'Got {sum(done for _, _, done in segments)} of {total} bytes from {url}')
+
+
+def _is_encoded(r):
+    return r.headers.get('content-encoding', 'identity').lower() != 'identity'
+
+
+def _download_part(url, part_location, meta_location, headers, enable_progress_bar, indent_level, segments, segment_threshold, control=None, progress_callback=None):
+    # The .part.json next to a partial download holds the validators needed to safely resume it
+    meta = {}
+    if os.path.isfile(part_location) and os.path.isfile(meta_location):
+        try:
+            with open(meta_location, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+
+    if meta.get('segments') and os.path.getsize(part_location) == meta['total']:
+        done = sum(done for _, _, done in meta['segments'])
+        progress = _create_progress(meta['total'], done, indent_level, enable_progress_bar, progress_callback)
+        try:
+            return _download_segments(url, part_location, meta_location, headers, meta, None, progress, control)
+        finally:
+            if progress: progress.close()
+    resume_from = os.path.getsize(part_location) if meta.get('total') and not meta.get('segments') else 0
+
+    r = None
+    if resume_from:
+        range_headers = {**headers, 'Range': f'bytes={resume_from}-'}
+        # If-Range makes the server send the whole file instead if it changed in the meantime
+        validator = meta.get('etag') or meta.get('last_modified')
+        if validator: range_headers['If-Range'] = validator
+        r = r_session.get(url, stream=True, headers=range_headers, verify=False, timeout=download_timeout)
+
+        if r.status_code == 416 and resume_from == meta['total']:
+            r.close()
+            return  # The previous run already got every byte
+        range_start, range_total = _parse_content_range(r.headers.get('content-range'))
+        if r.status_code != 206 or range_start != resume_from or range_total != meta['total'] or _is_encoded(r):
+            r.close()
+            r, resume_from = None, 0
+
+    if not r:
+        r = r_session.get(url, stream=True, headers=headers, verify=False, timeout=download_timeout)
+        # The Content-Length of an encoded response doesn't match the decoded bytes written, so those can't be resumed
+        total = int(r.headers['content-length']) if 'content-length' in r.headers and not _is_encoded(r) else None
+        meta = {'etag': r.headers.get('etag'), 'last_modified': r.headers.get('last-modified'), 'total': total}
+
+        if segments > 1 and total and total >= segment_threshold and r.headers.get('accept-ranges', '').lower() == 'bytes' \
+                and r.status_code == 200:
+            meta['segments'] = _split_segments(total, segments)
+            with open(part_location, 'wb') as f:
+                f.truncate(total)
+            with open(meta_location, 'w') as f:
+                json.dump(meta, f)
+            progress = _create_progress(total, 0, indent_level, enable_progress_bar, progress_callback)
+            try:
+                return _download_segments(url, part_location, meta_location, headers, meta, r, progress, control)
+            finally:
+                if progress: progress.close()
+
+        if total:
+            with open(meta_location, 'w') as f:
+                json.dump(meta, f)
+        else:
+            silentremove(meta_location)
+    total = meta['total']
+
+    progress = _create_progress(total, resume_from, indent_level, enable_progress_bar, progress_callback)
+    try:
+        with r, open(part_location, 'ab' if resume_from else 'wb') as f:
+            _stream_to_file(r, f, progress=progress, control=control)
+    finally:
+        if progress: progress.close()
+
+    if total and os.path.getsize(part_location) != total:
+        raise DownloadIncompleteError(f'Got {os.path.getsize(part_location)} of {total} bytes from {url}')
+
+
+class ArtworkCache:
+    # Artwork as it was saved after resizing, keyed by its URL and the artwork settings. Files are stored under the hash
+    # of that key and their mtime is bumped on every hit, so the least recently used ones are removed once the cache
+    # grows above max_size bytes
+    def __init__(self, location=os.path.join('config', 'artwork'), max_size=0):
+        self.location, self.max_size = location, max_size
+        self.lock = threading.Lock()
+        self.size = None  # Counted on the first store
+
+    def _get_path(self, url, artwork_settings):
+        key = json.dumps([url, artwork_settings], sort_keys=True)
+        return os.path.join(self.location, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def get(self, url, artwork_settings, file_location):
+        if not self.max_size: return False
+        cached_location = self._get_path(url, artwork_settings)
+        try:
+            shutil.copyfile(cached_location, file_location)
+            os.utime(cached_location)
+            return True
+        except FileNotFoundError:  # not cached, or evicted by another thread or process in between
+            silentremove(file_location)
+            return False
+
+    def store(self, url, artwork_settings, file_location):
+        if not self.max_size: return
+        os.makedirs(self.location, exist_ok=True)
+        cached_location = self._get_path(url, artwork_settings)
+        temp_location = f'{cached_location}.{os.getpid()}.{threading.get_ident()}.tmp'
+        shutil.copyfile(file_location, temp_location)
+        os.replace(temp_location, cached_location)
+
+        with self.lock:
+            if self.size is None:
+                self.size = sum(entry.stat().st_size for entry in os.scandir(self.location) if entry.is_file())
+            else:
+                self.size += os.path.getsize(cached_location)
+            if self.size > self.max_size: self._evict()
+
+    def _evict(self):
+        # Callers must hold the lock, this also corrects the size if other processes share the cache
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(self.location)
+                         if entry.is_file() and not entry.name.endswith('.tmp'))
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_size: break
+            silentremove(path)
+            self.size -= size
+
+
+artwork_cache = ArtworkCache()
+
+
+def download_file(url, file_location, headers=None, enable_progress_bar=False, indent_level=0, artwork_settings=None, segments=1, segment_threshold=0, control=None, progress_callback=None):
     if os.path.isfile(file_location):
         return None
+    # Modules leave TrackDownloadInfo.file_url_headers as None if they need none. Resuming and the size checks count
+    # the bytes as sent, so the file is asked for without content encoding unless the module's headers say otherwise
+    headers = {'Accept-Encoding': 'identity', **(headers or {})}
 
-    r = r_session.get(url, stream=True, headers=headers, verify=False)
+    # Artwork (anything with artwork_settings, {} caches an image without resizing it) is served from the artwork cache
+    if artwork_settings is not None and artwork_cache.get(url, artwork_settings, file_location):
+        return None
 
-    total = None
-    if 'content-length' in r.headers:
-        total = int(r.headers['content-length'])
+    # Data is written to a .part file which is only renamed once complete, so interrupted downloads can be resumed
+    part_location, meta_location = file_location + '.part', file_location + '.part.json'
 
     try:
-        with open(file_location, 'wb') as f:
-            if enable_progress_bar and total:
-                try:
-                    columns = os.get_terminal_size().columns
-                    if os.name == 'nt':
-                        bar = tqdm(total=total, unit='B', unit_scale=True, unit_divisor=1024, initial=0, miniters=1, ncols=(columns-indent_level), bar_format=' '*indent_level + '{l_bar}{bar}{r_bar}')
-                    else:
-                        raise
-                except:
-                    bar = tqdm(total=total, unit='B', unit_scale=True, unit_divisor=1024, initial=0, miniters=1, bar_format=' '*indent_level + '{l_bar}{bar}{r_bar}')
-                # bar.set_description(' '*indent_level)
-                for chunk in r.iter_content(chunk_size=1024):
-                    if chunk:  # filter out keep-alive new chunks
-                        f.write(chunk)
-                        bar.update(len(chunk))
-                bar.close()
-            else:
-                [f.write(chunk) for chunk in r.iter_content(chunk_size=1024) if chunk]
+        for attempt in range(1, download_retries + 1):
+            try:
+                # Files of at least segment_threshold bytes are fetched over several connections if the server allows ranges
+                _download_part(url, part_location, meta_location, headers, enable_progress_bar, indent_level, segments, segment_threshold, control, progress_callback)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout, DownloadIncompleteError):
+                if attempt == download_retries: raise
+        os.replace(part_location, file_location)
+        silentremove(meta_location)
+
         if artwork_settings and artwork_settings.get('should_resize', False):
             new_resolution = artwork_settings.get('resolution', 1400)
             new_format = artwork_settings.get('format', 'jpeg')
@@ -82,17 +411,33 @@ def download_file(url, file_location, headers={}, enable_progress_bar=False, ind
             with Image.open(file_location) as im:
                 im = im.resize((new_resolution, new_resolution), Image.Resampling.BICUBIC)
                 im.save(file_location, new_format, quality=new_compression)
+
+        if artwork_settings is not None: artwork_cache.store(url, artwork_settings, file_location)
     except KeyboardInterrupt:
-        if os.path.isfile(file_location):
-            print(f'\tDeleting partially downloaded file "{str(file_location)}"')
-            silentremove(file_location)
+        if os.path.isfile(part_location):
+            print(f'\tKeeping partially downloaded file "{str(part_location)}" to resume it later')
         raise KeyboardInterrupt
 
+def download_to_pipe(url, pipe, headers=None, control=None, progress_callback=None):
+    # Streams the response body into a pipe, f.e. the stdin of ffmpeg. Unlike download_file this can't be resumed
+    with r_session.get(url, stream=True, headers=headers or {}, verify=False, timeout=download_timeout) as r:
+        r.raise_for_status()
+        total = int(r.headers['content-length']) if 'content-length' in r.headers else None
+        _stream_to_file(r, pipe, progress=_create_progress(total, 0, 0, False, progress_callback), control=control)
+
+comparison_size = 64
+
+def _load_comparison_thumbnail(image_location):
+    with Image.open(image_location) as im:
+        im.draft('RGB', (comparison_size, comparison_size))  # lets the JPEG decoder skip most of the full resolution work
+        return im.convert('RGB').resize((comparison_size, comparison_size), Image.Resampling.BILINEAR)
+
 # root mean square code by Charlie Clark: https://code.activestate.com/recipes/577630-comparing-two-images/
 def compare_images(image_1, image_2):
-    with Image.open(image_1) as im1, Image.open(image_2) as im2:
-        h = ImageChops.difference(im1, im2).convert('L').histogram()
-        return math.sqrt(reduce(operator.add, map(lambda h, i: h*(i**2), h, range(256))) / (float(im1.size[0]) * im1.size[1]))
+    # Compares small thumbnails instead of the full images, which is a lot faster, ignores compression artifacts
+    # and also works if both images don't have the exact same resolution
+    h = ImageChops.difference(_load_comparison_thumbnail(image_1), _load_comparison_thumbnail(image_2)).convert('L').histogram()
+    return math.sqrt(sum(count * value ** 2 for value, count in enumerate(h)) / comparison_size ** 2)
 
 # TODO: check if not closing the files causes issues, and see if there's a way to use the context manager with lambda expressions
 get_image_resolution = lambda image_location : Image.open(image_location).size[0]
@@ -104,56 +449,152 @@ def silentremove(filename):
         if e.errno != errno.ENOENT:
             raise
 
-def read_temporary_setting(settings_location, module, root_setting=None, setting=None, global_mode=False):
-    temporary_settings = pickle.load(open(settings_location, 'rb'))
-    module_settings = temporary_settings['modules'][module] if module in temporary_settings['modules'] else None
-    
+class TemporarySettingsStore:
+    # Keeps loginstorage.bin in memory, changes are written back after write_delay seconds so bursts of token updates
+    # only cause a single write. Writes go to a temporary file which replaces the old one, so it is never left truncated.
+    # Other processes (f.e. the web interface next to the command line) write the same file, so it is read again once it
+    # changed on disk, and writing it only replaces the modules whose settings changed in this process
+    write_delay = 1.0
+
+    def __init__(self, location):
+        self.location = location
+        self.lock = threading.RLock()
+        self.data = None
+        self.write_timer = None
+        self.file_state = None  # (mtime, size) of the file when it was last read or written
+        self.changed_modules = set()  # Modules with changes that weren't written yet
+
+    def _get_file_state(self):
+        try:
+            stat = os.stat(self.location)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        # Callers must hold the lock
+        if self.data is None or self._get_file_state() != self.file_state:
+            self._reload()
+        return self.data
+
+    def _reload(self):
+        # Callers must hold the lock, the changes of this process that weren't written yet are kept
+        file_state, data = self._get_file_state(), {}
+        if file_state:
+            with open(self.location, 'rb') as f:
+                data = pickle.load(f)
+        if self.data is not None and self.changed_modules:
+            for module in self.changed_modules:
+                if module in self.data.get('modules', {}):
+                    data.setdefault('modules', {})[module] = self.data['modules'][module]
+        self.data, self.file_state = data, file_state
+
+    def mark_changed(self, module):
+        # Callers must hold the lock
+        self.changed_modules.add(module)
+        self.schedule_write()
+
+    def replace(self, data):
+        with self.lock:
+            self.data = data
+            self.changed_modules.clear()
+            self._write()
+
+    def schedule_write(self):
+        # Callers must hold the lock
+        if not self.write_timer:
+            self.write_timer = threading.Timer(self.write_delay, self.flush)
+            self.write_timer.daemon = True
+            self.write_timer.start()
+
+    def flush(self):
+        with self.lock:
+            if self.write_timer:
+                self.write_timer.cancel()
+                self.write_timer = None
+            if self.data is None: return
+            self.load()  # Merges in what other processes wrote in the meantime
+            self._write()
+
+    def _write(self):
+        # Callers must hold the lock
+        temp_location = f'{self.location}.{os.getpid()}.tmp'
+        with open(temp_location, 'wb') as f:
+            pickle.dump(self.data, f)
+        os.replace(temp_location, self.location)
+        self.file_state = self._get_file_state()
+        self.changed_modules.clear()
+
+
+_temporary_settings_stores = {}
+_temporary_settings_stores_lock = threading.Lock()
+
+
+def get_temporary_settings_store(settings_location):
+    with _temporary_settings_stores_lock:
+        key = os.path.abspath(settings_location)
+        if key not in _temporary_settings_stores:
+            _temporary_settings_stores[key] = TemporarySettingsStore(settings_location)
+        return _temporary_settings_stores[key]
+
+
+@atexit.register
+def flush_temporary_settings():
+    with _temporary_settings_stores_lock:
+        stores = list(_temporary_settings_stores.values())
+    for store in stores:
+        with store.lock:
+            if store.write_timer: store.flush()
+
+
+def _get_temporary_session(temporary_settings, module, global_mode):
+    module_settings = temporary_settings['modules'][module] if module in temporary_settings.get('modules', {}) else None
+
     if module_settings:
         if global_mode:
-            session = module_settings
+            return module_settings
         else:
-            session = module_settings['sessions'][module_settings['selected']]
+            return module_settings['sessions'][module_settings['selected']]
     else:
-        session = None
+        return None
 
-    if session and root_setting:
-        if setting:
-            return session[root_setting][setting] if root_setting in session and setting in session[root_setting] else None
+def read_temporary_setting(settings_location, module, root_setting=None, setting=None, global_mode=False):
+    store = get_temporary_settings_store(settings_location)
+    with store.lock:
+        session = _get_temporary_session(store.load(), module, global_mode)
+
+        # Copies, so callers can't change the stored session without going through set_temporary_setting
+        if session and root_setting:
+            if setting:
+                return copy.deepcopy(session[root_setting][setting]) if root_setting in session and setting in session[root_setting] else None
+            else:
+                return copy.deepcopy(session[root_setting]) if root_setting in session else None
+        elif root_setting and not session:
+            raise Exception('Module does not use temporary settings') 
         else:
-            return session[root_setting] if root_setting in session else None
-    elif root_setting and not session:
-        raise Exception('Module does not use temporary settings') 
-    else:
-        return session
+            return copy.deepcopy(session)
 
 def set_temporary_setting(settings_location, module, root_setting, setting=None, value=None, global_mode=False):
-    temporary_settings = pickle.load(open(settings_location, 'rb'))
-    module_settings = temporary_settings['modules'][module] if module in temporary_settings['modules'] else None
+    store = get_temporary_settings_store(settings_location)
+    with store.lock:
+        session = _get_temporary_session(store.load(), module, global_mode)
 
-    if module_settings:
-        if global_mode:
-            session = module_settings
+        if not session:
+            raise Exception('Module does not use temporary settings')
+        if setting:
+            session[root_setting][setting] = copy.deepcopy(value)
         else:
-            session = module_settings['sessions'][module_settings['selected']]
-    else:
-        session = None
-
-    if not session:
-        raise Exception('Module does not use temporary settings')
-    if setting:
-        session[root_setting][setting] = value
-    else:
-        session[root_setting] = value
-    pickle.dump(temporary_settings, open(settings_location, 'wb'))
+            session[root_setting] = copy.deepcopy(value)
+        store.mark_changed(module)
 
-create_temp_filename = lambda : f'temp/{os.urandom(16).hex()}'
+create_temp_filename = lambda directory='temp': f'{directory}/{os.urandom(16).hex()}'
 
-def save_to_temp(input: bytes):
-    location = create_temp_filename()
+def save_to_temp(input: bytes, directory='temp'):
+    location = create_temp_filename(directory)
     open(location, 'wb').write(input)
     return location
 
-def download_to_temp(url, headers={}, extension='', enable_progress_bar=False, indent_level=0):
-    location = create_temp_filename() + (('.' + extension) if extension else '')
-    download_file(url, location, headers=headers, enable_progress_bar=enable_progress_bar, indent_level=indent_level)
+def download_to_temp(url, headers=None, extension='', enable_progress_bar=False, indent_level=0, artwork_settings=None, directory='temp'):
+    location = create_temp_filename(directory) + (('.' + extension) if extension else '')
+    download_file(url, location, headers=headers, enable_progress_bar=enable_progress_bar, indent_level=indent_level, artwork_settings=artwork_settings)
     return location
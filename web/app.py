@@ -1,18 +1,16 @@
-from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for, session
+from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for, session, Response, stream_with_context
 from flask_wtf import FlaskForm
 from flask_wtf.csrf import CSRFProtect
-from wtforms import StringField, SelectField, BooleanField, SubmitField
-from wtforms.validators import DataRequired, URL
+from wtforms import StringField, SelectField, BooleanField, SubmitField, IntegerField
+from wtforms.validators import DataRequired, URL, Optional
 import os
 import json
 import sys
 import traceback
-import threading
 import time
-from queue import Queue
 import re
-from utils.events import event_manager, EventType
-from utils.progress import ProgressReporter
+from utils.events import EventType
+from web.job_store import JobStore, FINISHED_STATUSES
 import logging
 from utils.module_checker import ModuleCheckerRegistry, ModuleCheckResult
 
@@ -33,10 +31,7 @@ if parent_dir not in sys.path:
 
 # Try to import Orpheus modules
 try:
-    from orpheus.core import Orpheus
-    from orpheus.music_downloader import beauty_format_seconds
     from utils.models import MediaIdentification, DownloadTypeEnum, ModuleModes
-    from orpheus.core import orpheus_core_download
 except ImportError as e:
     print(f"Error importing Orpheus modules: {e}")
     print(f"Python path: {sys.path}")
@@ -49,115 +44,70 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('WEB_SECRET', 'orpheusdl-web-secret-key-2025')
 csrf = CSRFProtect(app)  # Initialize CSRF protection
 
-# Global variables for tracking download progress
-download_progress = {}
-download_status = {}
-download_messages = {}
-download_queue = []
-active_downloads = {}
-MAX_CONCURRENT_DOWNLOADS = 1  # Process one download at a time
+# Downloads are queued in the job store and run by the download executor (web/executor.py), a separate process, so
+# every web worker sees the same downloads and stays stateless. Only the executor loads Orpheus, which writes the
+# settings and login storage and logs in to the modules, the web workers read the module information it publishes in
+# the job store and queue commands for it
+job_store = JobStore()
 
 # Set default download path
 DEFAULT_DOWNLOAD_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'downloads')
 
-# Initialize Orpheus
-try:
-    # Ensure modules directory exists
-    modules_dir = os.path.join(parent_dir, 'modules')
-    os.makedirs(modules_dir, exist_ok=True)
-    
-    # Check if modules directory is empty
-    if not os.listdir(modules_dir):
-        print("Modules directory is empty. Please install at least one module.")
-        raise Exception("Modules directory is empty. Please install at least one module.")
-    
-    # Initialize Orpheus with proper module loading
-    orpheus_instance = Orpheus()
-    
-    # Verify modules are loaded
-    if not orpheus_instance.module_list:
-        print("No modules are installed. Please install at least one module.")
-        raise Exception("No modules are installed. Please install at least one module.")
-    
-    # Ensure settings are properly initialized
-    if not hasattr(orpheus_instance, 'settings') or not orpheus_instance.settings:
-        print("Settings not properly initialized, creating default settings")
-        orpheus_instance.settings = {
-            'global': {
-                'general': {
-                    'download_path': DEFAULT_DOWNLOAD_PATH,
-                    'download_quality': 'hifi',
-                    'search_limit': 10
-                },
-                'artist_downloading': {
-                    'return_credited_albums': True,
-                    'separate_tracks_skip_downloaded': True
-                },
-                'formatting': {
-                    'album_format': '{name}{explicit}',
-                    'track_filename_format': '{track_number}. {name}'
-                },
-                'advanced': {
-                    'proprietary_codecs': False,
-                    'spatial_codecs': True,
-                    'debug_mode': False,
-                    'disable_subscription_checks': False
-                }
-            },
-            'modules': {}
-        }
-    
-    # Ensure module_controls is properly initialized
-    if not hasattr(orpheus_instance, 'module_controls'):
-        print("module_controls not properly initialized, creating default module_controls")
-        orpheus_instance.module_controls = {
-            'module_list': orpheus_instance.module_list,
-            'module_settings': orpheus_instance.module_settings,
-            'loaded_modules': {},
-            'module_loader': orpheus_instance.load_module
-        }
-        
-except Exception as e:
-    print(f"Error initializing Orpheus: {e}")
-    traceback.print_exc()
-    
-    # Create a mock Orpheus instance for the web interface
-    class MockOrpheus:
-        def __init__(self):
-            self.module_list = []
-            self.module_settings = {}
-            self.module_netloc_constants = {}
-            self.settings = {
-                'global': {
-                    'general': {
-                        'download_path': DEFAULT_DOWNLOAD_PATH,
-                        'download_quality': 'hifi',
-                        'search_limit': 10
-                    },
-                    'formatting': {
-                        'album_format': '{name}{explicit}',
-                        'track_filename_format': '{track_number}. {name}'
-                    },
-                    'advanced': {
-                        'proprietary_codecs': False,
-                        'spatial_codecs': True,
-                        'debug_mode': False,
-                        'disable_subscription_checks': False
-                    }
-                },
-                'modules': {}
-            }
-            self.module_controls = {
-                'module_list': self.module_list,
-                'module_settings': self.module_settings,
-                'loaded_modules': {},
-                'module_loader': self.load_module
-            }
-        
-        def load_module(self, module_name):
-            raise Exception("No modules are installed. Please install at least one module.")
-    
-    orpheus_instance = MockOrpheus()
+SETTINGS_LOCATION = os.path.join('config', 'settings.json')
+
+# Seconds a web worker waits for the download executor to run a command, and between checks whether it has
+COMMAND_TIMEOUT = int(os.environ.get('WEB_COMMAND_TIMEOUT', 60))
+COMMAND_POLL_INTERVAL = 0.2
+
+# Shown on the settings page for sections that are missing from the settings file
+DEFAULT_GLOBAL_SETTINGS = {
+    'general': {
+        'download_path': DEFAULT_DOWNLOAD_PATH,
+        'download_quality': 'hifi',
+        'search_limit': 10
+    },
+    'formatting': {
+        'album_format': '{name}{explicit}',
+        'track_filename_format': '{track_number}. {name}'
+    },
+    'advanced': {
+        'proprietary_codecs': False,
+        'spatial_codecs': True,
+        'debug_mode': False,
+        'disable_subscription_checks': False
+    }
+}
+
+def get_modules():
+    """Get the module information the download executor published, there are no modules until it has loaded them."""
+    return job_store.get_state('modules') or {'module_list': [], 'module_netloc_constants': {}, 'service_names': {}}
+
+def read_settings():
+    """Read the settings file as it is, the download executor creates it with all defaults on its first start."""
+    if not os.path.exists(SETTINGS_LOCATION):
+        return {}
+    with open(SETTINGS_LOCATION, 'r') as f:
+        return json.load(f)
+
+def write_settings(settings):
+    """Write the settings file through a temporary file, so the executor never reads it half written."""
+    temp_location = SETTINGS_LOCATION + f'.{os.getpid()}.tmp'
+    with open(temp_location, 'w') as f:
+        json.dump(settings, f, indent=4)
+    os.replace(temp_location, SETTINGS_LOCATION)
+
+def run_executor_command(action, payload=None):
+    """Queue a command for the download executor and wait for its result, raises if it fails or takes too long."""
+    command_id = job_store.add_command(action, payload)
+    deadline = time.time() + COMMAND_TIMEOUT
+    while time.time() < deadline:
+        command = job_store.get_command(command_id)
+        if command.status == 'done':
+            return command.result
+        if command.status == 'error':
+            raise Exception(command.result)
+        time.sleep(COMMAND_POLL_INTERVAL)
+    raise Exception(f'The download executor did not answer within {COMMAND_TIMEOUT} seconds')
 
 class DownloadForm(FlaskForm):
     url = StringField('URL', validators=[DataRequired()])
@@ -165,6 +115,7 @@ class DownloadForm(FlaskForm):
     lyrics_module = SelectField('Lyrics Module', choices=[('default', 'Default')])
     covers_module = SelectField('Covers Module', choices=[('default', 'Default')])
     credits_module = SelectField('Credits Module', choices=[('default', 'Default')])
+    priority = IntegerField('Priority', default=0, validators=[Optional()])  # Higher priorities start first
 
 class SearchForm(FlaskForm):
     module = SelectField('Module', validators=[DataRequired()])
@@ -177,367 +128,43 @@ class SearchForm(FlaskForm):
     query = StringField('Query', validators=[DataRequired()])
     submit = SubmitField('Search')
 
-# Update form choices if Orpheus is initialized
-if orpheus_instance and hasattr(orpheus_instance, 'module_list') and orpheus_instance.module_list:
-    DownloadForm.lyrics_module.choices = [('default', 'Default')] + [(m, m) for m in orpheus_instance.module_list]
-    DownloadForm.covers_module.choices = [('default', 'Default')] + [(m, m) for m in orpheus_instance.module_list]
-    DownloadForm.credits_module.choices = [('default', 'Default')] + [(m, m) for m in orpheus_instance.module_list]
-    SearchForm.module.choices = [(m, m) for m in orpheus_instance.module_list]
-
-# Custom Oprinter class to capture progress
-class WebOprinter:
-    def __init__(self, download_id):
-        self.download_id = download_id
-        self.job_completed = False
-        self.total_items = 0
-        self.current_item = 0
-        self.last_progress = 0
-        self.last_update_time = time.time()
-        self.update_interval = 0.5  # Minimum time between progress updates in seconds
-        self.indent_number = 0  # Add indent_number attribute
-        self.messages = []  # Store messages for this download
-        self.completion_detected = False  # Flag to track if completion has been detected
-
-    def set_indent_number(self, number):
-        """Set the indent number for message formatting."""
-        self.indent_number = number
-
-    def oprint(self, message, level=0, drop_level=None):
-        """Print a message with optional indentation level and drop level.
-        
-        Args:
-            message (str): The message to print
-            level (int): The indentation level
-            drop_level (int, optional): The level to drop to after printing
-        """
-        # Add timestamp to message
-        timestamp = time.strftime("%H:%M:%S")
-        formatted_message = f"{timestamp} {message}"
-        
-        # Add message to the download's message list
-        if self.download_id not in download_messages:
-            download_messages[self.download_id] = []
-        download_messages[self.download_id].append(formatted_message)
-        
-        # Also store in local messages list
-        self.messages.append(formatted_message)
-        
-        # Print to console for debugging
-        print(formatted_message)
-
-        # Extract progress information from the message
-        progress_info = self._extract_progress_info(message)
-        if progress_info:
-            self._update_progress(*progress_info)
-            
-        # Check for completion messages
-        if ("Download completed" in message or "All downloads completed" in message) and not self.completion_detected:
-            self.completion_detected = True
-            self.job_completed = True
-            download_status[self.download_id] = "completed"
-            download_progress[self.download_id] = 100
-            print(f"Download {self.download_id} marked as completed")
-
-    def _extract_progress_info(self, message):
-        # Check for job completion messages
-        if "All downloads completed successfully" in message and not self.completion_detected:
-            self.completion_detected = True
-            self.job_completed = True
-            return (self.total_items, self.total_items, True)
-
-        # Check for total items information
-        total_match = re.search(r"Total items to download: (\d+)", message)
-        if total_match:
-            self.total_items = int(total_match.group(1))
-            return None
-
-        # Check for various progress patterns
-        patterns = [
-            r"Downloading (\d+)/(\d+)",  # General progress
-            r"Track (\d+)/(\d+)",        # Track progress
-            r"Album (\d+)/(\d+)",        # Album progress
-            r"Playlist (\d+)/(\d+)"      # Playlist progress
-        ]
-
-        for pattern in patterns:
-            match = re.search(pattern, message)
-            if match:
-                current = int(match.group(1))
-                total = int(match.group(2))
-                return (current, total, False)
-
-        return None
-
-    def _update_progress(self, current, total, is_completed):
-        # Update current item and total
-        self.current_item = current
-        self.total_items = max(self.total_items, total)
-
-        # Calculate progress percentage
-        if self.total_items > 0:
-            progress = int((self.current_item / self.total_items) * 100)
-        else:
-            progress = 0
-
-        # Only update if enough time has passed since the last update
-        current_time = time.time()
-        if (current_time - self.last_update_time >= self.update_interval or 
-            progress == 100 or 
-            progress - self.last_progress >= 5):
-            
-            # Update global tracking
-            download_progress[self.download_id] = progress
-            if is_completed or progress == 100:
-                self.completion_detected = True
-                self.job_completed = True
-                download_status[self.download_id] = "completed"
-                print(f"Download {self.download_id} marked as completed in _update_progress")
-            else:
-                download_status[self.download_id] = "running"
-
-            self.last_progress = progress
-            self.last_update_time = current_time
-
-# Function to run download in a separate thread
-def run_download(download_id, orpheus_instance, media_to_download, tpm, separate_download_module, output_path):
-    logger.debug(f"Starting download process for ID: {download_id}")
-    logger.debug(f"Media to download: {media_to_download}")
-    logger.debug(f"Third-party modules: {tpm}")
-    logger.debug(f"Separate download module: {separate_download_module}")
-    logger.debug(f"Output path: {output_path}")
-    
-    # Log module settings in detail
-    logger.debug("=== Module Settings ===")
-    for service_name in media_to_download:
-        logger.debug(f"Checking settings for service: {service_name}")
-        if service_name in orpheus_instance.settings.get('modules', {}):
-            module_settings = orpheus_instance.settings['modules'][service_name]
-            logger.debug(f"Module settings for {service_name}:")
-            for key, value in module_settings.items():
-                # Mask sensitive values
-                masked_value = "********" if key in ['password', 'client_secret', 'api_key'] else value
-                logger.debug(f"  {key}: {masked_value}")
-        else:
-            logger.warning(f"No settings found for module {service_name}")
-    logger.debug("=== End Module Settings ===")
-    
-    # Log module interface details
-    logger.debug("=== Module Interface Details ===")
-    for service_name in media_to_download:
-        try:
-            module = orpheus_instance.load_module(service_name)
-            logger.debug(f"Module interface for {service_name}:")
-            logger.debug(f"  Type: {type(module)}")
-            logger.debug(f"  Available methods: {[method for method in dir(module) if not method.startswith('_')]}")
-            logger.debug(f"  Has download method: {'download' in dir(module)}")
-            logger.debug(f"  Has download_album method: {'download_album' in dir(module)}")
-            logger.debug(f"  Has download_track method: {'download_track' in dir(module)}")
-            logger.debug(f"  Has download_playlist method: {'download_playlist' in dir(module)}")
-            logger.debug(f"  Has download_artist method: {'download_artist' in dir(module)}")
-        except Exception as e:
-            logger.error(f"Error inspecting module {service_name}: {str(e)}")
-    logger.debug("=== End Module Interface Details ===")
-    
-    # Set timeout for the download (5 minutes)
-    download_timeout = 300  # 5 minutes in seconds
-    start_time = time.time()
-    
-    try:
-        # Check module credentials before starting the download
-        for service_name in media_to_download:
-            if service_name in orpheus_instance.settings.get('modules', {}):
-                module_settings = orpheus_instance.settings['modules'][service_name]
-                logger.debug(f"Checking credentials for {service_name}")
-                check_result = ModuleCheckerRegistry.check_module(service_name, module_settings)
-                
-                if not check_result:
-                    error_message = f"Missing required credentials for {service_name}. Please check your settings."
-                    if check_result.missing_fields:
-                        error_message = f"Missing required fields for {service_name}: {', '.join(check_result.missing_fields)}. Please check your settings."
-                    if check_result.errors:
-                        error_message += f" Errors: {', '.join(check_result.errors)}"
-                    
-                    logger.error(error_message)
-                    orpheus_instance.report_error(error_message)
-                    download_status[download_id] = "error"
-                    if download_id not in download_messages:
-                        download_messages[download_id] = []
-                    download_messages[download_id].append(f"Error: {error_message}")
-                    download_progress[download_id] = 0
-                    return
-                else:
-                    logger.debug(f"Credentials check passed for {service_name}")
-        
-        # Set up progress reporter
-        logger.debug(f"Setting up progress reporter for download ID: {download_id}")
-        progress_reporter = orpheus_instance.set_progress_reporter(download_id)
-        
-        # Subscribe to events
-        logger.debug(f"Subscribing to events for download ID: {download_id}")
-        
-        def handle_event(event):
-            logger.debug(f"Event received for download ID {download_id}: {event.event_type} - {event.data}")
-            if event.event_type == EventType.PROGRESS:
-                download_progress[download_id] = event.data["progress"]
-                logger.debug(f"Progress updated for download ID {download_id}: {event.data['progress']}%")
-            elif event.event_type == EventType.MESSAGE:
-                if download_id not in download_messages:
-                    download_messages[download_id] = []
-                download_messages[download_id].append(event.data["message"])
-                logger.debug(f"Message for download ID {download_id}: {event.data['message']}")
-            elif event.event_type == EventType.STATUS:
-                download_status[download_id] = event.data["status"]
-                logger.debug(f"Status updated for download ID {download_id}: {event.data['status']}")
-            elif event.event_type == EventType.ERROR:
-                download_status[download_id] = "error"
-                if download_id not in download_messages:
-                    download_messages[download_id] = []
-                download_messages[download_id].append(f"Error: {event.data['error']}")
-                logger.error(f"Error for download ID {download_id}: {event.data['error']}")
-                # Ensure we mark the download as failed
-                download_progress[download_id] = 0
-            elif event.event_type == EventType.COMPLETE:
-                download_status[download_id] = "completed"
-                download_progress[download_id] = 100
-                logger.debug(f"Download ID {download_id} marked as completed")
-        
-        # Subscribe to all event types
-        for event_type in EventType:
-            event_manager.subscribe(download_id, event_type, handle_event)
-        
-        # Start the download
-        logger.debug(f"Starting download for ID: {download_id}")
-        orpheus_instance.report_status("starting")
-        
-        # Create a thread for the download
-        download_thread = threading.Thread(
-            target=orpheus_core_download,
-            args=(orpheus_instance, media_to_download, tpm, separate_download_module, output_path)
-        )
-        download_thread.daemon = True
-        download_thread.start()
-        
-        # Wait for the download to complete or timeout
-        while download_thread.is_alive():
-            # Check if we've exceeded the timeout
-            if time.time() - start_time > download_timeout:
-                logger.error(f"Download timed out for ID {download_id} after {download_timeout} seconds")
-                orpheus_instance.report_error(f"Download timed out after {download_timeout} seconds")
-                download_status[download_id] = "error"
-                if download_id not in download_messages:
-                    download_messages[download_id] = []
-                download_messages[download_id].append(f"Error: Download timed out after {download_timeout} seconds")
-                download_progress[download_id] = 0
-                break
-            
-            # Sleep for a short time to avoid busy waiting
-            time.sleep(1)
-        
-    except Exception as e:
-        logger.error(f"Exception in run_download for ID {download_id}: {str(e)}", exc_info=True)
-        # Ensure error is reported even if the exception occurs before event handling is set up
-        download_status[download_id] = "error"
-        if download_id not in download_messages:
-            download_messages[download_id] = []
-        download_messages[download_id].append(f"Critical error: {str(e)}")
-        download_progress[download_id] = 0
-        orpheus_instance.report_error(str(e))
-        print(f"Download error: {str(e)}")
-        traceback.print_exc()
-    finally:
-        # Clean up
-        logger.debug(f"Cleaning up for download ID: {download_id}")
-        for event_type in EventType:
-            event_manager.unsubscribe(download_id, event_type, handle_event)
-        event_manager.clear_events(download_id)
-        
-        # Remove from active downloads
-        if download_id in active_downloads:
-            logger.debug(f"Removing download ID {download_id} from active downloads")
-            del active_downloads[download_id]
-        
-        # Process next item in queue
-        logger.debug("Processing next item in queue")
-        process_queue()
-
-# Function to process the download queue
-def process_queue():
-    """Process the download queue and start new downloads if possible."""
-    logger.debug(f"Processing queue. Active downloads: {len(active_downloads)}, Queue length: {len(download_queue)}")
-    
-    # Check if we can start a new download
-    if len(active_downloads) < MAX_CONCURRENT_DOWNLOADS and download_queue:
-        # Get the next download from the queue
-        next_download = download_queue.pop(0)
-        download_id = next_download['download_id']
-        
-        logger.debug(f"Starting next download from queue. ID: {download_id}")
-        
-        # Start the download
-        active_downloads[download_id] = next_download
-        
-        # Update status to indicate it's starting
-        download_status[download_id] = "starting"
-        
-        # Start the download in a new thread
-        thread = threading.Thread(
-            target=run_download,
-            args=(
-                download_id, 
-                next_download['orpheus_instance'], 
-                next_download['media_to_download'], 
-                next_download['tpm'], 
-                next_download['separate_download_module'], 
-                next_download['output_path']
-            )
-        )
-        thread.daemon = True
-        thread.start()
-        
-        # Log that we're starting a new download
-        logger.debug(f"Started download thread for ID: {download_id}")
-    else:
-        logger.debug("No new downloads started. Queue empty or max concurrent downloads reached.")
+def create_download_form(module_list):
+    # The modules can change with every restart of the executor, so the choices are set for every request
+    form = DownloadForm()
+    for field in (form.lyrics_module, form.covers_module, form.credits_module):
+        field.choices = [('default', 'Default')] + [(m, m) for m in module_list]
+    return form
 
 @app.route('/')
 def index():
-    if not orpheus_instance or not hasattr(orpheus_instance, 'module_list') or not orpheus_instance.module_list:
+    modules = get_modules()
+    if not modules['module_list']:
         flash('No modules are installed. Please install at least one module to use OrpheusDL.', 'warning')
         return render_template('no_modules.html')
     
     return render_template('index.html', 
-                         modules=orpheus_instance.module_list,
-                         orpheus=orpheus_instance,
-                         form=DownloadForm())
+                         modules=modules['module_list'],
+                         service_names=modules['service_names'],
+                         form=create_download_form(modules['module_list']))
 
 @app.route('/search', methods=['GET', 'POST'])
 def search():
-    if not orpheus_instance or not hasattr(orpheus_instance, 'module_list') or not orpheus_instance.module_list:
+    module_list = get_modules()['module_list']
+    if not module_list:
         flash('No modules are installed. Please install at least one module to use OrpheusDL.', 'warning')
         return render_template('no_modules.html')
     
     form = SearchForm()
-    form.module.choices = [(module, module) for module in orpheus_instance.module_list]
+    form.module.choices = [(module, module) for module in module_list]
     
     if form.validate_on_submit():
         try:
-            module = orpheus_instance.load_module(form.module.data)
-            # Convert query type to lowercase before passing to module
-            query_type = DownloadTypeEnum[form.query_type.data.lower()]
-            items = module.search(query_type, form.query.data, limit=orpheus_instance.settings['global']['general']['search_limit'])
-            
-            results = []
-            for item in items:
-                result = {
-                    'name': item.name,
-                    'artists': item.artists,
-                    'year': item.year,
-                    'explicit': item.explicit,
-                    'duration': beauty_format_seconds(item.duration) if item.duration else None,
-                    'additional': item.additional
-                }
-                results.append(result)
-            
+            # The executor has the modules loaded and logged in, so it searches
+            results = run_executor_command('search', {
+                'module': form.module.data,
+                'query_type': form.query_type.data,
+                'query': form.query.data
+            })
             return jsonify(results)
         except Exception as e:
             return jsonify({'error': str(e)}), 400
@@ -548,11 +175,12 @@ def search():
 def download():
     logger.debug("Download endpoint called")
     
-    if not orpheus_instance or not hasattr(orpheus_instance, 'module_list') or not orpheus_instance.module_list:
+    modules = get_modules()
+    if not modules['module_list']:
         logger.error("No modules are installed")
         return jsonify({'error': 'No modules are installed. Please install at least one module to use OrpheusDL.'}), 500
     
-    form = DownloadForm()
+    form = create_download_form(modules['module_list'])
     
     # Debug information
     logger.debug(f"Form data: {request.form}")
@@ -563,13 +191,14 @@ def download():
     if form.validate_on_submit():
         try:
             url = form.url.data
-            output_path = form.output_path.data or orpheus_instance.settings['global']['general']['download_path']
+            settings = read_settings()
+            output_path = form.output_path.data or settings.get('global', {}).get('general', {}).get('download_path', DEFAULT_DOWNLOAD_PATH)
             
             logger.debug(f"Processing download request for URL: {url}")
             logger.debug(f"Output path: {output_path}")
             
-            # Prepare third-party modules
-            tpm = {}
+            # Prepare third-party modules, the ones left on default use the download module like on the command line
+            tpm = {ModuleModes.covers: '', ModuleModes.lyrics: '', ModuleModes.credits: ''}
             if form.lyrics_module.data and form.lyrics_module.data != 'default':
                 tpm[ModuleModes.lyrics] = form.lyrics_module.data
             if form.covers_module.data and form.covers_module.data != 'default':
@@ -589,9 +218,9 @@ def download():
             logger.debug(f"URL components: {components}")
             
             service_name = None
-            for pattern in orpheus_instance.module_netloc_constants:
+            for pattern in modules['module_netloc_constants']:
                 if re.findall(pattern, url_parsed.netloc):
-                    service_name = orpheus_instance.module_netloc_constants[pattern]
+                    service_name = modules['module_netloc_constants'][pattern]
                     break
                     
             logger.debug(f"Service name: {service_name}")
@@ -601,8 +230,8 @@ def download():
                 return jsonify({'error': f'URL location "{url_parsed.netloc}" is not found in modules!'}), 400
             
             # Check if the module has required credentials
-            if service_name in orpheus_instance.settings.get('modules', {}):
-                module_settings = orpheus_instance.settings['modules'][service_name]
+            if service_name in settings.get('modules', {}):
+                module_settings = settings['modules'][service_name]
                 check_result = ModuleCheckerRegistry.check_module(service_name, module_settings)
                 
                 if not check_result:
@@ -671,36 +300,26 @@ def download():
             
             logger.debug(f"Generated download ID: {download_id}")
             
-            # Initialize download tracking
-            download_progress[download_id] = 0
-            download_status[download_id] = "queued"
-            download_messages[download_id] = []
-            
-            # Add to queue
-            download_queue.append({
-                'download_id': download_id,
-                'orpheus_instance': orpheus_instance,
-                'media_to_download': media_to_download,
-                'tpm': tpm,
-                'separate_download_module': 'default' if media_type != DownloadTypeEnum.playlist else None,
-                'output_path': output_path,
-                'url': url,
-                'media_type': media_type.name,
-                'timestamp': time.time()
-            })
-            
-            logger.debug(f"Added download to queue. Queue length: {len(download_queue)}")
-            
-            # Process queue
-            process_queue()
+            # Add to queue, the download executor picks it up from the job store
+            job_store.add_download(
+                download_id,
+                media_to_download,
+                tpm,
+                'default' if media_type != DownloadTypeEnum.playlist else None,
+                output_path,
+                url=url,
+                media_type=media_type.name,
+                priority=form.priority.data or 0
+            )
             
-            logger.debug(f"Download queued successfully. ID: {download_id}")
+            queued_ids = [i.download_id for i in job_store.get_downloads('queued')]
+            logger.debug(f"Download queued successfully. ID: {download_id}, queue length: {len(queued_ids)}")
             
             return jsonify({
                 'success': True, 
                 'message': 'Download queued', 
                 'download_id': download_id,
-                'queue_position': len(download_queue)
+                'queue_position': queued_ids.index(download_id) + 1 if download_id in queued_ids else 0
             })
                 
         except Exception as e:
@@ -716,76 +335,31 @@ def get_progress(download_id):
     logger.debug(f"Progress request for download ID: {download_id}")
     
     try:
-        # Initialize response data
+        download = job_store.get_download(download_id)
+        if not download:
+            return jsonify({
+                'status': 'error',
+                'progress': 0,
+                'messages': ['Download not found']
+            }), 404
+        
         response_data = {
-            'status': 'unknown',
-            'progress': 0,
+            'status': download.status,
+            'progress': download.progress,
             'messages': []
         }
         
-        # Check if download exists in active_downloads
-        if download_id in active_downloads:
-            # Get all events for this download
-            events = event_manager.get_events(download_id)
-            logger.debug(f"Found {len(events)} events for download ID: {download_id}")
-            
-            # Get the latest progress event
-            progress_events = [e for e in events if e.event_type == EventType.PROGRESS]
-            if progress_events:
-                response_data['progress'] = progress_events[-1].data["progress"]
-            
-            # Get all messages
-            response_data['messages'] = [e.data["message"] for e in events if e.event_type == EventType.MESSAGE]
-            
-            # Get the latest status
-            status_events = [e for e in events if e.event_type == EventType.STATUS]
-            if status_events:
-                response_data['status'] = status_events[-1].data["status"]
-            
-            # Check for error events
-            error_events = [e for e in events if e.event_type == EventType.ERROR]
-            if error_events:
-                response_data['status'] = 'error'
-                # Add error messages if not already included
-                for error_event in error_events:
-                    error_msg = f"Error: {error_event.data['error']}"
-                    if error_msg not in response_data['messages']:
-                        response_data['messages'].append(error_msg)
-            
-            # Check for completion event
-            complete_events = [e for e in events if e.event_type == EventType.COMPLETE]
-            if complete_events:
-                response_data['status'] = 'completed'
-                response_data['progress'] = 100
-            
-            # If no events found and download is in active_downloads, it's still starting
-            if not events and response_data['status'] == 'unknown':
-                response_data['status'] = 'starting'
-                response_data['progress'] = 0
-                response_data['messages'] = ['Download is starting...']
-        else:
-            # Download is not in active_downloads, check if it was completed or failed
-            events = event_manager.get_events(download_id)
-            if events:
-                # Check for error events
-                error_events = [e for e in events if e.event_type == EventType.ERROR]
-                if error_events:
-                    response_data['status'] = 'error'
-                    response_data['messages'] = [f"Error: {e.data['error']}" for e in error_events]
-                # Check for completion event
-                elif any(e.event_type == EventType.COMPLETE for e in events):
-                    response_data['status'] = 'completed'
-                    response_data['progress'] = 100
-                else:
-                    # If we have events but no error or completion, mark as error
-                    response_data['status'] = 'error'
-                    response_data['messages'] = ['Download failed or was interrupted']
-            else:
-                # No events and not in active_downloads, mark as error
-                response_data['status'] = 'error'
-                response_data['messages'] = ['Download failed or was interrupted']
+        # Messages and errors in the order they happened
+        for event in job_store.get_events(download_id):
+            if event.event_type == EventType.MESSAGE:
+                response_data['messages'].append(event.data["message"])
+            elif event.event_type == EventType.ERROR:
+                response_data['messages'].append(f"Error: {event.data['error']}")
         
-        logger.debug(f"Progress for download ID {download_id}: {response_data}")
+        if download.status in ('queued', 'starting') and not response_data['messages']:
+            response_data['messages'] = ['Download is starting...']
+        
+        logger.debug(f"Progress for download ID {download_id}: {response_data['status']} {response_data['progress']}%")
         
         return jsonify(response_data)
     except Exception as e:
@@ -796,6 +370,61 @@ def get_progress(download_id):
             'messages': [f"Error retrieving progress: {str(e)}"]
         }), 500
 
+# Seconds between keep-alive comments on an idle progress stream
+PROGRESS_STREAM_KEEPALIVE = 15
+# Seconds between checks of the job store for new events of a streamed download
+PROGRESS_STREAM_POLL_INTERVAL = 0.5
+
+def format_progress_event(event):
+    """Format an event as a Server-Sent Event, its sequence number is the event ID."""
+    return f"id: {event.sequence}\nevent: {event.event_type.value}\ndata: {json.dumps(event.data)}\n\n"
+
+def is_progress_stream_finished(event):
+    return event.event_type in (EventType.COMPLETE, EventType.ERROR) or \
+        (event.event_type == EventType.STATUS and event.data.get('status') in FINISHED_STATUSES)
+
+@app.route('/progress/<download_id>/stream')
+def stream_progress(download_id):
+    """Stream the events of a download as Server-Sent Events.
+
+    Only events newer than the Last-Event-ID header (or the lastEventId query parameter) are sent, so a reconnecting
+    browser continues where it left off instead of receiving everything again.
+    """
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('lastEventId') or 0)
+    except ValueError:
+        last_event_id = 0
+
+    def generate():
+        # The events are written to the job store by the download executor, which can't notify this process
+        sent_id, idle_time = last_event_id, 0
+        while True:
+            # The status is read before the events, so the events of a download that just finished are still sent
+            download = job_store.get_download(download_id)
+            events = job_store.get_events(download_id, after=sent_id)
+            for event in events:
+                sent_id = event.sequence
+                yield format_progress_event(event)
+                if is_progress_stream_finished(event):
+                    return
+
+            if events:
+                idle_time = 0
+            elif not download or download.status in FINISHED_STATUSES:
+                # Finished without a final event, f.e. when it got cancelled while queued
+                status = download.status if download else 'error'
+                yield f"event: status\ndata: {json.dumps({'status': status})}\n\n"
+                return
+            elif idle_time >= PROGRESS_STREAM_KEEPALIVE:
+                idle_time = 0
+                yield ": keep-alive\n\n"
+
+            time.sleep(PROGRESS_STREAM_POLL_INTERVAL)
+            idle_time += PROGRESS_STREAM_POLL_INTERVAL
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/queue')
 def queue():
     return render_template('queue.html')
@@ -806,64 +435,42 @@ def get_queue():
     try:
         # Format active downloads
         active = []
-        for download_id, download in active_downloads.items():
+        for download in job_store.get_downloads('starting', 'running'):
             active.append({
-                'download_id': download_id,
-                'filename': download.get('url', 'Unknown'),
-                'size': download.get('size', 0),
-                'progress': download_progress.get(download_id, 0),
-                'status': download_status.get(download_id, 'unknown'),
-                'timestamp': download.get('timestamp', time.time())
+                'download_id': download.download_id,
+                'filename': download.url or 'Unknown',
+                'size': 0,
+                'progress': download.progress,
+                'status': download.status,
+                'timestamp': download.created
             })
         
-        # Format queued downloads
+        # Format queued downloads, in the order they would start if no service was busy
         queued = []
-        for i, download in enumerate(download_queue):
+        for i, download in enumerate(job_store.get_downloads('queued')):
             queued.append({
-                'download_id': download.get('download_id', f'queued_{i}'),
-                'filename': download.get('url', 'Unknown'),
-                'size': download.get('size', 0),
+                'download_id': download.download_id,
+                'filename': download.url or 'Unknown',
+                'size': 0,
                 'progress': 0,
                 'status': 'queued',
-                'timestamp': download.get('timestamp', time.time()),
+                'timestamp': download.created,
                 'queue_position': i + 1
             })
         
         # Get completed downloads from the last 10 minutes
         completed = []
         current_time = time.time()
-        
-        # First, check for downloads that are marked as completed in download_status
-        for download_id, status in list(download_status.items()):
-            if status == 'completed':
-                # Check if this is a recently completed download
-                if download_id in active_downloads:
-                    download = active_downloads[download_id]
-                    # Only include downloads completed in the last 10 minutes
-                    if current_time - download.get('timestamp', current_time) < 600:  # 10 minutes
-                        completed.append({
-                            'download_id': download_id,
-                            'filename': download.get('url', 'Unknown'),
-                            'size': download.get('size', 0),
-                            'progress': 100,
-                            'status': 'completed',
-                            'timestamp': download.get('timestamp', current_time)
-                        })
-        
-        # Also check for downloads that have 100% progress but might not be marked as completed
-        for download_id, progress in list(download_progress.items()):
-            if progress == 100 and download_id in active_downloads and download_id not in [c['download_id'] for c in completed]:
-                download = active_downloads[download_id]
-                # Only include downloads completed in the last 10 minutes
-                if current_time - download.get('timestamp', current_time) < 600:  # 10 minutes
-                    completed.append({
-                        'download_id': download_id,
-                        'filename': download.get('url', 'Unknown'),
-                        'size': download.get('size', 0),
-                        'progress': 100,
-                        'status': 'completed',
-                        'timestamp': download.get('timestamp', current_time)
-                    })
+        for download in job_store.get_downloads('completed'):
+            if current_time - download.updated < 600:  # 10 minutes
+                completed.append({
+                    'download_id': download.download_id,
+                    'filename': download.url or 'Unknown',
+                    'size': 0,
+                    'progress': 100,
+                    'status': 'completed',
+                    'timestamp': download.updated
+                })
         
         # Log queue status for debugging
         print(f"Queue status: {len(active)} active, {len(queued)} queued, {len(completed)} completed")
@@ -880,89 +487,43 @@ def get_queue():
 @app.route('/api/queue/<download_id>/cancel', methods=['POST'])
 def cancel_download(download_id):
     try:
-        # Check if download is active
-        if download_id in active_downloads:
-            # Mark as cancelled
-            download_status[download_id] = 'cancelled'
-            # Remove from active downloads
-            del active_downloads[download_id]
+        # A queued download is cancelled right away, an active one stops at its next track or chunk once the download
+        # executor sees the request
+        if job_store.request_cancel(download_id):
             return jsonify({'status': 'success'})
         
-        # Check if download is in queue
-        for i, download in enumerate(download_queue):
-            if download.get('download_id') == download_id:
-                # Remove from queue
-                download_queue.pop(i)
-                return jsonify({'status': 'success'})
-        
         return jsonify({'error': 'Download ID not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/settings')
 def settings():
-    if not orpheus_instance or not hasattr(orpheus_instance, 'module_list') or not orpheus_instance.module_list:
+    module_list = get_modules()['module_list']
+    if not module_list:
         flash('No modules are installed. Please install at least one module to use OrpheusDL.', 'warning')
         return render_template('no_modules.html')
     
     # Check if settings editing is enabled
     enable_editing = os.environ.get('ENABLE_EDITING', '').lower() == 'true'
     
-    # Ensure settings has all required sections
-    if 'global' not in orpheus_instance.settings:
-        orpheus_instance.settings['global'] = {}
-    
-    if 'general' not in orpheus_instance.settings['global']:
-        orpheus_instance.settings['global']['general'] = {
-            'download_path': DEFAULT_DOWNLOAD_PATH,
-            'download_quality': 'hifi',
-            'search_limit': 10
-        }
-    
-    if 'formatting' not in orpheus_instance.settings['global']:
-        orpheus_instance.settings['global']['formatting'] = {
-            'album_format': '{name}{explicit}',
-            'track_filename_format': '{track_number}. {name}'
-        }
-    
-    if 'advanced' not in orpheus_instance.settings['global']:
-        orpheus_instance.settings['global']['advanced'] = {
-            'proprietary_codecs': False,
-            'spatial_codecs': True,
-            'debug_mode': False,
-            'disable_subscription_checks': False
-        }
-    
-    if 'modules' not in orpheus_instance.settings:
-        orpheus_instance.settings['modules'] = {}
-    
-    # Create a backup of settings before saving
-    settings_backup_path = os.path.join(os.path.dirname(orpheus_instance.settings_location), 'settings.backup.json')
+    # Only shown, the settings file is written when they are saved
     try:
-        with open(settings_backup_path, 'w') as f:
-            json.dump(orpheus_instance.settings, f, indent=4)
+        settings = read_settings()
     except Exception as e:
-        app.logger.error(f"Error creating settings backup: {str(e)}")
+        app.logger.error(f"Error reading settings: {str(e)}")
+        settings = {}
     
-    # Save the updated settings
-    try:
-        with open(orpheus_instance.settings_location, 'w') as f:
-            json.dump(orpheus_instance.settings, f, indent=4)
-    except Exception as e:
-        app.logger.error(f"Error saving settings: {str(e)}")
-        # Try to restore from backup if save failed
-        try:
-            if os.path.exists(settings_backup_path):
-                with open(settings_backup_path, 'r') as f:
-                    orpheus_instance.settings = json.load(f)
-        except Exception as backup_error:
-            app.logger.error(f"Error restoring settings from backup: {str(backup_error)}")
+    # Ensure settings has all required sections
+    settings.setdefault('global', {})
+    for section, defaults in DEFAULT_GLOBAL_SETTINGS.items():
+        settings['global'].setdefault(section, dict(defaults))
+    settings.setdefault('modules', {})
     
     # Check module credentials
     module_status = {}
-    for module in orpheus_instance.module_list:
-        if module in orpheus_instance.settings.get('modules', {}):
-            module_settings = orpheus_instance.settings['modules'][module]
+    for module in module_list:
+        if module in settings['modules']:
+            module_settings = settings['modules'][module]
             check_result = ModuleCheckerRegistry.check_module(module, module_settings)
             module_status[module] = {
                 'is_valid': check_result.is_valid,
@@ -977,8 +538,8 @@ def settings():
             }
     
     return render_template('settings.html', 
-                         settings=orpheus_instance.settings,
-                         modules=orpheus_instance.module_list,
+                         settings=settings,
+                         modules=module_list,
                          enable_editing=enable_editing,
                          module_status=module_status)
 
@@ -993,25 +554,23 @@ def no_modules():
 @app.route('/api/settings', methods=['POST'])
 def update_settings():
     try:
-        if not orpheus_instance:
-            return jsonify({'success': False, 'error': 'Orpheus instance not initialized'}), 500
-
         # Check if settings editing is enabled
         if os.environ.get('ENABLE_EDITING', '').lower() != 'true':
             return jsonify({'success': False, 'error': 'Settings editing is disabled. Set ENABLE_EDITING=true to enable.'}), 403
 
         new_settings = request.get_json()
+        # The settings file is read again, another worker or the executor could have changed it since the page loaded
+        current_settings = read_settings()
         
         # Create a backup of current settings before updating
-        settings_backup_path = os.path.join(os.path.dirname(orpheus_instance.settings_location), 'settings.backup.json')
+        settings_backup_path = os.path.join(os.path.dirname(SETTINGS_LOCATION), 'settings.backup.json')
         try:
             with open(settings_backup_path, 'w') as f:
-                json.dump(orpheus_instance.settings, f, indent=4)
+                json.dump(current_settings, f, indent=4)
         except Exception as e:
             app.logger.error(f"Error creating settings backup: {str(e)}")
             return jsonify({'success': False, 'error': f'Error creating settings backup: {str(e)}'}), 500
         
-        # Update the settings in the Orpheus instance
         # We need to do a deep merge instead of a simple update
         def deep_merge(d1, d2):
             for k, v in d2.items():
@@ -1020,22 +579,16 @@ def update_settings():
                 else:
                     d1[k] = v
         
-        deep_merge(orpheus_instance.settings, new_settings)
+        deep_merge(current_settings, new_settings)
         
-        # Save settings to file
+        # Save settings to file, the old file stays untouched if this fails
         try:
-            with open(orpheus_instance.settings_location, 'w') as f:
-                json.dump(orpheus_instance.settings, f, indent=4)
+            write_settings(current_settings)
         except Exception as e:
-            # Try to restore from backup if save failed
-            try:
-                if os.path.exists(settings_backup_path):
-                    with open(settings_backup_path, 'r') as f:
-                        orpheus_instance.settings = json.load(f)
-            except Exception as backup_error:
-                app.logger.error(f"Error restoring settings from backup: {str(backup_error)}")
             return jsonify({'success': False, 'error': f'Error saving settings: {str(e)}'}), 500
         
+        # The executor loads Orpheus again with the new settings, running downloads finish with the old ones
+        job_store.add_command('reload_settings')
         return jsonify({'success': True})
     except Exception as e:
         app.logger.error(f"Error updating settings: {str(e)}")
@@ -1044,19 +597,10 @@ def update_settings():
 @app.route('/api/restart', methods=['POST'])
 def restart_module():
     try:
-        if not orpheus_instance:
-            return jsonify({'success': False, 'error': 'Orpheus instance not initialized'}), 500
-
-        # Reload all modules
-        for module in orpheus_instance.module_list:
-            try:
-                if module in orpheus_instance.loaded_modules:
-                    del orpheus_instance.loaded_modules[module]
-                orpheus_instance.load_module(module)
-            except Exception as e:
-                app.logger.error(f"Error reloading module {module}: {str(e)}")
-                # Continue with other modules even if one fails
-                continue
+        # The modules are only loaded in the download executor, which reloads them for every web worker
+        result = run_executor_command('restart')
+        for module, error in result['errors'].items():
+            app.logger.error(f"Error reloading module {module}: {error}")
 
         return jsonify({'success': True})
     except Exception as e:
@@ -1066,9 +610,6 @@ def restart_module():
 @app.route('/health')
 def health_check():
     """Health check endpoint for Docker/container orchestration."""
-    if not orpheus_instance:
-        return jsonify({'status': 'error', 'message': 'Orpheus instance not initialized'}), 500
-    
     return jsonify({'status': 'ok'}), 200
 
 if __name__ == '__main__':
@@ -0,0 +1,298 @@
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+# Add parent directory to Python path to allow importing modules
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if parent_dir not in sys.path:
+    sys.path.insert(0, parent_dir)
+
+from orpheus.core import Orpheus, orpheus_core_download
+from orpheus.music_downloader import beauty_format_seconds
+from utils.events import event_manager, EventType, DownloadEvent
+from utils.exceptions import DownloadCancelledError
+from utils.models import DownloadTypeEnum
+from utils.module_checker import ModuleCheckerRegistry
+from utils.progress import ProgressReporter
+from utils.utils import JobControl
+from web.job_store import JobStore, JOB_STORE_LOCATION
+from web.scheduler import DownloadScheduler
+
+logger = logging.getLogger('orpheus-executor')
+
+def parse_service_limits(value):
+    """Parse per-service concurrency limits like "qobuz=1,tidal=2"."""
+    service_limits = {}
+    for item in filter(None, (i.strip() for i in value.split(','))):
+        service, limit = item.split('=', 1)
+        service_limits[service.strip().lower()] = int(limit)
+    return service_limits
+
+# How many downloads run at the same time, and how many of them may use the same service
+DOWNLOAD_WORKERS = int(os.environ.get('WEB_DOWNLOAD_WORKERS', 4))
+SERVICE_LIMIT = int(os.environ.get('WEB_SERVICE_LIMIT', 1))
+SERVICE_LIMITS = parse_service_limits(os.environ.get('WEB_SERVICE_LIMITS', ''))
+# Seconds without any downloaded data or events after which a download counts as stalled and gets cancelled
+STALL_TIMEOUT = int(os.environ.get('WEB_STALL_TIMEOUT', 300))
+# How many messages of every download are kept for the progress page
+MAX_MESSAGES = int(os.environ.get('WEB_MAX_MESSAGES', 1000))
+# Seconds between checks of the job store for new and cancelled downloads and commands of the web workers
+POLL_INTERVAL = 0.5
+# Seconds finished downloads are kept in the job store
+FINISHED_RETENTION = 24 * 60 * 60
+
+
+class DownloadExecutor:
+    """Runs the downloads queued in the job store.
+
+    Only a single executor runs next to the web workers, so the modules are loaded and logged in to once and the
+    service limits hold for every download, no matter which web worker queued it. The web workers don't load Orpheus
+    at all, they read the module information the executor publishes in the job store and queue commands for
+    everything that needs the modules, see run_command.
+    """
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self.active_downloads = {}  # download_id -> JobControl of the running downloads
+        self.scheduler = DownloadScheduler(self.run_download, workers=DOWNLOAD_WORKERS, service_limits=SERVICE_LIMITS,
+                                           default_service_limit=SERVICE_LIMIT)
+        self._orpheus = None
+        self._orpheus_lock = threading.Lock()
+
+    def get_orpheus(self) -> Orpheus:
+        """Get the Orpheus instance, created on first use and again by the restart and reload_settings commands."""
+        with self._orpheus_lock:
+            if not self._orpheus:
+                self._load_orpheus()
+            return self._orpheus
+
+    def _load_orpheus(self):
+        # Callers must hold the lock. Running downloads keep the instance they started with
+        logger.debug("Loading Orpheus for the download executor")
+        self._orpheus = Orpheus()
+        self.store.set_state('modules', {
+            'module_list': sorted(self._orpheus.module_list),
+            'module_netloc_constants': self._orpheus.module_netloc_constants,
+            'service_names': {module: info.service_name for module, info in self._orpheus.module_settings.items()}
+        })
+
+    def run(self):
+        """Run the queued downloads and commands until the process stops."""
+        event_manager.max_messages = MAX_MESSAGES
+        # The module information of an earlier executor is outdated, the web workers wait for this one's
+        self.store.set_state('modules', None)
+        self.scheduler.start()
+        self.resume_unfinished_jobs()
+
+        last_cleanup = 0
+        while True:
+            for download in self.store.take_new_downloads():
+                self.scheduler.submit({
+                    'download_id': download.download_id,
+                    'media_to_download': download.request['media_to_download'],
+                    'tpm': download.request['third_party_modules'],
+                    'separate_download_module': download.request['separate_download_module'],
+                    'output_path': download.request['output_path']
+                }, priority=download.priority)
+
+            # Commands may take a while, f.e. searches or logging in to every module again, so they don't hold up the queue
+            for command in self.store.take_commands():
+                threading.Thread(target=self.run_command, args=(command,), daemon=True).start()
+
+            for download_id in self.store.take_cancel_requests():
+                # A download that is neither queued nor active yet sees its cancelled status once it starts
+                if not self.scheduler.cancel(download_id) and download_id in self.active_downloads:
+                    self.active_downloads[download_id].cancel()
+
+            if time.time() - last_cleanup > 60 * 60:
+                self.store.remove_finished(time.time() - FINISHED_RETENTION)
+                last_cleanup = time.time()
+
+            time.sleep(POLL_INTERVAL)
+
+    def run_command(self, command):
+        """Run a command queued by a web worker and store its result.
+
+        restart loads Orpheus again and logs in to every module, reload_settings loads Orpheus again after the settings
+        were edited and search searches a module, its payload has the module, query_type and query.
+        """
+        logger.debug(f"Running {command.action} command {command.command_id}")
+        try:
+            if command.action in ('restart', 'reload_settings'):
+                with self._orpheus_lock:
+                    self._load_orpheus()
+                    orpheus_instance = self._orpheus
+                errors = {}
+                if command.action == 'restart':
+                    for module in orpheus_instance.module_list:
+                        try:
+                            orpheus_instance.load_module(module)
+                        except Exception as e:
+                            logger.error(f"Error reloading module {module}: {str(e)}")
+                            errors[module] = str(e)
+                self.store.finish_command(command.command_id, {'errors': errors})
+            elif command.action == 'search':
+                orpheus_instance = self.get_orpheus()
+                module = orpheus_instance.load_module(command.payload['module'])
+                items = module.search(DownloadTypeEnum[command.payload['query_type'].lower()], command.payload['query'],
+                                      limit=orpheus_instance.settings['global']['general']['search_limit'])
+                self.store.finish_command(command.command_id, [{
+                    'name': item.name,
+                    'artists': item.artists,
+                    'year': item.year,
+                    'explicit': item.explicit,
+                    'duration': beauty_format_seconds(item.duration) if item.duration else None,
+                    'additional': item.additional
+                } for item in items])
+            else:
+                self.store.finish_command(command.command_id, error=f'Unknown command "{command.action}"')
+        except Exception as e:
+            logger.error(f"Error running {command.action} command {command.command_id}: {str(e)}", exc_info=True)
+            self.store.finish_command(command.command_id, error=str(e))
+
+    def resume_unfinished_jobs(self):
+        """Queue the jobs that were still running when the executor stopped, they continue from their last unfinished track."""
+        self.store.requeue_unfinished()
+
+        # Jobs of downloads that are gone from the store, or were started from the command line, are queued as well.
+        # Only running jobs whose process is gone are taken, failed jobs are left alone as they would most likely fail
+        # again, and command line jobs that are still running keep running in their own process
+        for job in self.get_orpheus().journal.get_orphaned_jobs():
+            if self.store.get_download(job.job_id):
+                continue
+
+            logger.debug(f"Resuming interrupted download ID: {job.job_id}")
+            media_to_download = job.request['media_to_download']
+            self.store.add_download(
+                job.job_id, media_to_download, job.request['third_party_modules'], job.request['separate_download_module'],
+                job.request['output_path'],
+                url=', '.join(f'{service}: {media.media_id}' for service, items in media_to_download.items() for media in items),
+                media_type=', '.join(media.media_type.name for items in media_to_download.values() for media in items),
+                created=job.created
+            )
+
+    def run_download(self, job):
+        """Run a download taken from the queue, called from a scheduler worker thread."""
+        download_id = job['download_id']
+        media_to_download = job['media_to_download']
+        logger.debug(f"Starting download process for ID: {download_id}")
+        logger.debug(f"Media to download: {media_to_download}")
+        logger.debug(f"Third-party modules: {job['tpm']}")
+        logger.debug(f"Separate download module: {job['separate_download_module']}")
+        logger.debug(f"Output path: {job['output_path']}")
+
+        # Lets the download be cancelled and shows whether it still makes progress
+        control = JobControl()
+        self.active_downloads[download_id] = control
+
+        def report(event_type, data):
+            event_manager.emit(DownloadEvent(download_id, event_type, data))
+
+        # Every event of the download ends up in the job store, where the web workers read them from
+        def handle_event(event):
+            control.touch()
+            self.store.add_event(event)
+            if event.event_type == EventType.ERROR:
+                logger.error(f"Error for download ID {download_id}: {event.data['error']}")
+
+        for event_type in EventType:
+            event_manager.subscribe(download_id, event_type, handle_event)
+
+        try:
+            # It could have been cancelled between leaving the queue and becoming active
+            download = self.store.get_download(download_id)
+            if not download or download.status == 'cancelled':
+                return
+
+            orpheus_instance = self.get_orpheus()
+            report(EventType.STATUS, {'status': 'starting'})
+
+            # Check module credentials before starting the download
+            for service_name in media_to_download:
+                if service_name in orpheus_instance.settings.get('modules', {}):
+                    module_settings = orpheus_instance.settings['modules'][service_name]
+                    logger.debug(f"Checking credentials for {service_name}")
+                    check_result = ModuleCheckerRegistry.check_module(service_name, module_settings)
+
+                    if not check_result:
+                        error_message = f"Missing required credentials for {service_name}. Please check your settings."
+                        if check_result.missing_fields:
+                            error_message = f"Missing required fields for {service_name}: {', '.join(check_result.missing_fields)}. Please check your settings."
+                        if check_result.errors:
+                            error_message += f" Errors: {', '.join(check_result.errors)}"
+
+                        report(EventType.ERROR, {'error': error_message})
+                        return
+                    else:
+                        logger.debug(f"Credentials check passed for {service_name}")
+                else:
+                    logger.warning(f"No settings found for module {service_name}")
+
+            # Turns the structured progress of the downloader into progress events with the throughput and ETA
+            progress_reporter = ProgressReporter(download_id)
+
+            download_errors = []
+            def download():
+                try:
+                    orpheus_core_download(orpheus_instance, media_to_download, job['tpm'], job['separate_download_module'],
+                                          job['output_path'], download_id, control, progress_callback=progress_reporter.handle_progress)
+                except DownloadCancelledError:
+                    logger.debug(f"Download ID {download_id} stopped after being cancelled")
+                except Exception as e:
+                    download_errors.append(e)
+
+            # Create a thread for the download
+            download_thread = threading.Thread(target=download)
+            download_thread.daemon = True
+            download_thread.start()
+            report(EventType.STATUS, {'status': 'running'})
+
+            # Wait for the download to complete, it only counts as stalled if neither data nor events arrived for a while
+            stalled = False
+            while download_thread.is_alive():
+                download_thread.join(1)
+                if not control.cancelled.is_set() and control.get_idle_time() > STALL_TIMEOUT:
+                    logger.error(f"Download stalled for ID {download_id}, no progress for {STALL_TIMEOUT} seconds")
+                    report(EventType.ERROR, {'error': f"Download stalled, no progress for {STALL_TIMEOUT} seconds"})
+                    stalled = True
+                    # Keep waiting until the download has stopped, so its queue slot isn't freed while it still runs
+                    control.cancel()
+
+            if download_errors:
+                raise download_errors[0]
+            if control.cancelled.is_set():
+                if not stalled:
+                    report(EventType.STATUS, {'status': 'cancelled'})
+            else:
+                report(EventType.COMPLETE, {'progress': 100})
+
+        except Exception as e:
+            logger.error(f"Exception in run_download for ID {download_id}: {str(e)}", exc_info=True)
+            report(EventType.ERROR, {'error': f"Critical error: {str(e)}"})
+            traceback.print_exc()
+        finally:
+            # Clean up
+            logger.debug(f"Cleaning up for download ID: {download_id}")
+            for event_type in EventType:
+                event_manager.unsubscribe(download_id, event_type, handle_event)
+            event_manager.clear_events(download_id)
+            del self.active_downloads[download_id]
+
+
+def main():
+    # Run from the OrpheusDL root like the web interface does
+    os.chdir(parent_dir)
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    DownloadExecutor(JobStore(JOB_STORE_LOCATION, MAX_MESSAGES)).run()
+
+if __name__ == '__main__':
+    main()
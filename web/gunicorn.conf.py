@@ -0,0 +1,13 @@
+# Gunicorn hooks of the web interface: the web workers only queue and watch downloads through the job store, the
+# downloads themselves run in a single executor process that lives as long as the Gunicorn master
+import subprocess
+import sys
+
+
+def on_starting(server):
+    server.download_executor = subprocess.Popen([sys.executable, '-m', 'web.executor'])
+
+
+def on_exit(server):
+    server.download_executor.terminate()
+    server.download_executor.wait()
@@ -0,0 +1,219 @@
+import json
+import os
+import pickle
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from utils.events import DownloadEvent, EventType, LOGGED_EVENT_TYPES
+from utils.sqlite_store import SQLiteStore
+
+# Both the web workers and the download executor run from the OrpheusDL root
+JOB_STORE_LOCATION = os.path.join('config', 'web.db')
+
+# Statuses of downloads that won't change anymore
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+
+
+@dataclass
+class Download:
+    download_id: str
+    status: str  # queued, starting, running, completed, error or cancelled
+    priority: int
+    request: dict  # The orpheus_core_download arguments, see JobStore.add_download
+    url: str
+    media_type: str
+    progress: int
+    created: float
+    updated: float
+
+
+@dataclass
+class Command:
+    command_id: int
+    action: str  # restart, reload_settings or search, see DownloadExecutor.run_command
+    payload: dict
+    status: str  # queued, running, done or error
+    result: object  # What the executor returned, or the error message
+    created: float
+
+
+class JobStore(SQLiteStore):
+    """Downloads of the web interface and their events, shared through SQLite.
+
+    Every web worker process and the download executor open the same database, so a download queued through one worker
+    can be watched and cancelled through any other while the executor runs it. Only the executor loads Orpheus, it
+    publishes the module information the web workers need as state and runs the commands they queue.
+    """
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS downloads (
+            download_id TEXT PRIMARY KEY, status TEXT, priority INTEGER, request BLOB, url TEXT, media_type TEXT,
+            progress INTEGER, dispatched INTEGER, cancel_requested INTEGER, created REAL, updated REAL
+        );
+        CREATE TABLE IF NOT EXISTS events (
+            download_id TEXT, sequence INTEGER, event_type TEXT, data TEXT, timestamp REAL,
+            PRIMARY KEY (download_id, sequence)
+        );
+        CREATE TABLE IF NOT EXISTS commands (
+            command_id INTEGER PRIMARY KEY AUTOINCREMENT, action TEXT, payload TEXT, status TEXT, result TEXT,
+            created REAL, updated REAL
+        );
+        CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT, updated REAL);
+    '''
+
+    def __init__(self, location: str = JOB_STORE_LOCATION, max_messages: int = 1000):
+        super().__init__(location)
+        self.max_messages = max_messages  # How many messages and errors are kept per download
+
+    @staticmethod
+    def _to_download(row) -> Download:
+        return Download(row[0], row[1], row[2], pickle.loads(row[3]), row[4], row[5], row[6], row[7], row[8])
+
+    _download_columns = 'download_id, status, priority, request, url, media_type, progress, created, updated'
+
+    def add_download(self, download_id: str, media_to_download: dict, third_party_modules: dict,
+                     separate_download_module: Optional[str], output_path: str, url: str, media_type: str,
+                     priority: int = 0, created: Optional[float] = None):
+        """Queue a download for the executor, an existing download with the same ID is queued again."""
+        # Pickled for the same reason as the requests in the job journal
+        request = dict(media_to_download=media_to_download, third_party_modules=third_party_modules,
+                       separate_download_module=separate_download_module, output_path=output_path)
+        now = time.time()
+        self._execute('INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0, ?, ?)',
+                      (download_id, 'queued', priority, pickle.dumps(request), url, media_type, 0, created or now, now))
+
+    def get_download(self, download_id: str) -> Optional[Download]:
+        rows = self._select(f'SELECT {self._download_columns} FROM downloads WHERE download_id = ?', (download_id,))
+        return self._to_download(rows[0]) if rows else None
+
+    def get_downloads(self, *statuses: str) -> List[Download]:
+        """Get the downloads with any of the statuses, in the order the executor starts them."""
+        rows = self._select(f'SELECT {self._download_columns} FROM downloads WHERE status IN ({", ".join("?" * len(statuses))}) '
+                            'ORDER BY priority DESC, created', statuses)
+        return [self._to_download(row) for row in rows]
+
+    def take_new_downloads(self) -> List[Download]:
+        """Get the queued downloads the executor didn't take yet, and mark them as taken."""
+        with self._transaction() as connection:
+            rows = connection.execute(f'SELECT {self._download_columns} FROM downloads '
+                                      "WHERE status = 'queued' AND dispatched = 0 ORDER BY created").fetchall()
+            connection.executemany('UPDATE downloads SET dispatched = 1 WHERE download_id = ?', [(row[0],) for row in rows])
+        return [self._to_download(row) for row in rows]
+
+    def requeue_unfinished(self):
+        """Queue the downloads again that were queued or running when the executor stopped, commands it was running fail."""
+        with self._transaction() as connection:
+            connection.execute('UPDATE downloads SET status = ?, dispatched = 0, cancel_requested = 0, updated = ? '
+                               f'WHERE status NOT IN ({", ".join("?" * len(FINISHED_STATUSES))})', ('queued', time.time(), *FINISHED_STATUSES))
+            connection.execute("UPDATE commands SET status = 'error', result = ?, updated = ? WHERE status = 'running'",
+                               (json.dumps('The download executor stopped while running the command'), time.time()))
+
+    def set_status(self, download_id: str, status: str):
+        self._execute('UPDATE downloads SET status = ?, updated = ? WHERE download_id = ?', (status, time.time(), download_id))
+
+    def request_cancel(self, download_id: str) -> bool:
+        """Ask the executor to cancel a download, returns whether it was still queued or running."""
+        with self._transaction() as connection:
+            row = connection.execute('SELECT status FROM downloads WHERE download_id = ?', (download_id,)).fetchone()
+            if not row or row[0] in FINISHED_STATUSES:
+                return False
+            # A queued download is cancelled right away, the executor only has to drop it from its queue
+            status = 'cancelled' if row[0] == 'queued' else row[0]
+            connection.execute('UPDATE downloads SET status = ?, cancel_requested = 1, updated = ? WHERE download_id = ?',
+                               (status, time.time(), download_id))
+        return True
+
+    def take_cancel_requests(self) -> List[str]:
+        """Get the IDs of the downloads that should be cancelled, and mark the requests as handled."""
+        with self._transaction() as connection:
+            rows = connection.execute('SELECT download_id FROM downloads WHERE cancel_requested = 1').fetchall()
+            connection.executemany('UPDATE downloads SET cancel_requested = 0 WHERE download_id = ?', rows)
+        return [row[0] for row in rows]
+
+    def add_event(self, event: DownloadEvent) -> int:
+        """Store an event of a download and update its status and progress, returns the event's sequence number."""
+        # The sequence continues over executor restarts, so reconnecting progress streams never miss events
+        status, progress = None, None
+        if event.event_type is EventType.PROGRESS:
+            progress = event.data['progress']
+        elif event.event_type is EventType.STATUS:
+            status = event.data['status']
+        elif event.event_type is EventType.ERROR:
+            status, progress = 'error', 0
+        elif event.event_type is EventType.COMPLETE:
+            status, progress = 'completed', 100
+
+        with self._transaction() as connection:
+            sequence = connection.execute('SELECT COALESCE(MAX(sequence), 0) + 1 FROM events WHERE download_id = ?',
+                                          (event.download_id,)).fetchone()[0]
+            # Of the event types that aren't logged only the latest event is kept
+            keep = self.max_messages if event.event_type in LOGGED_EVENT_TYPES else 1
+            connection.execute('INSERT INTO events VALUES (?, ?, ?, ?, ?)',
+                               (event.download_id, sequence, event.event_type.value, json.dumps(event.data), event.timestamp))
+            connection.execute('DELETE FROM events WHERE download_id = ? AND event_type = ? AND sequence <= ?',
+                               (event.download_id, event.event_type.value, sequence - keep))
+            connection.execute('UPDATE downloads SET status = COALESCE(?, status), progress = COALESCE(?, progress), updated = ? '
+                               'WHERE download_id = ?', (status, progress, time.time(), event.download_id))
+        event.sequence = sequence
+        return sequence
+
+    def get_events(self, download_id: str, event_type: EventType = None, after: int = 0) -> List[DownloadEvent]:
+        """Get the kept events of a download newer than the sequence number after, in the order they were added."""
+        query = 'SELECT event_type, data, timestamp, sequence FROM events WHERE download_id = ? AND sequence > ?'
+        parameters = (download_id, after)
+        if event_type:
+            query, parameters = query + ' AND event_type = ?', parameters + (event_type.value,)
+        rows = self._select(query + ' ORDER BY sequence', parameters)
+        return [DownloadEvent(download_id, EventType(row[0]), json.loads(row[1]), row[2], row[3]) for row in rows]
+
+    def get_latest_event(self, download_id: str, event_type: EventType) -> Optional[DownloadEvent]:
+        rows = self._select('SELECT event_type, data, timestamp, sequence FROM events WHERE download_id = ? AND event_type = ? '
+                            'ORDER BY sequence DESC LIMIT 1', (download_id, event_type.value))
+        return DownloadEvent(download_id, EventType(rows[0][0]), json.loads(rows[0][1]), rows[0][2], rows[0][3]) if rows else None
+
+    def add_command(self, action: str, payload: dict = None) -> int:
+        """Queue a command for the executor, returns its ID."""
+        now = time.time()
+        with self._transaction() as connection:
+            return connection.execute('INSERT INTO commands (action, payload, status, created, updated) VALUES (?, ?, ?, ?, ?)',
+                                      (action, json.dumps(payload or {}), 'queued', now, now)).lastrowid
+
+    _command_columns = 'command_id, action, payload, status, result, created'
+
+    @staticmethod
+    def _to_command(row) -> Command:
+        return Command(row[0], row[1], json.loads(row[2]), row[3], json.loads(row[4]) if row[4] else None, row[5])
+
+    def get_command(self, command_id: int) -> Optional[Command]:
+        rows = self._select(f'SELECT {self._command_columns} FROM commands WHERE command_id = ?', (command_id,))
+        return self._to_command(rows[0]) if rows else None
+
+    def take_commands(self) -> List[Command]:
+        """Get the queued commands in the order they were added, and mark them as running."""
+        with self._transaction() as connection:
+            rows = connection.execute(f"SELECT {self._command_columns} FROM commands WHERE status = 'queued' ORDER BY command_id").fetchall()
+            connection.executemany("UPDATE commands SET status = 'running' WHERE command_id = ?", [(row[0],) for row in rows])
+        return [self._to_command(row) for row in rows]
+
+    def finish_command(self, command_id: int, result=None, error: str = None):
+        """Store the result of a command, or the error it failed with."""
+        self._execute('UPDATE commands SET status = ?, result = ?, updated = ? WHERE command_id = ?',
+                      ('error' if error else 'done', json.dumps(error or result), time.time(), command_id))
+
+    def set_state(self, key: str, value):
+        """Publish a JSON serialisable value, f.e. the module information of the executor."""
+        self._execute('INSERT OR REPLACE INTO state VALUES (?, ?, ?)', (key, json.dumps(value), time.time()))
+
+    def get_state(self, key: str, default=None):
+        rows = self._select('SELECT value FROM state WHERE key = ?', (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def remove_finished(self, before: float):
+        """Remove the downloads and commands that finished before a timestamp, with the events of the downloads."""
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM commands WHERE status IN ('done', 'error') AND updated < ?", (before,))
+            statuses = ", ".join("?" * len(FINISHED_STATUSES))
+            connection.execute(f'DELETE FROM events WHERE download_id IN (SELECT download_id FROM downloads '
+                               f'WHERE status IN ({statuses}) AND updated < ?)', (*FINISHED_STATUSES, before))
+            connection.execute(f'DELETE FROM downloads WHERE status IN ({statuses}) AND updated < ?', (*FINISHED_STATUSES, before))
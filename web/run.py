@@ -16,5 +16,11 @@ if __name__ == '__main__':
     print(f"Starting OrpheusDL web interface from: {os.getcwd()}")
     print(f"Python path: {sys.path}")
     
+    # The development server is a single process, so the download executor runs in it as well
+    import threading
+    from web.executor import DownloadExecutor, MAX_MESSAGES
+    from web.job_store import JobStore, JOB_STORE_LOCATION
+    threading.Thread(target=DownloadExecutor(JobStore(JOB_STORE_LOCATION, MAX_MESSAGES)).run, name='download-executor', daemon=True).start()
+    
     # Disable Flask reloader to prevent the restart issue
     app.run(debug=True, host='0.0.0.0', use_reloader=False) 
\ No newline at end of file
@@ -0,0 +1,106 @@
+import heapq
+import itertools
+import logging
+import threading
+
+logger = logging.getLogger('orpheus-scheduler')
+
+
+class DownloadScheduler:
+    """Runs queued downloads on a pool of worker threads.
+
+    Jobs with a higher priority start first, jobs with the same priority in the order they were queued. A job only
+    starts once every service it downloads from is below its concurrency limit, jobs of other services can pass it
+    in the meantime.
+    """
+
+    def __init__(self, run_job, workers=1, service_limits=None, default_service_limit=1):
+        self.run_job = run_job  # Called with the job dict from a worker thread
+        self.workers = workers
+        self.service_limits = service_limits or {}
+        self.default_service_limit = default_service_limit
+        self._queue = []  # Heap of (-priority, sequence, download_id)
+        self._jobs = {}  # Queued jobs by download_id, cancelled jobs are only removed from here and skipped in the heap
+        self._running_services = {}  # Service -> number of running jobs downloading from it
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads."""
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'download-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.debug(f"Started {self.workers} download workers, service limits: {self.service_limits}")
+
+    def submit(self, job, priority=0):
+        """Queue a job, a dict with at least download_id and media_to_download."""
+        with self._condition:
+            self._jobs[job['download_id']] = job
+            heapq.heappush(self._queue, (-priority, next(self._sequence), job['download_id']))
+            self._condition.notify()
+
+    def cancel(self, download_id):
+        """Remove a queued job, returns whether it was queued."""
+        with self._condition:
+            return self._jobs.pop(download_id, None) is not None
+
+    def is_queued(self, download_id):
+        with self._condition:
+            return download_id in self._jobs
+
+    def get_queued(self):
+        """Get the queued jobs in the order they would start if no service was busy."""
+        with self._condition:
+            return [self._jobs[entry[2]] for entry in sorted(self._queue) if entry[2] in self._jobs]
+
+    def get_service_limit(self, service):
+        return self.service_limits.get(service, self.default_service_limit)
+
+    @staticmethod
+    def _get_services(job):
+        services = set(job['media_to_download'])
+        separate_download_module = job.get('separate_download_module')
+        if separate_download_module and separate_download_module != 'default':
+            services.add(separate_download_module)
+        return services
+
+    def _take_job(self):
+        # Callers must hold the condition. Pops the first job whose services all have a free slot, the jobs that were
+        # passed over keep their place
+        passed_over, job = [], None
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            if entry[2] not in self._jobs:
+                continue  # Cancelled
+            services = self._get_services(self._jobs[entry[2]])
+            if all(self._running_services.get(i, 0) < self.get_service_limit(i) for i in services):
+                job = self._jobs.pop(entry[2])
+                for service in services:
+                    self._running_services[service] = self._running_services.get(service, 0) + 1
+                break
+            passed_over.append(entry)
+
+        for entry in passed_over:
+            heapq.heappush(self._queue, entry)
+        return job
+
+    def _work(self):
+        while True:
+            with self._condition:
+                job = self._take_job()
+                while job is None:
+                    self._condition.wait()
+                    job = self._take_job()
+
+            try:
+                self.run_job(job)
+            except Exception as e:
+                logger.error(f"Error running download ID {job['download_id']}: {str(e)}", exc_info=True)
+            finally:
+                with self._condition:
+                    for service in self._get_services(job):
+                        self._running_services[service] -= 1
+                    # A finished job can unblock queued jobs of its services for any waiting worker
+                    self._condition.notify_all()